@@ -0,0 +1,1214 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+import tools.indexing.index_dropbox_qdrant as idx
+
+REAL_DELETE_POINTS_BATCH = idx.delete_points_batch
+REAL_EMBED_TEXTS = idx.embed_texts
+
+
+@pytest.fixture()
+def indexer_env(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Dict[str, Any]:
+    root = tmp_path / "Dropbox"
+    root.mkdir()
+    for i in range(7):
+        (root / f"note_{i}.txt").write_text(f"note number {i} " * 20, encoding="utf-8")
+
+    monkeypatch.setattr(idx, "STATE_DB", str(tmp_path / "state.sqlite"))
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    monkeypatch.setattr(idx, "OCR_SIDECAR_DIR", str(tmp_path / "ocr"))
+    monkeypatch.setattr(idx, "DEDUP_FILES", False)
+
+    upserts: List[List[Dict[str, Any]]] = []
+
+    def fake_embed(provider: str, texts: List[str], cache: Any):
+        return [[float(len(t)), 1.0] for t in texts], [None] * len(texts)
+
+    monkeypatch.setattr(idx, "embed_texts", fake_embed)
+    monkeypatch.setattr(idx, "upsert_batch", lambda points: upserts.append(list(points)))
+    deletes: List[List[str]] = []
+    monkeypatch.setattr(idx, "delete_points_for_paths", lambda paths: deletes.append(list(paths)))
+    batch_deletes: List[Any] = []
+    monkeypatch.setattr(idx, "delete_points_batch", lambda stale, paths: batch_deletes.append((list(stale), list(paths))))
+    monkeypatch.setattr(idx, "fetch_prev_vectors", lambda path: {})
+
+    conn = idx.ensure_state_db()
+    stats = idx.RunStats()
+    audit = idx.AuditLog(str(tmp_path / "audit.jsonl"))
+    writer = idx.BatchWriter(conn, None, "cfg", "run", audit, stats, batch_size=2)
+    yield {"root": root, "conn": conn, "stats": stats, "writer": writer, "upserts": upserts, "deletes": deletes, "batch_deletes": batch_deletes}
+    audit.close()
+    conn.close()
+
+
+def _complete_paths(conn) -> List[str]:
+    return sorted(r[0] for r in conn.execute("SELECT path FROM file_state WHERE complete = 1 AND cfg_hash = 'cfg'"))
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_sequential_and_pipeline_index_every_file(indexer_env: Dict[str, Any], pipelined: bool) -> None:
+    env = indexer_env
+    roots = [str(env["root"])]
+    if pipelined:
+        report = idx.run_pipeline(roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+        assert set(report["queues"]) == {"extract", "embed", "commit"}
+        assert report["queues"]["commit"]["items"] >= 7
+    else:
+        idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+
+    expected = sorted(str(p) for p in env["root"].iterdir())
+    assert _complete_paths(env["conn"]) == expected
+    assert sorted(p["payload"]["path"] for batch in env["upserts"] for p in batch) == expected
+    assert env["stats"].get("files_indexed") == len(expected)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_max_files_counts_files_taken_for_indexing_in_both_modes(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, pipelined: bool) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "MAX_FILES", 3)
+    roots = [str(env["root"])]
+    if pipelined:
+        idx.run_pipeline(roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    else:
+        idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    assert len(_complete_paths(env["conn"])) == 3
+
+
+def test_pipeline_failed_upsert_does_not_advance_state(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+
+    def boom(points):
+        raise RuntimeError("qdrant down")
+
+    monkeypatch.setattr(idx, "upsert_batch", boom)
+    with pytest.raises(RuntimeError):
+        idx.run_pipeline([str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    assert _complete_paths(env["conn"]) == []
+
+
+def test_pipeline_commit_stage_releases_write_lock_while_embedding_is_slow(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "DEDUP_FILES", True)  # the walker writes content_sig through its own connection
+    first = env["root"].parent / "Inbox"  # roots are walked in order, so this file reaches embed first
+    first.mkdir()
+    failed = first / "failed.txt"
+    failed.write_text("no vector for this one " * 20, encoding="utf-8")
+    probes: List[bool] = []
+
+    def slow_embed(provider: str, texts: List[str], cache: Any):
+        if any("no vector" in t for t in texts):
+            return [None] * len(texts), ["embedding_failed"] * len(texts)
+        if not probes:
+            # The failed file's state row must become visible, and no write lock may be held while we stall.
+            probe = sqlite3.connect(idx.STATE_DB, timeout=0)
+            try:
+                deadline = time.time() + 10
+                while not probe.execute("SELECT 1 FROM file_state WHERE path = ?", (str(failed),)).fetchone():
+                    assert time.time() < deadline, "state row of the failed file was never committed"
+                    time.sleep(0.05)
+                probe.execute("BEGIN IMMEDIATE")
+                probe.rollback()
+                probes.append(True)
+            finally:
+                probe.close()
+        return [[float(len(t)), 1.0] for t in texts], [None] * len(texts)
+
+    monkeypatch.setattr(idx, "embed_texts", slow_embed)
+    idx.run_pipeline([str(first), str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    assert probes == [True]
+    assert len(_complete_paths(env["conn"])) == 7
+    assert env["conn"].execute("SELECT complete FROM file_state WHERE path = ?", (str(failed),)).fetchone() == (0,)
+
+
+def test_embed_cache_key_changes_with_vector_affecting_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    base = idx.embed_model_key("ollama")
+    assert base.startswith(f"ollama:{idx.OLLAMA_MODEL}:")
+    monkeypatch.setattr(idx, "OLLAMA_USE_BATCH", not idx.OLLAMA_USE_BATCH)
+    legacy = idx.embed_model_key("ollama")
+    monkeypatch.setattr(idx, "OLLAMA_TRUNCATE", not idx.OLLAMA_TRUNCATE)
+    untruncated = idx.embed_model_key("ollama")
+    monkeypatch.setattr(idx, "EMBED_MAX_CHARS", idx.EMBED_MAX_CHARS + 1)
+    assert len({base, legacy, untruncated, idx.embed_model_key("ollama")}) == 4
+
+
+def test_extract_pool_times_out_stuck_file_and_keeps_going(indexer_env: Dict[str, Any]) -> None:
+    env = indexer_env
+    # Reading a FIFO with no writer blocks forever inside the worker process.
+    stuck = env["root"] / "stuck.txt"
+    os.mkfifo(stuck)
+    pool = idx.ExtractPool(2, timeout_s=3)
+    try:
+        report = idx.run_pipeline(
+            [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"], pool
+        )
+    finally:
+        pool.close()
+    env["writer"].flush()
+
+    assert report["extract_pool"]["timeouts"] == 1
+    assert report["extract_pool"]["restarts"] >= 1
+    sources = {p["payload"]["path"]: p["payload"]["text_source"] for batch in env["upserts"] for p in batch}
+    assert sources[str(stuck)] == "extract_timeout"
+    assert len(_complete_paths(env["conn"])) == 8
+
+
+def test_extract_pool_kill_takes_down_a_hung_pdftotext(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    env = indexer_env
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    pid_file = tmp_path / "pdftotext.pid"
+    fake = bin_dir / "pdftotext"
+    fake.write_text(f"#!/bin/sh\necho $$ > {pid_file}\nexec sleep 60\n", encoding="utf-8")
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")  # inherited by the workers
+    hung = env["root"] / "hung.pdf"
+    hung.write_bytes(b"%PDF-1.4 fake")
+    pool = idx.ExtractPool(2, timeout_s=3)
+    try:
+        report = idx.run_pipeline(
+            [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"], pool
+        )
+    finally:
+        pool.close()
+
+    assert report["extract_pool"]["timeouts"] == 1
+    pid = int(pid_file.read_text().strip())
+    deadline = time.time() + 5
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            break
+        stat_file = Path(f"/proc/{pid}/stat")
+        if stat_file.exists() and stat_file.read_text().split(") ")[1][0] == "Z":
+            break  # killed, waiting for its new parent to reap it
+        assert time.time() < deadline, "pdftotext kept running after the worker was killed"
+        time.sleep(0.1)
+
+
+def test_persistent_embed_cache_survives_restart(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    calls: List[List[str]] = []
+
+    def fake_ollama(texts: List[str]) -> List[List[float]]:
+        calls.append(list(texts))
+        return [[0.5, float(len(t)), -1.25] for t in texts]
+
+    monkeypatch.setattr(idx, "embed_texts_ollama_modern", fake_ollama)
+    db = str(tmp_path / "embed_cache.sqlite")
+    texts = ["alpha", "beta", "alpha"]
+
+    first = idx.EmbedCache(10, idx.EmbedStore(db, "ollama:test-model", 0))
+    vecs, errs = idx.embed_texts("ollama", texts, first)
+    first.close()
+    assert errs == [None, None, None]
+    assert len(calls) == 1
+
+    # Fresh process memory, same model: served from disk without embedding calls.
+    second = idx.EmbedCache(10, idx.EmbedStore(db, "ollama:test-model", 0))
+    vecs2, _ = idx.embed_texts("ollama", texts, second)
+    second.close()
+    assert len(calls) == 1
+    assert vecs2 == vecs
+    assert second.disk_hits == 3
+
+    # A different model must not reuse those vectors.
+    other = idx.EmbedCache(10, idx.EmbedStore(db, "ollama:other-model", 0))
+    idx.embed_texts("ollama", texts, other)
+    other.close()
+    assert len(calls) == 2
+
+
+def test_legacy_fallback_vectors_are_not_cached(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    monkeypatch.setattr(idx, "OLLAMA_USE_BATCH", True)
+    modern_up = {"ok": False}
+
+    def fake_ollama(texts: List[str]) -> List[List[float]]:
+        if not modern_up["ok"]:
+            raise RuntimeError("/api/embed unavailable")
+        return [[1.0, float(len(t))] for t in texts]
+
+    monkeypatch.setattr(idx, "embed_texts_ollama_modern", fake_ollama)
+    monkeypatch.setattr(idx, "embed_text_ollama_legacy", lambda t: [2.0, float(len(t))])
+    db = str(tmp_path / "embed_cache.sqlite")
+
+    # The failed batch is salvaged through the legacy endpoint, but those vectors stay out of the cache.
+    first = idx.EmbedCache(10, idx.EmbedStore(db, idx.embed_model_key("ollama"), 0))
+    vecs, errs = idx.embed_texts("ollama", ["alpha", "beta"], first)
+    first.close()
+    assert errs == [None, None] and vecs == [[2.0, 5.0], [2.0, 4.0]]
+
+    modern_up["ok"] = True
+    second = idx.EmbedCache(10, idx.EmbedStore(db, idx.embed_model_key("ollama"), 0))
+    vecs2, _ = idx.embed_texts("ollama", ["alpha", "beta"], second)
+    second.close()
+    assert vecs2 == [[1.0, 5.0], [1.0, 4.0]]
+    assert second.disk_hits == 0
+
+
+def test_embed_store_evicts_least_recently_used(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    store = idx.EmbedStore(str(tmp_path / "embed_cache.sqlite"), "ollama:m", 1)
+    store.max_rows = 10
+    store.put_many([(f"h{i}", [float(i)]) for i in range(12)])
+    assert store.rows <= 10
+    assert store.get_many(["h11"]) == {"h11": [11.0]}
+    store.close()
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_embed_accumulator_batches_small_files(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, pipelined: bool) -> None:
+    env = indexer_env
+    calls: List[int] = []
+
+    def counting_embed(provider: str, texts: List[str], cache: Any):
+        calls.append(len(texts))
+        return [[float(len(t)), 1.0] for t in texts], [None] * len(texts)
+
+    monkeypatch.setattr(idx, "embed_texts", counting_embed)
+    acc = idx.EmbedAccumulator("ollama", idx.EmbedCache(10), target_chunks=4, max_wait_s=30)
+    roots = [str(env["root"])]
+    if pipelined:
+        idx.run_pipeline(roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"], None, acc)
+    else:
+        idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"], acc)
+    env["writer"].flush()
+
+    # 7 one-chunk files -> one full batch of 4 plus the 3-file remainder.
+    assert calls == [4, 3]
+    points = [p for batch in env["upserts"] for p in batch]
+    assert len(points) == 7
+    assert all(p["vector"][0] == float(len(p["payload"]["preview"])) for p in points)
+    assert len(_complete_paths(env["conn"])) == 7
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        body = json.dumps({"status": "ok", "result": json.loads(raw or b"null")}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def test_http_json_reuses_keepalive_connections_and_gzips(monkeypatch: pytest.MonkeyPatch) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pool = idx.HttpPool(4, keepalive=True)
+    monkeypatch.setattr(idx, "HTTP_POOL", pool)
+    monkeypatch.setattr(idx, "HTTP_GZIP_MIN_BYTES", 64)
+    url = f"http://127.0.0.1:{server.server_address[1]}/collections/x/points"
+    try:
+        for i in range(3):
+            assert idx.http_json("POST", url, {"i": i})["result"] == {"i": i}
+        big = {"points": ["x" * 50] * 20}
+        assert idx.http_json("POST", url, big, gzip_body=True)["result"] == big
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
+
+    c = pool.counters.snapshot()
+    assert c["requests"] == 4
+    assert c["connections_opened"] == 1
+    assert c["connections_reused"] == 3
+    assert c["gzip_requests"] == 1
+    assert c["gzip_bytes_saved"] > 0
+
+
+def test_preloaded_state_index_skips_unchanged_files_without_sqlite(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    roots = [str(env["root"])]
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    changed = env["root"] / "note_3.txt"
+    changed.write_text("rewritten " * 40, encoding="utf-8")
+
+    state_index = idx.load_state_index(env["conn"], "cfg")
+    assert len(state_index.fingerprints) == 7
+
+    def no_lookup(conn, path):
+        raise AssertionError("per-file SELECT while a preloaded index is active")
+
+    monkeypatch.setattr(idx, "get_state", no_lookup)
+    stats = idx.RunStats()
+    work = [idx.prepare_file(env["conn"], Path(p), roots, "cfg", stats, state_index) for p in idx.iter_files(roots)]
+    assert [w.path for w in work if w is not None] == [changed]
+    assert work[[w is not None for w in work].index(True)].had_prev
+    assert stats.get("skipped_incremental") == 6
+
+    # A different cfg_hash invalidates every row.
+    assert set(idx.load_state_index(env["conn"], "other").fingerprints.values()) == {idx.StateIndex.NEEDS_WORK}
+
+
+def test_walk_files_single_pass_applies_excludes_and_reuses_stat(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    monkeypatch.setattr(idx, "EXCLUDE_DIR_NAMES", {"node_modules"})
+    monkeypatch.setattr(idx, "EXCLUDE_FILE_NAMES", {".DS_Store"})
+    root = tmp_path / "Dropbox"
+    for rel in ["a.txt", "sub/b.txt", "sub/deeper/c.txt", "node_modules/x.js", ".DS_Store", "sub/._meta"]:
+        f = root / rel
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_text(rel, encoding="utf-8")
+    (root / "linked").symlink_to(root / "sub", target_is_directory=True)
+
+    def no_walk(*a, **k):
+        raise AssertionError("os.walk should not be used")
+
+    monkeypatch.setattr(idx.os, "walk", no_walk)
+    found = list(idx.walk_files([str(root)]))
+    assert sorted(str(p.relative_to(root)) for p, _ in found) == ["a.txt", "sub/b.txt", "sub/deeper/c.txt"]
+    assert all(st is not None and st.st_size == len(str(p.relative_to(root))) for p, st in found)
+
+
+def test_parallel_walk_lists_concurrently_in_serial_order(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    roots = []
+    for r in ("Dropbox", "Dropbox (Business)"):
+        root = tmp_path / r
+        for i in range(6):
+            for j in range(3):
+                f = root / f"d{i}" / f"e{j}" / "file.txt"
+                f.parent.mkdir(parents=True, exist_ok=True)
+                f.write_text("x", encoding="utf-8")
+            (root / f"d{i}" / "top.txt").write_text("y", encoding="utf-8")
+        roots.append(str(root))
+
+    real_scan = idx._scan_dir
+    lock = threading.Lock()
+    active = {"now": 0, "max": 0}
+
+    def slow_scan(top: str):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        try:
+            threading.Event().wait(0.01)
+            return real_scan(top)
+        finally:
+            with lock:
+                active["now"] -= 1
+
+    monkeypatch.setattr(idx, "_scan_dir", slow_scan)
+    serial = [p for p, _ in idx.walk_files(roots, workers=1)]
+    assert active["max"] == 1
+    parallel = [p for p, _ in idx.walk_files(roots, workers=8)]
+    assert parallel == serial
+    assert len(serial) == 2 * 6 * 4
+    assert active["max"] > 1
+
+
+def test_change_debouncer_waits_for_quiet_period() -> None:
+    d = idx.ChangeDebouncer(quiet_s=2, max_delay_s=10)
+    d.add(["/r/a.txt"], "changed", now=100)
+    d.add(["/r/a.txt"], "changed", now=101.5)
+    d.add(["/r/b.txt"], "deleted", now=100)
+    assert d.pop_ready(102) == {"/r/b.txt": "deleted"}
+    assert d.pop_ready(103) == {}
+    assert d.pop_ready(103.5) == {"/r/a.txt": "changed"}
+    # A file that keeps changing is still released after max_delay_s.
+    for t in range(200, 215):
+        d.add(["/r/busy.txt"], "changed", now=t)
+        if t - 200 >= 10:
+            assert d.pop_ready(t) == {"/r/busy.txt": "changed"}
+            break
+        assert d.pop_ready(t) == {}
+
+
+@pytest.mark.parametrize("backend", ["inotify", "snapshot"])
+def test_watch_mode_indexes_only_changed_files(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, backend: str) -> None:
+    env = indexer_env
+    roots = [str(env["root"])]
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    env["upserts"].clear()
+    monkeypatch.setattr(idx, "WATCH_DEBOUNCE_SECONDS", 0.2)
+    monkeypatch.setattr(idx, "MAX_FILES", 1)  # caps the initial walk only, never the watcher
+    if backend == "inotify":
+        try:
+            watcher = idx.InotifyWatcher(roots)
+        except OSError as e:
+            pytest.skip(f"inotify unavailable: {e}")
+    else:
+        watcher = idx.SnapshotWatcher(roots, poll_s=0.2)
+
+    stop = threading.Event()
+    new_dir = env["root"] / "new"
+
+    def edit_tree() -> None:
+        new_dir.mkdir()
+        (new_dir / "fresh.txt").write_text("a brand new note " * 10, encoding="utf-8")
+        (env["root"] / "note_1.txt").write_text("edited " * 30, encoding="utf-8")
+        (env["root"] / "note_2.txt").unlink()
+        for _ in range(200):
+            if env["stats"].get("pruned") >= 1 and env["stats"].get("files_indexed") >= 9:
+                break
+            threading.Event().wait(0.05)
+        stop.set()
+
+    # The watch loop owns the SQLite connection, so it runs on this thread; edits come from another.
+    editor = threading.Thread(target=edit_tree)
+    editor.start()
+    try:
+        idx.run_watch(watcher, env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"], stop=stop)
+    finally:
+        stop.set()
+        editor.join(10)
+        watcher.close()
+
+    assert _complete_paths(env["conn"]) == sorted(
+        [str(p) for p in env["root"].iterdir() if p.is_file()] + [str(new_dir / "fresh.txt")]
+    )
+    assert env["deletes"] == [[str(env["root"] / "note_2.txt")]]
+    upserted = sorted({p["payload"]["path"] for batch in env["upserts"] for p in batch})
+    assert upserted == sorted([str(new_dir / "fresh.txt"), str(env["root"] / "note_1.txt")])
+    assert env["stats"].get("watch_deleted") == 1
+
+
+def test_sweep_prunes_only_files_missing_from_the_walk(indexer_env: Dict[str, Any], tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "PRUNE_MAX_FRACTION", 0.5)
+    roots = [str(env["root"])]
+    snip_conn = idx.sqlite3.connect(":memory:")
+    snip_conn.execute("CREATE TABLE chunks (point_id TEXT PRIMARY KEY, path TEXT)")
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    gone = [str(env["root"] / "note_0.txt"), str(env["root"] / "note_5.txt")]
+    snip_conn.executemany("INSERT INTO chunks VALUES (?, ?)", [(p, p) for p in gone + [str(env["root"] / "note_1.txt")]])
+    # A file_state row from a root that is not part of this run must survive.
+    idx.set_state(env["conn"], str(tmp_path / "Other" / "x.txt"), 1, 1, 0, 0, "cfg", True, "h")
+    env["conn"].commit()
+    for p in gone:
+        os.unlink(p)
+
+    state_index = idx.load_state_index(env["conn"], "cfg")
+    stats = idx.RunStats()
+    for p, st in idx.walk_files(roots):
+        idx.prepare_file(env["conn"], p, roots, "cfg", stats, state_index, st)
+    report = idx.sweep_deleted(env["conn"], snip_conn, roots, state_index, stats)
+
+    assert report == {"candidates": 2, "deleted": 2, "pruned": 2}
+    assert env["deletes"] == [sorted(gone)]
+    assert [r[0] for r in snip_conn.execute("SELECT path FROM chunks")] == [str(env["root"] / "note_1.txt")]
+    remaining = {r[0] for r in env["conn"].execute("SELECT path FROM file_state")}
+    assert not remaining & set(gone)
+    assert str(tmp_path / "Other" / "x.txt") in remaining
+
+
+def test_sweep_refuses_when_too_much_disappeared(indexer_env: Dict[str, Any]) -> None:
+    env = indexer_env
+    roots = [str(env["root"])]
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    for p in list(env["root"].iterdir())[:4]:
+        p.unlink()
+    state_index = idx.load_state_index(env["conn"], "cfg")
+    for p, st in idx.walk_files(roots):
+        idx.prepare_file(env["conn"], p, roots, "cfg", env["stats"], state_index, st)
+    report = idx.sweep_deleted(env["conn"], None, roots, state_index, env["stats"])
+    assert report["refused"] and report["pruned"] == 0
+    assert env["deletes"] == []
+
+
+@pytest.mark.parametrize("accumulate", [False, True])
+def test_edited_file_reuses_vectors_of_unchanged_chunks(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, accumulate: bool) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "CHUNK_SIZE", 40)
+    monkeypatch.setattr(idx, "CHUNK_OVERLAP", 0)
+    roots = [str(env["root"])]
+    doc = env["root"] / "contract.txt"
+    paras = [f"clause {i:02d} " + "x" * 30 for i in range(6)]
+    doc.write_text("".join(paras), encoding="utf-8")
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    stored = {p["payload"]["text_hash"]: p["vector"] for batch in env["upserts"] for p in batch if p["payload"]["path"] == str(doc)}
+    assert len(stored) == 6
+
+    paras[4] = "clause 04 " + "y" * 30
+    doc.write_text("".join(paras), encoding="utf-8")
+    os.utime(doc, (1, 1))
+    embedded: List[str] = []
+
+    def counting_embed(provider: str, texts: List[str], cache: Any):
+        embedded.extend(texts)
+        return [[float(len(t)), 2.0] for t in texts], [None] * len(texts)
+
+    monkeypatch.setattr(idx, "embed_texts", counting_embed)
+    monkeypatch.setattr(idx, "fetch_prev_vectors", lambda path: dict(stored) if path == str(doc) else {})
+    env["upserts"].clear()
+    acc = idx.EmbedAccumulator("ollama", idx.EmbedCache(10), target_chunks=4, max_wait_s=30) if accumulate else None
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"], acc)
+    env["writer"].flush()
+
+    assert embedded == [paras[4]]
+    points = sorted((p for batch in env["upserts"] for p in batch), key=lambda p: p["payload"]["chunk_index"])
+    assert [p["vector"][1] for p in points] == [1.0, 1.0, 1.0, 1.0, 2.0, 1.0]
+    assert env["stats"].get("chunks_reused") == 5
+    audit = [json.loads(line) for line in (Path(env["writer"].audit.f.name)).read_text().splitlines()]
+    assert audit[-1]["chunks_reused"] == 5 and audit[-1]["reuse_ratio"] == round(5 / 6, 3)
+
+
+def test_cdc_chunking_confines_an_insert_to_nearby_chunks(monkeypatch: pytest.MonkeyPatch) -> None:
+    import random
+
+    monkeypatch.setattr(idx, "CHUNK_SIZE", 400)
+    monkeypatch.setattr(idx, "CHUNK_OVERLAP", 40)
+    rnd = random.Random(7)
+    words = ["invoice", "kitchen", "supplier", "delivery", "oven", "contract", "net", "terms", "gastro", "steel"]
+    paras = [" ".join(rnd.choice(words) for _ in range(rnd.randint(8, 40))) + "." for _ in range(120)]
+    text = "\n\n".join(paras)
+    edited = text.replace(paras[2], paras[2] + "\nInserted line about a new fryer.", 1)
+
+    monkeypatch.setattr(idx, "CHUNK_MODE", "cdc")
+    before, after = idx.chunk_text(text), idx.chunk_text(edited)
+    assert all(len(c) <= 400 for c in before)
+    assert "".join(c if i == 0 else c[40:] for i, c in enumerate(before)) == text
+    changed = set(after) - set(before)
+    assert len(changed) <= 3 and len(after) > 20
+
+    monkeypatch.setattr(idx, "CHUNK_MODE", "fixed")
+    fixed_changed = set(idx.chunk_text(edited)) - set(idx.chunk_text(text))
+    assert len(fixed_changed) > len(after) // 2
+
+    fixed_cfg = idx.run_config_hash("ollama")
+    monkeypatch.setattr(idx, "CHUNK_MODE", "cdc")
+    assert idx.run_config_hash("ollama") != fixed_cfg
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_moved_file_is_rekeyed_without_embedding(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, pipelined: bool) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "DEDUP_FILES", True)
+    monkeypatch.setattr(idx, "delete_points_for_path", lambda path: None)
+    roots = [str(env["root"])]
+    snip_conn = idx.sqlite3.connect(":memory:")
+    snip_conn.execute("CREATE TABLE chunks (point_id TEXT PRIMARY KEY, path TEXT, mtime INTEGER, size INTEGER)")
+    env["writer"].snip_conn = snip_conn
+    monkeypatch.setattr(idx, "upsert_snippets", lambda conn, rows: conn.executemany(
+        "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", [(r[0], r[1], r[4], r[5]) for r in rows]
+    ))
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    stored = [p for batch in env["upserts"] for p in batch]
+
+    old = env["root"] / "note_4.txt"
+    new = env["root"] / "archive_2024" / "renamed.txt"
+    new.parent.mkdir()
+    os.rename(old, new)
+    monkeypatch.setattr(idx, "fetch_points_for_path", lambda path, with_payload=True: [p for p in stored if p["payload"]["path"] == path])
+
+    def no_embed(provider: str, texts: List[str], cache: Any):
+        raise AssertionError("moved files must not be embedded")
+
+    monkeypatch.setattr(idx, "embed_texts", no_embed)
+    env["upserts"].clear()
+    if pipelined:
+        idx.run_pipeline(roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    else:
+        idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+
+    (moved,) = [p for batch in env["upserts"] for p in batch]
+    (orig,) = [p for p in stored if p["payload"]["path"] == str(old)]
+    assert moved["id"] == idx.point_id_for(str(new), 0)
+    assert moved["vector"] == orig["vector"]
+    assert moved["payload"]["path"] == str(new) and moved["payload"]["name"] == "renamed.txt"
+    assert env["batch_deletes"] == [([], [str(old)])]
+    paths = {r[0] for r in env["conn"].execute("SELECT path FROM file_state")}
+    assert str(new) in paths and str(old) not in paths
+    assert snip_conn.execute("SELECT path FROM chunks WHERE point_id = ?", (moved["id"],)).fetchone() == (str(new),)
+    assert env["stats"].get("files_moved") == 1
+
+
+def test_flush_sends_all_deletes_in_one_request(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "DEDUP_FILES", True)
+    roots = [str(env["root"])]
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    for i in (0, 2, 5):
+        p = env["root"] / f"note_{i}.txt"
+        p.write_text(f"short {i}", encoding="utf-8")
+        os.utime(p, (5, 5))
+    sub = env["root"] / "zz_copies"
+    sub.mkdir()
+    for i in range(3):
+        (sub / f"copy_{i}.txt").write_text((env["root"] / "note_1.txt").read_text(encoding="utf-8"), encoding="utf-8")
+
+    posts: List[str] = []
+
+    def fake_post(path: str, payload: Any) -> Dict[str, Any]:
+        posts.append(path)
+        if "/points/delete" in path:
+            clauses = payload["filter"]["should"]
+            stale.extend(c["must"][0]["match"]["value"] for c in clauses if "must" in c)
+            dups.extend(v for c in clauses if "match" in c for v in c["match"]["any"])
+        return {"status": "ok"}
+
+    stale: List[str] = []
+    dups: List[str] = []
+    monkeypatch.setattr(idx, "delete_points_batch", REAL_DELETE_POINTS_BATCH)
+    monkeypatch.setattr(idx, "qdrant_post", fake_post)
+    env["writer"].batch_size = 100
+    idx.run_sequential(env["conn"], roots, "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+
+    assert len([p for p in posts if "/points/delete" in p]) == 1
+    assert sorted(stale) == sorted(str(env["root"] / f"note_{i}.txt") for i in (0, 2, 5))
+    assert sorted(dups) == sorted(str(sub / f"copy_{i}.txt") for i in range(3))
+    complete = set(_complete_paths(env["conn"]))
+    assert {str(sub / f"copy_{i}.txt") for i in range(3)} <= complete
+
+
+def test_async_upserts_commit_state_only_after_acknowledgement(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    release = threading.Event()
+    sent: List[int] = []
+
+    def slow_upsert(points):
+        sent.append(len(points))
+        if not release.wait(10):
+            raise RuntimeError("timed out")
+        env["upserts"].append(list(points))
+
+    monkeypatch.setattr(idx, "upsert_batch", slow_upsert)
+    writer = idx.BatchWriter(env["conn"], None, "cfg", "run", env["writer"].audit, env["stats"], batch_size=2, inflight=8)
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", writer, idx.EmbedCache(10), env["stats"])
+
+    # Batches are in flight, nothing acknowledged yet: no file may be marked complete.
+    assert len(sent) >= 3
+    assert _complete_paths(env["conn"]) == []
+    release.set()
+    writer.flush()
+    writer.close()
+    assert len(_complete_paths(env["conn"])) == 7
+    assert writer.report()["max_inflight_seen"] >= 3
+
+
+def test_async_upsert_failure_keeps_state_of_unacknowledged_batches(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    calls = {"n": 0}
+    lock = threading.Lock()
+
+    def flaky_upsert(points):
+        with lock:
+            calls["n"] += 1
+            n = calls["n"]
+        if n == 2:
+            raise RuntimeError("qdrant down")
+
+    monkeypatch.setattr(idx, "upsert_batch", flaky_upsert)
+    writer = idx.BatchWriter(env["conn"], None, "cfg", "run", env["writer"].audit, env["stats"], batch_size=2, inflight=1)
+    with pytest.raises(RuntimeError):
+        idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", writer, idx.EmbedCache(10), env["stats"])
+        writer.flush()
+    writer.close()
+    assert len(_complete_paths(env["conn"])) == 2
+
+
+def test_aimd_controller_probes_up_and_backs_off(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    ctl = idx.AimdController("embed_batch", 4, 1, 10, step=2, window=2)
+
+    for units in (4, 4):
+        ctl.observe(units, 1.0)
+    assert ctl.get() == 6  # first window: probe upwards
+    for units in (6, 6):
+        ctl.observe(units, 1.0)
+    assert ctl.get() == 8  # throughput improved: keep probing
+    for units in (2, 2):
+        ctl.observe(units, 1.0)
+    assert ctl.get() == 6  # throughput dropped: back off by a quarter
+    ctl.observe(6, 1.0, ok=False)
+    ctl.observe(6, 1.0)
+    assert ctl.get() == 3  # errors halve
+    for _ in range(20):
+        ctl.observe(100, 0.1)
+    assert ctl.get() == 10  # capped at hi
+
+    slow = idx.AimdController("upsert_batch", 8, 2, 64, step=4, window=1, max_latency_s=0.5)
+    slow.observe(8, 2.0)
+    assert slow.get() == 6
+    report = ctl.report()
+    assert report["errors"] == 1 and report["decreases"] == 2
+    log_text = Path(idx.LOG_PATH).read_text(encoding="utf-8")
+    assert "aimd name=embed_batch value=8->6 reason=throughput_drop" in log_text
+    assert "aimd name=upsert_batch value=8->6 reason=latency" in log_text
+
+
+def test_adaptive_embed_and_upsert_batches_follow_controllers(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    calls: List[List[str]] = []
+    threads = set()
+    lock = threading.Lock()
+
+    def fake_ollama(texts: List[str]) -> List[List[float]]:
+        with lock:
+            calls.append(list(texts))
+            threads.add(threading.current_thread().name)
+        if "boom" in texts:
+            raise RuntimeError("batch rejected")
+        return [[float(len(t)), 1.0] for t in texts]
+
+    monkeypatch.setattr(idx, "embed_texts_ollama_modern", fake_ollama)
+    monkeypatch.setattr(idx, "embed_text_ollama_legacy", lambda t: [float(len(t)), 2.0])
+    batch_ctl = idx.AimdController("embed_batch", 2, 1, 8, window=100)
+    conc_ctl = idx.AimdController("embed_concurrency", 2, 1, 4, window=100)
+    monkeypatch.setattr(idx, "EMBED_BATCH_CTL", batch_ctl)
+    monkeypatch.setattr(idx, "EMBED_CONCURRENCY_CTL", conc_ctl)
+
+    texts = [f"text {i}" for i in range(9)] + ["boom"]
+    vecs, errs = REAL_EMBED_TEXTS("ollama", texts, idx.EmbedCache(100))
+    assert errs == [None] * 10
+    assert [len(c) for c in calls] == [2, 2, 2, 2, 2]
+    assert threading.main_thread().name not in threads
+    # The rejected batch is salvaged through the legacy endpoint, in order.
+    assert vecs[8] == [6.0, 2.0] and vecs[9] == [4.0, 2.0]
+    assert vecs[0] == [6.0, 1.0]
+    assert batch_ctl.observations == 5 and batch_ctl.errors == 1
+    assert conc_ctl.observations == 1
+
+    # Upserts: the writer takes its batch size from the controller after every acknowledged batch.
+    upsert_ctl = idx.AimdController("upsert_batch", 2, 1, 16, step=2, window=1)
+    writer = idx.BatchWriter(env["conn"], None, "cfg", "run", env["writer"].audit, env["stats"], batch_size=2, size_ctl=upsert_ctl)
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", writer, idx.EmbedCache(10), env["stats"])
+    writer.flush()
+    assert upsert_ctl.observations == len(env["upserts"])
+    assert upsert_ctl.increases >= 1
+    assert writer.batch_size == upsert_ctl.get()
+    assert len(_complete_paths(env["conn"])) == 7
+
+
+def test_pdf_text_needs_few_pdftotext_runs_and_caches_page_count(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    doc_pages = {"n": 3}
+    runs: List[Any] = []
+    pdfinfo_calls: List[str] = []
+
+    def fake_pdftotext(path: Path, first: int, last: int) -> Any:
+        runs.append((first, last))
+        last = min(last, doc_pages["n"])
+        return [f"page {p} " + "invoice text " * 30 for p in range(first, last + 1)], True
+
+    def fake_pdfinfo(path: Path) -> int:
+        pdfinfo_calls.append(str(path))
+        return doc_pages["n"]
+
+    monkeypatch.setattr(idx, "cmd_exists", lambda name: True)
+    monkeypatch.setattr(idx, "pdftotext_pages", fake_pdftotext)
+    monkeypatch.setattr(idx, "pdf_page_count", fake_pdfinfo)
+    monkeypatch.setattr(idx, "PDF_RANGE_MAX_GAP", 8)
+    pdf = Path(env["root"]) / "scan.pdf"
+    pdf.write_bytes(b"%PDF-1.4 fake")
+
+    # Short document: one run, and the page count falls out of it without pdfinfo.
+    text, pages = idx.extract_pdf_text_pdftotext(pdf, 30, 0)
+    assert (pages, runs, pdfinfo_calls) == (3, [(1, 30)], [])
+    assert text.startswith("page 1 ")
+
+    # Long document: the first run is reused, the remaining sampled pages come from one more run.
+    doc_pages["n"] = 200
+    runs.clear()
+    text, pages = idx.extract_pdf_text_pdftotext(pdf, 30, 0)
+    assert pages == 200 and len(pdfinfo_calls) == 1
+    assert runs == [(1, 30), (35, 200)]
+    wanted = [i + 1 for i in idx.page_sample_indices(200, 30)]
+    assert [int(line.split()[1]) for line in text.split("\n")] == wanted
+
+    # Very long and large: pdfinfo first, no speculative head run, and a bounded number of runs.
+    doc_pages["n"] = 5000
+    runs.clear()
+    monkeypatch.setattr(idx, "PDF_HEAD_RUN_MAX_BYTES", 4)
+    text, pages = idx.extract_pdf_text_pdftotext(pdf, 30, 0)
+    monkeypatch.setattr(idx, "PDF_HEAD_RUN_MAX_BYTES", 4 * 1024 * 1024)
+    assert pages == 5000 and len(pdfinfo_calls) == 2
+    assert len(runs) == idx.PDF_MAX_RUNS and runs[0][0] == 1 and runs[-1][1] == 5000
+    wanted = [i + 1 for i in idx.page_sample_indices(5000, 30)]
+    assert [int(line.split()[1]) for line in text.split("\n")] == wanted
+    pdfinfo_calls.clear()
+
+    # Through the indexer: the learned count is cached by content signature, so a re-index skips pdfinfo.
+    doc_pages["n"] = 200
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    assert len(pdfinfo_calls) == 1
+    sig = idx.compute_file_sig(pdf, pdf.stat().st_size)
+    assert idx.cached_pdf_pages(env["conn"], sig) == 200
+
+    os.utime(pdf, (pdf.stat().st_atime, pdf.stat().st_mtime + 10))
+    runs.clear()
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    assert len(pdfinfo_calls) == 1
+    assert runs == [(1, 200)]
+    assert env["stats"].get("pdf_pages_cached") == 1
+
+
+def test_pdftotext_failing_partway_does_not_decide_the_page_count(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    env = indexer_env
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake = bin_dir / "pdftotext"
+    fake.write_text("#!/bin/sh\nprintf 'page one text\\fpage two text\\f'\nexit 1\n", encoding="utf-8")
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    pdfinfo = {"pages": 0}
+    monkeypatch.setattr(idx, "pdf_page_count", lambda path: pdfinfo["pages"])
+    pdf = Path(env["root"]) / "crash.pdf"
+    pdf.write_bytes(b"%PDF-1.4 fake")
+
+    assert idx.pdftotext_pages(pdf, 1, 30) == (["page one text", "page two text"], False)
+    # The pages it printed are kept, but the length comes from pdfinfo (or stays unknown).
+    text, pages = idx.extract_pdf_text_pdftotext(pdf, 30, 0)
+    assert (text, pages) == ("page one text\npage two text", 0)
+    pdfinfo["pages"] = 10
+    assert idx.extract_pdf_text_pdftotext(pdf, 30, 0)[1] == 10
+
+    pdfinfo["pages"] = 0
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    assert idx.cached_pdf_pages(env["conn"], idx.compute_file_sig(pdf, pdf.stat().st_size)) == 0
+
+
+def _write_docx(path: Path, body: str, header: str = "", footer: str = "") -> None:
+    ns = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    with zipfile.ZipFile(str(path), "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("word/document.xml", f"<w:document {ns}><w:body>{body}</w:body></w:document>")
+        if header:
+            z.writestr("word/header1.xml", f"<w:hdr {ns}>{header}</w:hdr>")
+            z.writestr("word/header2.xml", f"<w:hdr {ns}>{header}</w:hdr>")
+        if footer:
+            z.writestr("word/footer1.xml", f"<w:ftr {ns}>{footer}</w:ftr>")
+
+
+def _para(text: str) -> str:
+    return f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>"
+
+
+def test_docx_streaming_extracts_headers_tables_footers_within_budget(tmp_path: Path) -> None:
+    table = (
+        "<w:tbl>"
+        f"<w:tr><w:tc>{_para('SKU')}</w:tc><w:tc>{_para('Price')}</w:tc></w:tr>"
+        f"<w:tr><w:tc>{_para('A-100')}{_para('(boxed)')}</w:tc><w:tc>{_para('9.99')}</w:tc></w:tr>"
+        "</w:tbl>"
+    )
+    doc = tmp_path / "catalogue.docx"
+    _write_docx(doc, _para("Spring catalogue") + table + _para("Terms apply"), _para("ACME Corp"), _para("Page footer"))
+    text = idx.extract_docx_text_ooxml(doc)
+    assert text.split("\n") == ["ACME Corp", "Spring catalogue", "SKU\tPrice", "A-100 (boxed)\t9.99", "Terms apply", "Page footer"]
+
+    # A huge body is cut at the budget while parsing; header and footer still make it in.
+    big = tmp_path / "big.docx"
+    _write_docx(big, "".join(_para(f"item {i} " + "x" * 80) for i in range(50000)), _para("ACME Corp"), _para("Page footer"))
+    text = idx.extract_docx_text_ooxml(big, 5000)
+    lines = text.split("\n")
+    assert len(text) <= 5000
+    assert lines[0] == "ACME Corp" and lines[-1] == "Page footer"
+    assert lines[1].startswith("item 0 ") and len(lines) < 70
+
+
+def test_zip_members_are_indexed_in_memory_with_archive_member_payload(indexer_env: Dict[str, Any], tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "ZIP_MEMBERS", True)
+    pdf_reads: List[bytes] = []
+
+    def fake_pdftotext(path: Path, first: int, last: int) -> Any:
+        pdf_reads.append(path.read_bytes())
+        return ["Invoice 4711 total due " * 5], True
+
+    monkeypatch.setattr(idx, "cmd_exists", lambda name: True)
+    monkeypatch.setattr(idx, "pdftotext_pages", fake_pdftotext)
+    docx = tmp_path / "letter.docx"
+    _write_docx(docx, _para("Dear supplier, thanks for the delivery"))
+    archive = Path(env["root"]) / "export.zip"
+    with zipfile.ZipFile(str(archive), "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("notes/readme.txt", "quarterly ledger export " * 10)
+        z.writestr("letters/letter.docx", docx.read_bytes())
+        z.writestr("invoices/4711.pdf", b"%PDF-1.4 member")
+        z.writestr("photos/logo.png", b"\x89PNG not text")
+        z.writestr("big.txt", "x" * 5000)
+    monkeypatch.setattr(idx, "ZIP_MEMBER_MAX_BYTES", 4000)
+
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+
+    points = [p for batch in env["upserts"] for p in batch if p["payload"]["path"] == str(archive)]
+    by_member = {p["payload"].get("archive_member", ""): p["payload"] for p in points}
+    assert set(by_member) == {"", "notes/readme.txt", "letters/letter.docx", "invoices/4711.pdf"}
+    assert all(p["text_source"] == "zip_members" for p in by_member.values())
+    assert "photos/logo.png" in by_member[""]["preview"]  # the listing chunk still names every member
+    assert by_member["letters/letter.docx"]["preview"].startswith("Dear supplier")
+    assert by_member["invoices/4711.pdf"]["preview"].startswith("Invoice 4711")
+    # Only the PDF member went through a temporary file, and that file is gone again.
+    assert pdf_reads == [b"%PDF-1.4 member"]
+    assert not list(tmp_path.glob("**/*.pdf"))
+
+
+def test_near_duplicates_become_aliases_until_the_canonical_is_deleted(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "NEAR_DUP_INDEX", idx.NearDupIndex())
+    words = [f"w{i % 97}x{i % 13}" for i in range(400)]
+    root = Path(env["root"])
+    (root / "report.txt").write_text(" ".join(words), encoding="utf-8")
+    words[200] = "changed"
+    (root / "report_final_v2.txt").write_text(" ".join(words), encoding="utf-8")
+    (root / "other.txt").write_text(" ".join(reversed(words)), encoding="utf-8")
+
+    def index_once() -> None:
+        idx.run_sequential(env["conn"], [str(root)], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+        env["writer"].flush()
+
+    index_once()
+    indexed = {p["payload"]["path"] for batch in env["upserts"] for p in batch}
+    copies = {str(root / "report.txt"), str(root / "report_final_v2.txt")}
+    assert str(root / "other.txt") in indexed and len(copies & indexed) == 1
+    (canonical,) = copies & indexed
+    (alias,) = copies - indexed
+    assert env["stats"].get("skipped_near_dup") == 1
+    row = env["conn"].execute("SELECT complete, text_hash FROM file_state WHERE path = ?", (alias,)).fetchone()
+    assert row == (1, "near:" + canonical)
+    canonicals = {r[0] for r in env["conn"].execute("SELECT path FROM near_dup")}
+    assert canonicals == {canonical, str(root / "other.txt")}  # short notes are never aliased
+
+    # The persisted signatures rebuild the LSH index for the next run.
+    reloaded = idx.load_near_dup_index(env["conn"])
+    assert set(reloaded.sigs) == canonicals
+
+    # Deleting the canonical hands the role to its alias on the next run.
+    Path(canonical).unlink()
+    idx.prune_paths(env["conn"], None, [canonical])
+    env["upserts"].clear()
+    monkeypatch.setattr(idx, "NEAR_DUP_INDEX", idx.load_near_dup_index(env["conn"]))
+    index_once()
+    assert {p["payload"]["path"] for batch in env["upserts"] for p in batch} == {alias}
+
+
+def test_migrate_from_snippets_reembeds_without_touching_the_files(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "SNIPPETS_DB", str(tmp_path / "snippets.sqlite"))
+    monkeypatch.setattr(idx, "SNIPPET_MAX_CHARS", 0)
+    monkeypatch.setattr(idx, "MIGRATE_BATCH_ROWS", 3)
+    root = Path(env["root"])
+    (root / "long.txt").write_text("".join(f"line {i} of a long document\n" for i in range(400)), encoding="utf-8")
+    snip = idx.ensure_snippets_db()
+    audit = idx.AuditLog(str(tmp_path / "audit_old.jsonl"))
+    writer = idx.BatchWriter(env["conn"], snip, "old", "run", audit, idx.RunStats(), batch_size=4)
+    idx.run_sequential(env["conn"], [str(root)], "ollama", "old", writer, idx.EmbedCache(10), idx.RunStats())
+    writer.flush()
+    audit.close()
+    indexed = sum(len(b) for b in env["upserts"])
+    assert snip.execute("SELECT COUNT(*) FROM chunks WHERE path = ?", (str(root / "long.txt"),)).fetchone()[0] > 3
+    # A row cut short (as with QDRANT_SNIPPET_MAX_CHARS > 0) no longer reproduces the file's fingerprint.
+    snip.execute("UPDATE chunks SET text = substr(text, 1, 5) WHERE path = ?", (str(root / "note_3.txt"),))
+    snip.commit()
+
+    shutil.rmtree(root)  # the migration never reads the files
+    env["upserts"].clear()
+    stats = idx.RunStats()
+    report = idx.migrate_from_snippets(env["conn"], snip, "ollama", "new", idx.EmbedCache(10), stats)
+
+    migrated = [p for batch in env["upserts"] for p in batch]
+    assert report["files_migrated"] == 7 and report["points_migrated"] == len(migrated) == indexed - 1
+    assert report["skipped"] == {"fingerprint_mismatch": 1}
+    assert {p["payload"]["path"] for p in migrated} == {str(root / f"note_{i}.txt") for i in range(7) if i != 3} | {str(root / "long.txt")}
+    assert all(p["id"] == idx.point_id_for(p["payload"]["path"], p["payload"]["chunk_index"]) for p in migrated)
+    states = dict(env["conn"].execute("SELECT path, cfg_hash FROM file_state"))
+    assert states.pop(str(root / "note_3.txt")) == "old"
+    assert set(states.values()) == {"new"}
+
+    # Resuming finds nothing left to do.
+    env["upserts"].clear()
+    report = idx.migrate_from_snippets(env["conn"], snip, "ollama", "new", idx.EmbedCache(10), idx.RunStats())
+    assert env["upserts"] == [] and report["skipped"] == {"already_migrated": 7, "fingerprint_mismatch": 1}
+    snip.close()
+
+
+def test_migration_refuses_extraction_changes_and_truncated_snippets(monkeypatch: pytest.MonkeyPatch) -> None:
+    prev = idx.run_config("ollama")
+    cfg = dict(prev, ollama_model="other-embed", collection="dropbox_v2")
+    monkeypatch.setattr(idx, "SNIPPET_MAX_CHARS", 0)
+    conn = sqlite3.connect(":memory:")
+    idx.check_migration_source(conn, prev, cfg)
+    idx.check_migration_source(conn, cfg, cfg)
+    with pytest.raises(RuntimeError, match="chunk_size"):
+        idx.check_migration_source(conn, prev, dict(cfg, chunk_size=prev["chunk_size"] + 1))
+    with pytest.raises(RuntimeError, match="QDRANT_COLLECTION"):
+        idx.check_migration_source(conn, prev, dict(prev, ollama_model="other-embed"))
+    monkeypatch.setattr(idx, "SNIPPET_MAX_CHARS", 800)
+    with pytest.raises(RuntimeError, match="SNIPPET_MAX_CHARS"):
+        idx.check_migration_source(conn, prev, cfg)
+
+
+def test_alias_switch_is_one_atomic_request_and_builds_get_their_own_state(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    aliases = {"dropbox": "dropbox_v2"}
+    posts: List[Any] = []
+    monkeypatch.setattr(idx, "qdrant_get", lambda path: {"result": {"aliases": [{"alias_name": a, "collection_name": c} for a, c in aliases.items()]}})
+    monkeypatch.setattr(idx, "qdrant_post", lambda path, payload: posts.append((path, payload)) or {})
+    assert idx.switch_alias("dropbox", "dropbox_v3") == "dropbox_v2"
+    assert posts == [(
+        "/collections/aliases",
+        {"actions": [
+            {"delete_alias": {"alias_name": "dropbox"}},
+            {"create_alias": {"collection_name": "dropbox_v3", "alias_name": "dropbox"}},
+        ]},
+    )]
+
+    monkeypatch.setattr(idx, "ALIAS", "dropbox")
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    for env in ("QDRANT_COLLECTION", "QDRANT_STATE_DB", "QDRANT_SNIPPETS_DB"):
+        monkeypatch.delenv(env, raising=False)
+    # Scheduled runs without QDRANT_COLLECTION keep the live collection fresh.
+    monkeypatch.setattr(idx, "STATE_DB", str(tmp_path / "state.sqlite"))
+    monkeypatch.setattr(idx, "SNIPPETS_DB", str(tmp_path / "snippets.sqlite"))
+    assert idx.use_alias_build_target() == "dropbox_v2"
+    assert (idx.COLLECTION, idx.STATE_DB, idx.SNIPPETS_DB) == (
+        "dropbox_v2", str(tmp_path / "state.dropbox_v2.sqlite"), str(tmp_path / "snippets.dropbox_v2.sqlite")
+    )
+    # A rebuild into a new collection never touches the live collection's state.
+    monkeypatch.setenv("QDRANT_COLLECTION", "dropbox_v3")
+    monkeypatch.setattr(idx, "COLLECTION", "dropbox_v3")
+    monkeypatch.setattr(idx, "STATE_DB", str(tmp_path / "state.sqlite"))
+    monkeypatch.setattr(idx, "SNIPPETS_DB", str(tmp_path / "snippets.sqlite"))
+    idx.use_alias_build_target()
+    assert idx.STATE_DB == str(tmp_path / "state.dropbox_v3.sqlite")
+    # A migration starts from a copy of the live collection's chunk text and fingerprints.
+    with sqlite3.connect(str(tmp_path / "snippets.dropbox_v2.sqlite")) as live_db:
+        live_db.execute("CREATE TABLE chunks (point_id TEXT)")
+        live_db.execute("INSERT INTO chunks VALUES ('p1')")
+    monkeypatch.setattr(idx, "MIGRATE_FROM_SNIPPETS", True)
+    monkeypatch.setenv("QDRANT_COLLECTION", "dropbox_v4")
+    monkeypatch.setattr(idx, "COLLECTION", "dropbox_v4")
+    monkeypatch.setattr(idx, "SNIPPETS_DB", str(tmp_path / "snippets.sqlite"))
+    idx.use_alias_build_target()
+    with sqlite3.connect(idx.SNIPPETS_DB) as seeded:
+        assert seeded.execute("SELECT point_id FROM chunks").fetchall() == [("p1",)]
+    monkeypatch.setattr(idx, "COLLECTION", "dropbox")
+    with pytest.raises(RuntimeError, match="versioned collection"):
+        idx.use_alias_build_target()
+
+    # OCR backfill and status open the state DB the scheduled indexer writes to.
+    monkeypatch.delenv("QDRANT_COLLECTION")
+    monkeypatch.setattr(idx, "STATE_DB", str(tmp_path / "state.sqlite"))
+    monkeypatch.setattr(idx, "SNIPPETS_DB", str(tmp_path / "snippets.sqlite"))
+    assert idx.resolve_collection_dbs() == (
+        "dropbox_v2", str(tmp_path / "state.dropbox_v2.sqlite"), str(tmp_path / "snippets.dropbox_v2.sqlite")
+    )
+    # A job moved to the alias before the existing collection was adopted must not start a rebuild.
+    aliases.clear()
+    (tmp_path / "state.sqlite").write_bytes(b"")
+    with pytest.raises(RuntimeError, match="adopt the existing collection"):
+        idx.use_alias_build_target()
+
+
+def test_storage_profiles_shape_new_collections(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    assert idx.collection_config("default", 768) == {"vectors": {"size": 768, "distance": "Cosine"}}
+    monkeypatch.setattr(idx, "HNSW_M", 32)
+    monkeypatch.setattr(idx, "INDEXING_THRESHOLD_KB", 50000)
+    sq8 = idx.collection_config("sq8", 768)
+    assert sq8["vectors"] == {"size": 768, "distance": "Cosine", "on_disk": True}
+    assert sq8["quantization_config"]["scalar"]["always_ram"] is True
+    assert sq8["hnsw_config"] == {"m": 32, "ef_construct": 128}
+    assert sq8["optimizers_config"] == {"indexing_threshold": 50000}
+    assert idx.STORAGE_PROFILES["sq8"]["hnsw_config"]["m"] == 16  # overrides never leak into the profile table
+
+    created: List[Any] = []
+    monkeypatch.setattr(idx, "LOG_PATH", str(tmp_path / "index.log"))
+    monkeypatch.setattr(idx, "VECTOR_SIZE", 4)
+    monkeypatch.setattr(idx, "STORAGE_PROFILE", "binary")
+    monkeypatch.setattr(idx, "qdrant_aliases", lambda: {})
+    monkeypatch.setattr(idx, "collection_exists", lambda name: False)
+    monkeypatch.setattr(idx, "qdrant_put", lambda path, payload: created.append((path, payload)) or {})
+    idx.ensure_collection("dropbox_v3")
+    assert created == [("/collections/dropbox_v3", idx.collection_config("binary", 4))]
+    monkeypatch.setattr(idx, "STORAGE_PROFILE", "pq")
+    with pytest.raises(RuntimeError, match="Unknown QDRANT_STORAGE_PROFILE"):
+        idx.ensure_collection("dropbox_v3")
+
+
+def test_slim_payload_keeps_only_filter_fields_in_qdrant(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch) -> None:
+    env = indexer_env
+    full = idx.run_config_hash("ollama")
+    monkeypatch.setattr(idx, "SLIM_PAYLOAD", True)
+    assert idx.run_config_hash("ollama") != full  # switching modes reindexes once
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    payloads = [p["payload"] for batch in env["upserts"] for p in batch]
+    assert len(payloads) == 7
+    slim_fields = {"path", "name", "mtime", "source", "text_source", "chunk_index", "chunk_total", "text_hash"}
+    assert all(set(p) == slim_fields for p in payloads)
+
+    # A moved file's re-keyed points stay slim too.
+    stored = [p for batch in env["upserts"] for p in batch]
+    monkeypatch.setattr(idx, "DEDUP_FILES", True)
+    monkeypatch.setattr(idx, "fetch_points_for_path", lambda path, with_payload=True: [p for p in stored if p["payload"]["path"] == path])
+    os.rename(env["root"] / "note_4.txt", env["root"] / "renamed.txt")
+    env["upserts"].clear()
+    idx.run_sequential(env["conn"], [str(env["root"])], "ollama", "cfg", env["writer"], idx.EmbedCache(10), env["stats"])
+    env["writer"].flush()
+    (moved,) = [p for batch in env["upserts"] for p in batch]
+    assert moved["payload"]["path"] == str(env["root"] / "renamed.txt") and set(moved["payload"]) == slim_fields
+
+
+def test_shared_chunks_store_repeated_text_once(indexer_env: Dict[str, Any], monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    env = indexer_env
+    monkeypatch.setattr(idx, "SHARED_CHUNKS", True)
+    monkeypatch.setattr(idx, "SNIPPETS_DB", str(tmp_path / "snippets.sqlite"))
+    id_deletes: List[List[str]] = []
+    monkeypatch.setattr(idx, "delete_point_ids", lambda ids: id_deletes.append(list(ids)))
+    root = Path(env["root"])
+    copies = [str(root / f"disclaimer_{c}.txt") for c in "abc"]
+    for p in copies:
+        Path(p).write_text("Confidential: do not forward this message. " * 10, encoding="utf-8")
+    snip = idx.ensure_snippets_db()
+    audit = idx.AuditLog(str(tmp_path / "audit_shared.jsonl"))
+    stats = idx.RunStats()
+    writer = idx.BatchWriter(env["conn"], snip, "cfg", "run", audit, stats, batch_size=2)
+    idx.run_sequential(env["conn"], [str(root)], "ollama", "cfg", writer, idx.EmbedCache(10), stats)
+    writer.flush()
+    audit.close()
+
+    points = [p for batch in env["upserts"] for p in batch]
+    shared = [p for p in points if p["payload"].get("shared")]
+    assert len(shared) == 1 and "path" not in shared[0]["payload"]
+    h = shared[0]["payload"]["text_hash"]
+    assert shared[0]["id"] == idx.shared_point_id(h)
+    # The first copy got a per-path point; the second copy replaced it with the shared one, the third added nothing.
+    first = [p for p in points if p["payload"].get("path") in copies]
+    assert len(first) == 1 and id_deletes == [[first[0]["id"]]]
+    assert stats.get("chunks_shared") == 2
+    assert sorted(r[0] for r in snip.execute("SELECT path FROM chunks WHERE text_hash = ?", (h,))) == copies
+    assert len(_complete_paths(env["conn"])) == 10
+
+    # Once no file holds the text, the end-of-run sweep drops the shared point.
+    assert idx.gc_shared_points(snip) == 0
+    idx.prune_paths(env["conn"], snip, copies, stats)
+    assert idx.gc_shared_points(snip) == 1
+    assert id_deletes[-1] == [shared[0]["id"]]
+    assert snip.execute("SELECT COUNT(*) FROM shared_points").fetchone()[0] == 0
+    snip.close()
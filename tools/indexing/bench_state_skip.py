@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark the incremental skip check of index_dropbox_qdrant.py on an unchanged tree.
+
+Creates N small files in a temp dir, marks them all complete in a throwaway state DB,
+then times prepare_file() over the tree with per-file SELECTs vs the preloaded StateIndex.
+Nothing touches Qdrant or the embedding provider.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import index_dropbox_qdrant as idx  # noqa: E402
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark incremental skip throughput (files/sec)")
+    ap.add_argument("--files", type=int, default=20000)
+    ap.add_argument("--per-dir", type=int, default=500)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "tree"
+        for i in range(args.files):
+            d = root / f"d{i // max(1, args.per_dir):05d}"
+            if i % max(1, args.per_dir) == 0:
+                d.mkdir(parents=True)
+            (d / f"f{i:07d}.txt").write_text("x", encoding="utf-8")
+
+        idx.STATE_DB = str(Path(tmp) / "state.sqlite")
+        idx.LOG_PATH = str(Path(tmp) / "bench.log")
+        idx.OCR_SIDECAR_DIR = str(Path(tmp) / "ocr")
+        Path(idx.OCR_SIDECAR_DIR).mkdir()
+        conn = idx.ensure_state_db()
+        cfg = "bench"
+        roots = [str(root)]
+        for p in idx.iter_files(roots):
+            st = p.stat()
+            idx.set_state(conn, str(p), st.st_size, int(st.st_mtime), 0, 0, cfg, True, "bench")
+        conn.commit()
+
+        results = []
+        for mode in ("per_file_select", "preloaded"):
+            stats = idx.RunStats()
+            t0 = time.perf_counter()
+            state_index = idx.load_state_index(conn, cfg) if mode == "preloaded" else None
+            t_load = time.perf_counter() - t0
+            for p, st in idx.walk_files(roots):
+                idx.prepare_file(conn, p, roots, cfg, stats, state_index, st)
+            secs = time.perf_counter() - t0
+            results.append(
+                {
+                    "mode": mode,
+                    "files": stats.get("files_seen"),
+                    "skipped": stats.get("skipped_incremental"),
+                    "load_seconds": round(t_load, 3),
+                    "seconds": round(secs, 3),
+                    "files_per_second": round(stats.get("files_seen") / secs, 1) if secs else None,
+                }
+            )
+        conn.close()
+
+    print(json.dumps({"ok": True, "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
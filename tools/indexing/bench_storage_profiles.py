@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Compare QDRANT_STORAGE_PROFILE settings on copies of an existing collection.
+
+For each profile, the points of --source (or the first --sample of them) are copied into
+<source>__bench_<profile>, created with that profile's settings. Once the optimizer is done, the eval
+queries (eval_index.py format) run against the copy. Reported per profile:
+- recall@k against an exact, unquantized search of the same copy;
+- the eval pass rate;
+- search latency. The query embedding is computed once per query and not timed.
+The copies are deleted afterwards unless --keep is given.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import eval_index as ev  # noqa: E402
+import index_dropbox_qdrant as idx  # noqa: E402
+
+
+def copy_points(src: str, dst: str, sample: int) -> int:
+    offset: Any = None
+    copied = 0
+    while True:
+        body: Dict[str, Any] = {"limit": 256, "with_payload": True, "with_vector": True}
+        if offset is not None:
+            body["offset"] = offset
+        res = idx.qdrant_post(f"/collections/{src}/points/scroll", body).get("result", {})
+        points = [{"id": p["id"], "vector": p["vector"], "payload": p.get("payload") or {}} for p in res.get("points", [])]
+        if sample:
+            points = points[: max(0, sample - copied)]
+        if points:
+            idx.qdrant_put(f"/collections/{dst}/points{idx.qdrant_params(wait=True)}", {"points": points})
+        copied += len(points)
+        offset = res.get("next_page_offset")
+        if offset is None or (sample and copied >= sample):
+            return copied
+
+
+def wait_green(name: str, timeout_s: float) -> bool:
+    t0 = time.time()
+    while time.time() - t0 < timeout_s:
+        if idx.qdrant_get(f"/collections/{name}").get("result", {}).get("status") == "green":
+            return True
+        time.sleep(2)
+    return False
+
+
+def search(name: str, vec: List[float], k: int, params: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], float]:
+    body: Dict[str, Any] = {"vector": vec, "limit": k, "with_payload": ["path", "preview", "shared", "text_hash"]}
+    if params:
+        body["params"] = params
+    t0 = time.perf_counter()
+    res = idx.qdrant_post(f"/collections/{name}/points/search", body).get("result", []) or []
+    return res, (time.perf_counter() - t0) * 1000
+
+
+def drop_collection(name: str) -> None:
+    if idx.collection_exists(name):
+        idx.qdrant_check(idx.http_json("DELETE", f"{idx.QDRANT_URL}/collections/{name}", headers=idx.qdrant_headers()))
+
+
+def bench_profile(
+    source: str,
+    profile: str,
+    size: int,
+    queries: List[Tuple[str, List[str], List[float]]],
+    args: argparse.Namespace,
+    snip_conn: Optional[sqlite3.Connection],
+) -> Dict[str, Any]:
+    name = f"{source}__bench_{profile}"
+    drop_collection(name)
+    config = idx.collection_config(profile, size)
+    idx.qdrant_put(f"/collections/{name}", config)
+    t0 = time.time()
+    points = copy_points(source, name, args.sample)
+    green = wait_green(name, args.timeout)
+    build_s = round(time.time() - t0, 1)
+
+    params: Dict[str, Any] = {}
+    if args.hnsw_ef:
+        params["hnsw_ef"] = args.hnsw_ef
+    if "quantization_config" in config:
+        params["quantization"] = {"rescore": True, "oversampling": args.oversampling}
+    exact = {"exact": True, "quantization": {"ignore": True}}
+
+    if queries:
+        search(name, queries[0][2], args.k, params)  # warm-up
+    recalls: List[float] = []
+    lat_ms: List[float] = []
+    passed = 0
+    for _q, expect_any, vec in queries:
+        # Fetched like search_dropbox_index.py does, so the pass rate scores the page it would print.
+        hits, ms = search(name, vec, ev.search_limit(args.k), params)
+        truth, _ = search(name, vec, args.k, exact)
+        lat_ms.append(ms)
+        want = {str(h["id"]) for h in truth}
+        recalls.append(len(want & {str(h["id"]) for h in hits[: args.k]}) / max(1, len(want)))
+        # Copies keep the source's point IDs and text hashes, so the source's snippets DB resolves them.
+        hits = ev.with_snippet_previews(snip_conn, ev.search_page(snip_conn, hits, args.k))
+        if not expect_any or any(ev.is_match(h, expect_any) for h in hits):
+            passed += 1
+    if not args.keep:
+        drop_collection(name)
+    lat_ms.sort()
+    return {
+        "profile": profile,
+        "points": points,
+        "green": green,
+        "build_s": build_s,
+        f"recall_at_{args.k}": round(sum(recalls) / max(1, len(recalls)), 4),
+        "pass_rate": round(passed / max(1, len(queries)), 4),
+        "avg_ms": round(sum(lat_ms) / max(1, len(lat_ms)), 1),
+        "p95_ms": round(lat_ms[int(0.95 * (len(lat_ms) - 1))], 1) if lat_ms else 0,
+        "search_params": params,
+        "config": config,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark recall and latency of Qdrant storage profiles")
+    ap.add_argument("--source", default="", help="collection or alias to copy (default: QDRANT_ALIAS or QDRANT_COLLECTION)")
+    ap.add_argument("--queries", required=True, help="eval queries (JSONL, eval_index.py format)")
+    ap.add_argument("--profiles", default=",".join(idx.STORAGE_PROFILES), help="comma-separated profile names")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--sample", type=int, default=0, help="copy at most N points (0 = all)")
+    ap.add_argument("--oversampling", type=float, default=2.0, help="search oversampling for quantized profiles")
+    ap.add_argument("--hnsw-ef", type=int, default=0, help="search hnsw_ef (0 = collection default)")
+    ap.add_argument("--timeout", type=float, default=1800, help="seconds to wait for each copy to finish indexing")
+    ap.add_argument("--keep", action="store_true", help="keep the benchmark collections")
+    args = ap.parse_args()
+
+    source = args.source or idx.ALIAS or idx.COLLECTION
+    source = idx.qdrant_aliases().get(source, source)
+    info = idx.qdrant_get(f"/collections/{source}").get("result", {})
+    size = int(info.get("config", {}).get("params", {}).get("vectors", {}).get("size") or 0)
+    if not size:
+        print(f"Cannot read the vector size of '{source}'.")
+        return 2
+    queries: List[Tuple[str, List[str], List[float]]] = []
+    for item in ev.load_queries(Path(args.queries)):
+        q = str(item.get("query") or "").strip()
+        if not q:
+            continue
+        expect_any = item.get("expect_any") or []
+        if isinstance(expect_any, str):
+            expect_any = [expect_any]
+        queries.append((q, [str(x) for x in expect_any if str(x).strip()], ev.embed_query(q)))
+    if not queries:
+        print("No queries found.")
+        return 2
+
+    snip_conn = ev.snippets_connect(source)
+    print(json.dumps({"source": source, "points": int(info.get("points_count") or 0), "vector_size": size, "queries": len(queries)}))
+    for profile in [p.strip() for p in args.profiles.split(",") if p.strip()]:
+        print(json.dumps(bench_profile(source, profile, size, queries, args, snip_conn)), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
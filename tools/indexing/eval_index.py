@@ -3,6 +3,7 @@ import os
 import sys
 import json
 import time
+import sqlite3
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 from urllib.parse import urlencode
@@ -10,7 +11,12 @@ from urllib.parse import urlencode
 
 QDRANT_URL = os.environ.get("QDRANT_URL", "http://127.0.0.1:6333")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY") or os.environ.get("QDRANT_APIKEY")
-COLLECTION = os.environ.get("QDRANT_COLLECTION", "dropbox_semantic_index")
+ALIAS = os.environ.get("QDRANT_ALIAS", "")
+COLLECTION = os.environ.get("QDRANT_COLLECTION") or ALIAS or "dropbox_semantic_index"
+SNIPPETS_DB = os.environ.get(
+    "QDRANT_SNIPPETS_DB",
+    str(Path.cwd() / ".cache" / "qdrant_dropbox_snippets.sqlite"),
+)
 
 EMBEDDING_PROVIDER = os.environ.get("QDRANT_EMBEDDING_PROVIDER", "auto").lower()
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -19,6 +25,12 @@ OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "nomic-embed-text")
 OLLAMA_EMBED_ENDPOINT = os.environ.get("OLLAMA_EMBED_ENDPOINT", "/api/embed")
 
+# Search-time settings for quantized collections (QDRANT_STORAGE_PROFILE=sq8|binary) and HNSW recall.
+SEARCH_HNSW_EF = int(os.environ.get("QDRANT_SEARCH_HNSW_EF", "0"))  # 0 = collection default
+SEARCH_OVERSAMPLING = float(os.environ.get("QDRANT_SEARCH_OVERSAMPLING", "0"))  # 0 = Qdrant default
+SEARCH_RESCORE = os.environ.get("QDRANT_SEARCH_RESCORE", "1") != "0"
+SEARCH_EXPAND_MAX = int(os.environ.get("QDRANT_SEARCH_EXPAND_MAX", "20"))  # files listed per shared chunk hit
+
 HTTP_CONNECT_TIMEOUT = float(os.environ.get("INDEX_HTTP_CONNECT_TIMEOUT", "3"))
 HTTP_MAX_TIME = float(os.environ.get("INDEX_HTTP_MAX_TIME", "60"))
 
@@ -133,12 +145,28 @@ def embed_query(text: str) -> List[float]:
     raise RuntimeError(f"Unsupported provider: {provider}")
 
 
+def search_params() -> Dict[str, Any]:
+    params: Dict[str, Any] = {}
+    if SEARCH_HNSW_EF > 0:
+        params["hnsw_ef"] = SEARCH_HNSW_EF
+    if SEARCH_OVERSAMPLING > 0 or not SEARCH_RESCORE:
+        quant: Dict[str, Any] = {"rescore": SEARCH_RESCORE}
+        if SEARCH_OVERSAMPLING > 0:
+            quant["oversampling"] = SEARCH_OVERSAMPLING
+        params["quantization"] = quant
+    return params
+
+
 def qdrant_vector_search(vec: List[float], limit: int) -> List[Dict[str, Any]]:
-    payload = {
+    payload: Dict[str, Any] = {
         "vector": vec,
         "limit": int(limit),
-        "with_payload": True,
+        # What is_match() reads; slim collections have no preview, shared chunk points no path.
+        "with_payload": ["path", "preview", "shared", "text_hash"],
     }
+    params = search_params()
+    if params:
+        payload["params"] = params
     res = http_json(
         "POST",
         f"{QDRANT_URL}/collections/{COLLECTION}/points/search{qdrant_params()}",
@@ -148,6 +176,104 @@ def qdrant_vector_search(vec: List[float], limit: int) -> List[Dict[str, Any]]:
     return res.get("result", []) or []
 
 
+def snippets_db_path(collection: str) -> str:
+    # With QDRANT_ALIAS the indexer keeps one snippets DB per versioned collection: use the one behind `collection`.
+    if not ALIAS or "QDRANT_SNIPPETS_DB" in os.environ:
+        return SNIPPETS_DB
+    try:
+        res = http_json("GET", f"{QDRANT_URL}/aliases", headers=qdrant_headers())
+        aliases = {a["alias_name"]: a["collection_name"] for a in res.get("result", {}).get("aliases", [])}
+        collection = aliases.get(collection, collection)
+    except Exception:
+        pass
+    p = Path(SNIPPETS_DB)
+    return str(p.with_name(f"{p.stem}.{collection}{p.suffix}"))
+
+
+def snippets_connect(collection: str) -> Optional[sqlite3.Connection]:
+    p = Path(snippets_db_path(collection))
+    if not p.exists():
+        return None
+    return sqlite3.connect(str(p), timeout=30)
+
+
+def expand_shared(conn: Optional[sqlite3.Connection], results: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    QDRANT_SHARED_CHUNKS: replace each shared chunk hit by its files (snippets rows with that text_hash), exactly
+    as search_dropbox_index.py does: at most QDRANT_SEARCH_EXPAND_MAX files per hit, and a slot of the `limit`
+    kept for every hit ranked below it. Without the snippets DB shared hits stay as they are.
+    """
+    if conn is None:
+        return results
+    out: List[Dict[str, Any]] = []
+    seen: set = set()
+    for i, r in enumerate(results):
+        if len(out) >= limit:
+            break
+        payload = r.get("payload") or {}
+        if not payload.get("shared"):
+            if str(r.get("id")) not in seen:
+                seen.add(str(r.get("id")))
+                out.append(r)
+            continue
+        h = str(payload.get("text_hash") or "")
+        total = conn.execute("SELECT COUNT(*) FROM chunks WHERE text_hash = ?", (h,)).fetchone()[0]
+        later = min(len(results) - i - 1, limit - len(out) - 1)  # slots kept for the hits ranked below
+        cur = conn.execute(
+            "SELECT point_id, path, chunk_index, chunk_total FROM chunks WHERE text_hash = ? ORDER BY path LIMIT ?",
+            (h, max(1, min(SEARCH_EXPAND_MAX, limit - len(out) - later))),
+        )
+        for pid, path, chunk_index, chunk_total in cur.fetchall():
+            if str(pid) in seen:
+                continue
+            seen.add(str(pid))
+            out.append(
+                {
+                    "id": str(pid),
+                    "payload": {
+                        "path": path,
+                        "chunk_index": int(chunk_index or 0),
+                        "chunk_total": int(chunk_total or 0),
+                        "preview": payload.get("preview") or "",
+                    },
+                    "score": r.get("score"),
+                    "source": r.get("source"),
+                    "shared_files": int(total),
+                }
+            )
+    return out
+
+
+def search_limit(k: int) -> int:
+    # search_dropbox_index.py asks Qdrant for (and expands) at least 10 hits, whatever --limit is.
+    return max(10, k)
+
+
+def search_page(conn: Optional[sqlite3.Connection], results: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """
+    The top-k page search_dropbox_index.py would print for vector hits fetched with search_limit(k): shared
+    hits expanded against the same max(10, k) limit, then cut to k.
+    """
+    return expand_shared(conn, results, search_limit(k))[:k]
+
+
+def with_snippet_previews(conn: Optional[sqlite3.Connection], results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Previews from the snippets DB, as search_dropbox_index.py shows them. Slim collections store none in
+    Qdrant, and full ones are cut at QDRANT_PAYLOAD_PREVIEW_MAX_CHARS: one source keeps their scores comparable.
+    """
+    if conn is None or not results:
+        return results
+    pids = [str(r.get("id") or "") for r in results]
+    qs = ",".join(["?"] * len(pids))
+    texts = dict(conn.execute(f"SELECT point_id, text FROM chunks WHERE point_id IN ({qs})", pids).fetchall())
+    for r in results:
+        txt = texts.get(str(r.get("id") or ""))
+        if txt:
+            r.setdefault("payload", {})["preview"] = str(txt)[:800]
+    return results
+
+
 def load_queries(path: Path) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
     for line in path.read_text(encoding="utf-8", errors="ignore").splitlines():
@@ -167,13 +293,20 @@ def is_match(result: Dict[str, Any], expect_any: List[str]) -> bool:
 
 
 def main() -> int:
+    global COLLECTION
     if "--queries" not in sys.argv:
-        print("Usage: eval_index.py --queries <queries.jsonl> [--k N]")
+        print("Usage: eval_index.py --queries <queries.jsonl> [--k N] [--collection NAME] [--min-pass-rate F]")
         return 2
     qpath = Path(sys.argv[sys.argv.index("--queries") + 1])
     k = 10
     if "--k" in sys.argv:
         k = int(sys.argv[sys.argv.index("--k") + 1])
+    if "--collection" in sys.argv:
+        # Evaluate a rebuild before switching the alias to it.
+        COLLECTION = sys.argv[sys.argv.index("--collection") + 1]
+    min_pass_rate = -1.0
+    if "--min-pass-rate" in sys.argv:
+        min_pass_rate = float(sys.argv[sys.argv.index("--min-pass-rate") + 1])
     if not qpath.exists():
         print(f"Missing queries file: {qpath}")
         return 2
@@ -186,6 +319,7 @@ def main() -> int:
     total = 0
     passed = 0
     lat_ms: List[int] = []
+    snip_conn = snippets_connect(COLLECTION)
 
     for item in queries:
         q = str(item.get("query") or "").strip()
@@ -198,8 +332,9 @@ def main() -> int:
         kk = int(item.get("k") or k)
         t0 = time.time()
         vec = embed_query(q)
-        results = qdrant_vector_search(vec, kk)
+        results = qdrant_vector_search(vec, search_limit(kk))
         dt = int((time.time() - t0) * 1000)
+        results = with_snippet_previews(snip_conn, search_page(snip_conn, results, kk))
         lat_ms.append(dt)
         total += 1
         ok = True if not expect_any else any(is_match(r, expect_any) for r in results)
@@ -209,8 +344,18 @@ def main() -> int:
 
     avg = int(sum(lat_ms) / max(1, len(lat_ms)))
     p95 = sorted(lat_ms)[int(0.95 * (len(lat_ms) - 1))] if lat_ms else 0
-    print(json.dumps({"total": total, "passed": passed, "pass_rate": (passed / max(1, total)), "avg_ms": avg, "p95_ms": p95}))
-    return 0
+    pass_rate = passed / max(1, total)
+    print(json.dumps({
+        "collection": COLLECTION,
+        "total": total,
+        "passed": passed,
+        "pass_rate": pass_rate,
+        "avg_ms": avg,
+        "p95_ms": p95,
+        "previews": "snippets_db" if snip_conn is not None else "payload",
+    }))
+    # Non-zero exit below the gate, so `eval_index.py ... && qdrant_alias.py switch ...` only promotes a passing build.
+    return 1 if pass_rate < min_pass_rate else 0
 
 
 if __name__ == "__main__":
@@ -25,8 +25,12 @@ def main() -> int:
 
     # Low-impact mode: this wrapper is intended for periodic catch-up runs after completion
     # (or after a crash) to pick up newly added/changed files. The heavy work is in the indexer.
+    # --watch: after the catch-up walk, keep running and index changes as they happen (QDRANT_WATCH=1).
+    # Run it under a KeepAlive launchd agent instead of StartCalendarInterval.
     cmd = [sys.executable, "scripts/index_dropbox_qdrant.py"]
     env = dict(os.environ)
+    if "--watch" in sys.argv[1:]:
+        env["QDRANT_WATCH"] = "1"
     return subprocess.call(cmd, env=env)
 
 
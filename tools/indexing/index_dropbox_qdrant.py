@@ -10,12 +10,27 @@ import uuid
 import sqlite3
 import shutil
 import zipfile
+import tempfile
+import gzip
+import http.client
+import queue
+import threading
+import multiprocessing
+import errno
+import select
+import signal
+import struct
+import re
+from array import array
 from io import BytesIO
-from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, Tuple, Dict, Any, List, Optional
-from urllib.parse import urlencode
+from stat import S_ISREG
+from typing import IO, Iterable, Iterator, Tuple, Dict, Any, List, Optional, Set, Union
+from urllib.parse import urlencode, urlsplit
 from xml.etree import ElementTree as ET
 
 INDEXER_VERSION = "2026-02-07.ollama-embed-batch-state-v4-snippets-ocr-ooxml"
@@ -23,18 +38,37 @@ INDEXER_VERSION = "2026-02-07.ollama-embed-batch-state-v4-snippets-ocr-ooxml"
 QDRANT_URL = os.environ.get("QDRANT_URL", "http://127.0.0.1:6333")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY") or os.environ.get("QDRANT_APIKEY")
 COLLECTION = os.environ.get("QDRANT_COLLECTION", "dropbox_semantic_index")
+ALIAS = os.environ.get("QDRANT_ALIAS", "")  # stable name searches use; COLLECTION is a versioned collection behind it
 VECTOR_SIZE = int(os.environ.get("QDRANT_VECTOR_SIZE", "0"))  # 0 = auto-detect
 BATCH_SIZE = int(os.environ.get("QDRANT_BATCH_SIZE", "16"))  # points per upsert
 MAX_BYTES = int(os.environ.get("QDRANT_MAX_BYTES", str(2 * 1024 * 1024)))  # 2MB per file
 MAX_CHARS = int(os.environ.get("QDRANT_MAX_CHARS", "12000"))
 CHUNK_SIZE = int(os.environ.get("QDRANT_CHUNK_SIZE", "2000"))
 CHUNK_OVERLAP = int(os.environ.get("QDRANT_CHUNK_OVERLAP", "200"))
+CHUNK_MODE = os.environ.get("QDRANT_CHUNK_MODE", "fixed").lower()  # fixed | cdc (content-defined boundaries)
 PDF_MAX_PAGES = int(os.environ.get("QDRANT_PDF_MAX_PAGES", "30"))
+# Sampled pages closer than this are pulled in one pdftotext run (the pages in between are read and dropped).
+PDF_RANGE_MAX_GAP = int(os.environ.get("QDRANT_PDF_RANGE_MAX_GAP", "8"))
+# Upper bound on pdftotext runs for the sampled pages of one PDF: the smallest gaps are merged until it holds.
+PDF_MAX_RUNS = int(os.environ.get("QDRANT_PDF_MAX_RUNS", "4"))  # 0 = no bound (gap rule only)
+# PDFs of unknown length larger than this ask pdfinfo first instead of a speculative run over the first pages.
+PDF_HEAD_RUN_MAX_BYTES = int(os.environ.get("QDRANT_PDF_HEAD_RUN_MAX_BYTES", str(4 * 1024 * 1024)))
+PDF_PAGE_CACHE = os.environ.get("QDRANT_PDF_PAGE_CACHE", "1") != "0"  # page counts by content signature in the state DB
 SAMPLE_WINDOWS = int(os.environ.get("QDRANT_SAMPLE_WINDOWS", "5"))
 MAX_CHUNKS_PER_FILE = int(os.environ.get("QDRANT_MAX_CHUNKS_PER_FILE", "32"))
 XLSX_MAX_CELLS = int(os.environ.get("QDRANT_XLSX_MAX_CELLS", "20000"))
+ZIP_MEMBERS = os.environ.get("QDRANT_ZIP_MEMBERS", "0") == "1"  # index text of ZIP members instead of the path only
+ZIP_MAX_MEMBERS = int(os.environ.get("QDRANT_ZIP_MAX_MEMBERS", "64"))
+ZIP_MAX_BYTES = int(os.environ.get("QDRANT_ZIP_MAX_BYTES", str(64 * 1024 * 1024)))  # uncompressed bytes read per archive
+ZIP_MEMBER_MAX_BYTES = int(os.environ.get("QDRANT_ZIP_MEMBER_MAX_BYTES", str(16 * 1024 * 1024)))
 EMBED_CONCURRENCY = int(os.environ.get("QDRANT_EMBED_CONCURRENCY", "2"))
 EMBED_CACHE_SIZE = int(os.environ.get("QDRANT_EMBED_CACHE_SIZE", "5000"))
+EMBED_CACHE_PERSIST = os.environ.get("QDRANT_EMBED_CACHE_PERSIST", "1") != "0"
+EMBED_CACHE_DB = os.environ.get(
+    "QDRANT_EMBED_CACHE_DB",
+    str(Path.cwd() / ".cache" / "qdrant_embed_cache.sqlite"),
+)
+EMBED_CACHE_DB_MAX_MB = int(os.environ.get("QDRANT_EMBED_CACHE_DB_MAX_MB", "4096"))  # 0 = unbounded
 DEDUP_EMBEDDINGS = os.environ.get("QDRANT_DEDUP_EMBEDDINGS", "1") != "0"
 DEDUP_FILES = os.environ.get("QDRANT_DEDUP_FILES", "1") != "0"
 DEDUP_HASH_BYTES = int(os.environ.get("QDRANT_DEDUP_HASH_BYTES", str(256 * 1024)))
@@ -42,11 +76,41 @@ DEDUP_HASH_SUFFIX_BYTES = int(os.environ.get("QDRANT_DEDUP_HASH_SUFFIX_BYTES", s
 CREATE_PAYLOAD_INDEXES = os.environ.get("QDRANT_CREATE_PAYLOAD_INDEXES", "1") != "0"
 PAYLOAD_INDEX_ON_DISK = os.environ.get("QDRANT_PAYLOAD_INDEX_ON_DISK", "0") == "1"
 MTIME_IS_PRINCIPAL = os.environ.get("QDRANT_MTIME_IS_PRINCIPAL", "1") != "0"
+STORAGE_PROFILE = os.environ.get("QDRANT_STORAGE_PROFILE", "default")  # see STORAGE_PROFILES; applied to new collections
+HNSW_M = int(os.environ.get("QDRANT_HNSW_M", "0"))  # 0 = profile value
+HNSW_EF_CONSTRUCT = int(os.environ.get("QDRANT_HNSW_EF_CONSTRUCT", "0"))  # 0 = profile value
+INDEXING_THRESHOLD_KB = int(os.environ.get("QDRANT_INDEXING_THRESHOLD_KB", "0"))  # 0 = profile value
 QDRANT_WAIT = os.environ.get("QDRANT_WAIT", "1") != "0"
 QDRANT_ORDERING = os.environ.get("QDRANT_ORDERING", "weak").lower()
 AUDIT_PATH = os.environ.get("QDRANT_AUDIT_PATH", "/tmp/qdrant_dropbox_audit.jsonl")
 LOG_PATH = os.environ.get("QDRANT_LOG_PATH", "/tmp/qdrant_dropbox_index.log")
 MAX_FILES = int(os.environ.get("QDRANT_MAX_FILES", "0"))  # 0 = no limit
+STATE_PRELOAD = os.environ.get("QDRANT_STATE_PRELOAD", "1") != "0"
+WALK_PROGRESS_EVERY = int(os.environ.get("QDRANT_WALK_PROGRESS_EVERY", "10000"))  # 0 = no walk_progress lines
+WALK_WORKERS = int(os.environ.get("QDRANT_WALK_WORKERS", "1"))  # >1 = list directories concurrently
+WALK_PREFETCH_PER_WORKER = int(os.environ.get("QDRANT_WALK_PREFETCH_PER_WORKER", "32"))
+WATCH = os.environ.get("QDRANT_WATCH", "0") == "1"  # keep running and index changes as they happen
+WATCH_BACKEND = os.environ.get("QDRANT_WATCH_BACKEND", "auto").lower()  # auto | inotify | snapshot
+WATCH_POLL_SECONDS = float(os.environ.get("QDRANT_WATCH_POLL_SECONDS", "60"))  # snapshot backend only
+WATCH_DEBOUNCE_SECONDS = float(os.environ.get("QDRANT_WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_MAX_DELAY_SECONDS = float(os.environ.get("QDRANT_WATCH_MAX_DELAY_SECONDS", "30"))
+PRUNE = os.environ.get("QDRANT_PRUNE", "1") != "0"  # sweep points/state of files deleted from the roots
+PRUNE_BATCH_SIZE = int(os.environ.get("QDRANT_PRUNE_BATCH_SIZE", "256"))  # paths per filtered delete
+PRUNE_MAX_FRACTION = float(os.environ.get("QDRANT_PRUNE_MAX_FRACTION", "0.2"))  # refuse larger sweeps
+UPSERT_INFLIGHT = int(os.environ.get("QDRANT_UPSERT_INFLIGHT", "0"))  # >0 = background upserts, up to N batches in flight
+MOVE_DETECTION = os.environ.get("QDRANT_MOVE_DETECTION", "1") != "0"  # re-key points of moved files (needs QDRANT_DEDUP_FILES)
+CHUNK_REUSE = os.environ.get("QDRANT_CHUNK_REUSE", "1") != "0"  # reuse vectors of unchanged chunks in edited files
+NEAR_DUP = os.environ.get("QDRANT_NEAR_DUP", "0") == "1"  # index near-identical documents once (MinHash + LSH)
+NEAR_DUP_THRESHOLD = float(os.environ.get("QDRANT_NEAR_DUP_THRESHOLD", "0.9"))  # estimated Jaccard similarity
+NEAR_DUP_MIN_SHINGLES = int(os.environ.get("QDRANT_NEAR_DUP_MIN_SHINGLES", "64"))  # shorter texts are never aliased
+NEAR_DUP_SHINGLE_WORDS = int(os.environ.get("QDRANT_NEAR_DUP_SHINGLE_WORDS", "5"))
+MIGRATE_FROM_SNIPPETS = os.environ.get("QDRANT_MIGRATE_FROM_SNIPPETS", "0") == "1"  # re-embed snippets DB text, no walk
+MIGRATE_BATCH_ROWS = int(os.environ.get("QDRANT_MIGRATE_BATCH_ROWS", "2048"))  # chunk rows read and embedded per round
+PIPELINE = os.environ.get("QDRANT_PIPELINE", "0") == "1"
+PIPELINE_QUEUE_SIZE = int(os.environ.get("QDRANT_PIPELINE_QUEUE_SIZE", "64"))  # items per stage queue
+PIPELINE_REPORT_SECONDS = float(os.environ.get("QDRANT_PIPELINE_REPORT_SECONDS", "60"))
+EXTRACT_WORKERS = int(os.environ.get("QDRANT_EXTRACT_WORKERS", "0"))  # 0 = extract in-process; >0 implies QDRANT_PIPELINE=1
+EXTRACT_TIMEOUT_SECONDS = float(os.environ.get("QDRANT_EXTRACT_TIMEOUT_SECONDS", "300"))
 STATE_DB = os.environ.get(
     "QDRANT_STATE_DB",
     str(Path.cwd() / ".cache" / "qdrant_dropbox_state.sqlite"),
@@ -60,6 +124,8 @@ SNIPPETS_DB = os.environ.get(
 SNIPPET_MAX_CHARS = int(os.environ.get("QDRANT_SNIPPET_MAX_CHARS", "800"))  # 0 = store full text (not recommended)
 SNIPPETS_FTS = os.environ.get("QDRANT_SNIPPETS_FTS", "1") != "0"
 PAYLOAD_PREVIEW_MAX_CHARS = int(os.environ.get("QDRANT_PAYLOAD_PREVIEW_MAX_CHARS", "400"))  # 0 = store full chunk text
+SLIM_PAYLOAD = os.environ.get("QDRANT_SLIM_PAYLOAD", "0") == "1"  # no preview/size in Qdrant; previews from the snippets DB
+SHARED_CHUNKS = os.environ.get("QDRANT_SHARED_CHUNKS", "0") == "1"  # one point per chunk text repeated across files
 
 OCR_SIDECAR_DIR = os.environ.get(
     "QDRANT_OCR_SIDECAR_DIR",
@@ -95,6 +161,16 @@ OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "5m")
 OLLAMA_USE_BATCH = os.environ.get("OLLAMA_USE_BATCH", "1") != "0"
 OLLAMA_BATCH_SIZE = int(os.environ.get("OLLAMA_BATCH_SIZE", "32"))
 EMBED_MAX_CHARS = int(os.environ.get("QDRANT_EMBED_MAX_CHARS", "8000"))  # 0 = no clamp
+EMBED_ACCUMULATE = os.environ.get("QDRANT_EMBED_ACCUMULATE", "0") == "1"
+EMBED_ACCUMULATE_CHUNKS = int(os.environ.get("QDRANT_EMBED_ACCUMULATE_CHUNKS", "0"))  # 0 = OLLAMA_BATCH_SIZE
+EMBED_ACCUMULATE_MAX_WAIT_MS = int(os.environ.get("QDRANT_EMBED_ACCUMULATE_MAX_WAIT_MS", "2000"))
+# AIMD tuning of embed batch size, embed concurrency and upsert batch size from observed latency/throughput.
+ADAPTIVE = os.environ.get("QDRANT_ADAPTIVE", "0") == "1"
+ADAPTIVE_WINDOW = int(os.environ.get("QDRANT_ADAPTIVE_WINDOW", "8"))  # requests per decision
+ADAPTIVE_MAX_LATENCY_MS = int(os.environ.get("QDRANT_ADAPTIVE_MAX_LATENCY_MS", "20000"))  # 0 = no latency cap
+OLLAMA_BATCH_SIZE_MAX = int(os.environ.get("OLLAMA_BATCH_SIZE_MAX", "256"))
+EMBED_CONCURRENCY_MAX = int(os.environ.get("QDRANT_EMBED_CONCURRENCY_MAX", "8"))
+BATCH_SIZE_MAX = int(os.environ.get("QDRANT_BATCH_SIZE_MAX", "512"))
 
 def discover_dropbox_roots() -> List[str]:
     base = Path.home() / "Library" / "CloudStorage"
@@ -117,6 +193,9 @@ HTTP_CONNECT_TIMEOUT = float(os.environ.get("INDEX_HTTP_CONNECT_TIMEOUT", "3"))
 HTTP_MAX_TIME = float(os.environ.get("INDEX_HTTP_MAX_TIME", "60"))
 HTTP_RETRIES = int(os.environ.get("INDEX_HTTP_RETRIES", "2"))
 HTTP_RETRY_SLEEP_SECONDS = float(os.environ.get("INDEX_HTTP_RETRY_SLEEP_SECONDS", "1"))
+HTTP_KEEPALIVE = os.environ.get("INDEX_HTTP_KEEPALIVE", "1") != "0"
+HTTP_POOL_MAXSIZE = int(os.environ.get("INDEX_HTTP_POOL_MAXSIZE", "8"))  # idle connections kept per host
+HTTP_GZIP_MIN_BYTES = int(os.environ.get("INDEX_HTTP_GZIP_MIN_BYTES", "0"))  # 0 = never gzip request bodies
 
 
 def log(msg: str) -> None:
@@ -126,7 +205,265 @@ def log(msg: str) -> None:
         f.write(line)
 
 
-def http_json(method: str, url: str, payload: Any = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+class Counters:
+    # Thread-safe named counters (pipeline stages update them from several threads).
+    def __init__(self, keys: Iterable[str] = ()) -> None:
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {k: 0 for k in keys}
+
+    def incr(self, key: str, n: int = 1) -> int:
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+            return self.counts[key]
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            return self.counts.get(key, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+
+EMBED_COUNTERS = Counters(["requests", "texts"])
+
+
+class AimdController:
+    """
+    Additive-increase / multiplicative-decrease tuning of one knob (a batch size or a concurrency).
+
+    Callers report every request as (units, seconds, ok). Each `window` observations the controller
+    decides once: any error halves the value, a window whose average request exceeded `max_latency_s`
+    or whose throughput fell more than `tolerance` below the previous window's cuts it by a quarter,
+    otherwise it grows by `step` to probe for a faster setting. Value changes are logged.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        value: int,
+        lo: int,
+        hi: int,
+        step: int = 1,
+        window: int = 8,
+        max_latency_s: float = 0.0,
+        tolerance: float = 0.15,
+    ) -> None:
+        self.name = name
+        self.lo = max(1, int(lo))
+        self.hi = max(self.lo, int(hi))
+        self.value = min(self.hi, max(self.lo, int(value)))
+        self.step = max(1, int(step))
+        self.window = max(1, int(window))
+        self.max_latency_s = max(0.0, float(max_latency_s))
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        self._n = 0
+        self._units = 0
+        self._seconds = 0.0
+        self._errors = 0
+        self.prev_rate = 0.0
+        self.best_rate = 0.0
+        self.best_value = self.value
+        self.observations = 0
+        self.errors = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def get(self) -> int:
+        with self._lock:
+            return self.value
+
+    def observe(self, units: int, seconds: float, ok: bool = True) -> int:
+        with self._lock:
+            self.observations += 1
+            self._n += 1
+            self._seconds += max(0.0, seconds)
+            if ok:
+                self._units += units
+            else:
+                self._errors += 1
+                self.errors += 1
+            if self._n >= self.window:
+                self._decide()
+            return self.value
+
+    def _decide(self) -> None:
+        n, errors = self._n, self._errors
+        rate = self._units / self._seconds if self._seconds > 0 else 0.0
+        latency = self._seconds / n
+        self._n, self._units, self._seconds, self._errors = 0, 0, 0.0, 0
+        old = self.value
+        if errors:
+            new, reason = int(old * 0.5), "errors"
+        elif self.max_latency_s and latency > self.max_latency_s:
+            new, reason = int(old * 0.75), "latency"
+        elif self.prev_rate and rate < self.prev_rate * (1.0 - self.tolerance):
+            new, reason = int(old * 0.75), "throughput_drop"
+        else:
+            new, reason = old + self.step, "probe"
+        new = min(self.hi, max(self.lo, new))
+        # A failing window says nothing about healthy throughput; don't compare the next one against it.
+        self.prev_rate = 0.0 if errors else rate
+        if rate > self.best_rate and not errors:
+            self.best_rate, self.best_value = rate, old
+        if new > old:
+            self.increases += 1
+        elif new < old:
+            self.decreases += 1
+        self.value = new
+        if new != old or reason != "probe":
+            log(
+                f"aimd name={self.name} value={old}->{new} reason={reason} rate={rate:.1f}/s "
+                f"latency_ms={int(latency * 1000)} errors={errors}/{n}"
+            )
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "value": self.value,
+                "lo": self.lo,
+                "hi": self.hi,
+                "observations": self.observations,
+                "errors": self.errors,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "best_value": self.best_value,
+                "best_rate": round(self.best_rate, 1),
+            }
+
+
+# Set by enable_adaptive() when QDRANT_ADAPTIVE=1; None keeps the static env settings.
+EMBED_BATCH_CTL: Optional[AimdController] = None
+EMBED_CONCURRENCY_CTL: Optional[AimdController] = None
+
+
+def enable_adaptive(upsert_batch_size: int) -> AimdController:
+    """Create the embed controllers and return the one for the upsert batch size (owned by the BatchWriter)."""
+    global EMBED_BATCH_CTL, EMBED_CONCURRENCY_CTL
+    max_latency_s = ADAPTIVE_MAX_LATENCY_MS / 1000.0
+    EMBED_BATCH_CTL = AimdController(
+        "embed_batch", OLLAMA_BATCH_SIZE, max(1, OLLAMA_BATCH_SIZE // 8), OLLAMA_BATCH_SIZE_MAX,
+        step=max(1, OLLAMA_BATCH_SIZE // 4), window=ADAPTIVE_WINDOW, max_latency_s=max_latency_s,
+    )
+    # Observed once per multi-batch embed call (wall time), so a per-request latency cap does not apply.
+    EMBED_CONCURRENCY_CTL = AimdController(
+        "embed_concurrency", EMBED_CONCURRENCY, 1, EMBED_CONCURRENCY_MAX, step=1, window=max(2, ADAPTIVE_WINDOW // 2),
+    )
+    return AimdController(
+        "upsert_batch", upsert_batch_size, max(1, upsert_batch_size // 8), max(upsert_batch_size, BATCH_SIZE_MAX),
+        step=max(1, upsert_batch_size // 4), window=ADAPTIVE_WINDOW, max_latency_s=max_latency_s,
+    )
+
+
+def adaptive_report(upsert_ctl: Optional[AimdController]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for ctl in (EMBED_BATCH_CTL, EMBED_CONCURRENCY_CTL, upsert_ctl):
+        if ctl is not None:
+            out[ctl.name] = ctl.report()
+    return out
+
+
+class HttpPool:
+    """
+    Persistent-connection HTTP transport shared by the qdrant_* and embed_* helpers.
+
+    Idle keep-alive connections are kept per (scheme, host, port), so upserts/deletes against
+    the LAN Qdrant and Ollama calls do not pay TCP (and for OpenAI, TLS) setup on every request.
+    """
+
+    def __init__(self, max_idle_per_host: int, keepalive: bool) -> None:
+        self.max_idle_per_host = max(1, max_idle_per_host)
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self.counters = Counters(
+            [
+                "requests",
+                "connections_opened",
+                "connections_reused",
+                "stale_reconnects",
+                "gzip_requests",
+                "gzip_bytes_saved",
+            ]
+        )
+
+    def _acquire(self, key: Tuple[str, str, int]) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        if scheme == "https":
+            conn: http.client.HTTPConnection = http.client.HTTPSConnection(host, port, timeout=HTTP_CONNECT_TIMEOUT)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=HTTP_CONNECT_TIMEOUT)
+        conn.connect()
+        if conn.sock is not None:
+            conn.sock.settimeout(HTTP_MAX_TIME)
+        self.counters.incr("connections_opened")
+        return conn, False
+
+    def _release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        if self.keepalive:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle_per_host:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def request(self, method: str, url: str, body: Optional[bytes], headers: Dict[str, str]) -> Tuple[int, bytes]:
+        u = urlsplit(url)
+        scheme = (u.scheme or "http").lower()
+        key = (scheme, u.hostname or "", int(u.port or (443 if scheme == "https" else 80)))
+        target = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        self.counters.incr("requests")
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, http.client.BadStatusLine) as e:
+                conn.close()
+                if reused:
+                    # The server closed an idle keep-alive connection; retry once on a fresh one.
+                    self.counters.incr("stale_reconnects")
+                    continue
+                raise ConnectionResetError(str(e) or repr(e)) from e
+            except BaseException:
+                conn.close()
+                raise
+            if reused:
+                self.counters.incr("connections_reused")
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return resp.status, data
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for c in conns:
+            try:
+                c.close()
+            except Exception:
+                pass
+
+
+HTTP_POOL = HttpPool(HTTP_POOL_MAXSIZE, HTTP_KEEPALIVE)
+
+
+def http_json(
+    method: str,
+    url: str,
+    payload: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    gzip_body: bool = False,
+) -> Dict[str, Any]:
     """
     Lightweight HTTP JSON helper with retries.
 
@@ -134,10 +471,9 @@ def http_json(method: str, url: str, payload: Any = None, headers: Optional[Dict
     - improves performance (no subprocess per request)
     - avoids curl-specific error strings and timeouts
     - makes retry/timeout behavior consistent across hosts
-    """
-    import socket
-    from urllib import error, request
 
+    Requests go through HTTP_POOL (persistent keep-alive connections).
+    """
     req_headers = {"Content-Type": "application/json"}
     if headers:
         req_headers.update(headers)
@@ -145,35 +481,36 @@ def http_json(method: str, url: str, payload: Any = None, headers: Optional[Dict
     data_bytes: Optional[bytes] = None
     if payload is not None:
         data_bytes = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        if gzip_body and HTTP_GZIP_MIN_BYTES > 0 and len(data_bytes) >= HTTP_GZIP_MIN_BYTES:
+            raw_len = len(data_bytes)
+            data_bytes = gzip.compress(data_bytes, compresslevel=1)
+            req_headers["Content-Encoding"] = "gzip"
+            HTTP_POOL.counters.incr("gzip_requests")
+            HTTP_POOL.counters.incr("gzip_bytes_saved", raw_len - len(data_bytes))
 
     last_err = ""
     for attempt in range(HTTP_RETRIES + 1):
         try:
-            req = request.Request(url, data=data_bytes, headers=req_headers, method=method)
-            with request.urlopen(req, timeout=float(HTTP_MAX_TIME)) as resp:
-                raw = resp.read()
-                body = raw.decode("utf-8", "replace").strip()
-                if body:
-                    try:
-                        return json.loads(body)
-                    except Exception:
-                        return {"_raw": body[:2000]}
-                return {}
-        except error.HTTPError as e:
-            raw = e.read(2000)
-            body = raw.decode("utf-8", "replace").strip()
-            msg = body[:200] if body else str(e)
-            raise RuntimeError(f"HTTP {e.code} {method} {url}: {msg}")
-        except (error.URLError, socket.timeout, TimeoutError, ConnectionResetError, ConnectionAbortedError) as e:
+            status, raw = HTTP_POOL.request(method, url, data_bytes, req_headers)
+        except (OSError, http.client.HTTPException) as e:
             last_err = str(e) or repr(e)
-            retryable = True
-            if attempt < HTTP_RETRIES and retryable:
+            if attempt < HTTP_RETRIES:
                 time.sleep(HTTP_RETRY_SLEEP_SECONDS * (attempt + 1))
                 continue
             break
         except Exception as e:
             last_err = str(e) or repr(e)
             break
+        body = raw.decode("utf-8", "replace").strip()
+        if status < 200 or status >= 300:
+            msg = body[:200] if body else f"status {status}"
+            raise RuntimeError(f"HTTP {status} {method} {url}: {msg}")
+        if body:
+            try:
+                return json.loads(body)
+            except Exception:
+                return {"_raw": body[:2000]}
+        return {}
     raise RuntimeError(last_err or "http_json failed")
 
 
@@ -208,10 +545,10 @@ def qdrant_get(path: str) -> Dict[str, Any]:
 
 
 def qdrant_put(path: str, payload: Any) -> Dict[str, Any]:
-    return qdrant_check(http_json("PUT", QDRANT_URL + path, payload, headers=qdrant_headers()))
+    return qdrant_check(http_json("PUT", QDRANT_URL + path, payload, headers=qdrant_headers(), gzip_body=True))
 
 def qdrant_post(path: str, payload: Any) -> Dict[str, Any]:
-    return qdrant_check(http_json("POST", QDRANT_URL + path, payload, headers=qdrant_headers()))
+    return qdrant_check(http_json("POST", QDRANT_URL + path, payload, headers=qdrant_headers(), gzip_body=True))
 
 
 def collection_exists(name: str) -> bool:
@@ -223,7 +560,136 @@ def collection_exists(name: str) -> bool:
         return False
 
 
+def qdrant_aliases() -> Dict[str, str]:
+    r = qdrant_get("/aliases")
+    return {a["alias_name"]: a["collection_name"] for a in r.get("result", {}).get("aliases", [])}
+
+
+def switch_alias(alias: str, collection: str) -> str:
+    """Point alias at collection in one atomic request; returns the previous target ("" if the alias is new)."""
+    prev = qdrant_aliases().get(alias, "")
+    actions: List[Dict[str, Any]] = []
+    if prev:
+        actions.append({"delete_alias": {"alias_name": alias}})
+    actions.append({"create_alias": {"collection_name": collection, "alias_name": alias}})
+    qdrant_post("/collections/aliases", {"actions": actions})
+    return prev
+
+
+def collection_db_path(path: str, collection: str) -> str:
+    # .cache/qdrant_dropbox_state.sqlite -> .cache/qdrant_dropbox_state.<collection>.sqlite
+    p = Path(path)
+    return str(p.with_name(f"{p.stem}.{collection}{p.suffix}"))
+
+
+def alias_target(live: str) -> Tuple[str, str, str]:
+    """
+    QDRANT_ALIAS: the versioned collection a process works on, with its state and snippets DB paths.
+
+    Without QDRANT_COLLECTION that is the live target itself, so scheduled runs keep it fresh. With it, a
+    run builds a collection searches do not see until the alias is switched. Each collection gets its own
+    state and snippets DB (unless QDRANT_STATE_DB / QDRANT_SNIPPETS_DB are set), so a rebuild never
+    invalidates the incremental state of the live collection.
+    """
+    collection = COLLECTION if "QDRANT_COLLECTION" in os.environ else (live or f"{ALIAS}_v1")
+    if collection == ALIAS:
+        raise RuntimeError(f"QDRANT_COLLECTION must name a versioned collection, not the alias '{ALIAS}'")
+    state_db = STATE_DB if "QDRANT_STATE_DB" in os.environ else collection_db_path(STATE_DB, collection)
+    snippets_db = SNIPPETS_DB if "QDRANT_SNIPPETS_DB" in os.environ else collection_db_path(SNIPPETS_DB, collection)
+    return collection, state_db, snippets_db
+
+
+def resolve_collection_dbs() -> Tuple[str, str, str]:
+    """
+    (collection, state DB, snippets DB) for the companion tools (OCR backfill, status): the same files the
+    indexer uses for this environment, per-collection ones under QDRANT_ALIAS.
+    """
+    if not ALIAS:
+        return COLLECTION, STATE_DB, SNIPPETS_DB
+    live = "" if "QDRANT_COLLECTION" in os.environ else qdrant_aliases().get(ALIAS, "")
+    return alias_target(live)
+
+
+def use_alias_build_target() -> str:
+    """QDRANT_ALIAS: switch this run to its versioned collection and DBs (alias_target); returns the live target."""
+    global COLLECTION, STATE_DB, SNIPPETS_DB
+    live = qdrant_aliases().get(ALIAS, "")
+    if not live and "QDRANT_COLLECTION" not in os.environ and "QDRANT_STATE_DB" not in os.environ and Path(STATE_DB).exists():
+        # A scheduled job switched to the alias before the existing collection was adopted: do not start a rebuild.
+        raise RuntimeError(
+            f"QDRANT_ALIAS '{ALIAS}' does not exist but a state DB from before the alias does ({STATE_DB}): "
+            "adopt the existing collection first (qdrant_alias.py switch <collection>, then rename its DBs), "
+            "or set QDRANT_COLLECTION to build a new one"
+        )
+    collection, state_db, snippets_db = alias_target(live)
+    if MIGRATE_FROM_SNIPPETS and live and live != collection:
+        # A migration reads the live collection's chunk text and fingerprints: start from a copy of them.
+        for current, target in ((STATE_DB, state_db), (SNIPPETS_DB, snippets_db)):
+            if target != current and not Path(target).exists():
+                seed_db(collection_db_path(current, live), target)
+    COLLECTION, STATE_DB, SNIPPETS_DB = collection, state_db, snippets_db
+    log(f"alias alias={ALIAS} live={live or '-'} collection={COLLECTION} state_db={STATE_DB} snippets_db={SNIPPETS_DB}")
+    return live
+
+
+def seed_db(src: str, dst: str) -> None:
+    if not Path(src).exists():
+        return
+    Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    # The backup API gives a consistent copy even while a scheduled run writes to src.
+    with sqlite3.connect(src, timeout=30) as a, sqlite3.connect(dst) as b:
+        a.backup(b)
+    log(f"alias_seed src={src} dst={dst}")
+
+
+# Collection settings per QDRANT_STORAGE_PROFILE, merged into the create request next to size and distance.
+STORAGE_PROFILES: Dict[str, Dict[str, Any]] = {
+    # float32 vectors, HNSW graph and payload in RAM (Qdrant defaults).
+    "default": {},
+    # int8 copies in RAM for the search, float32 originals on disk for rescoring: about 4x less vector RAM.
+    "sq8": {
+        "vectors": {"on_disk": True},
+        "quantization_config": {"scalar": {"type": "int8", "quantile": 0.99, "always_ram": True}},
+        "hnsw_config": {"m": 16, "ef_construct": 128},
+        "optimizers_config": {"indexing_threshold": 20000},
+        "on_disk_payload": True,
+    },
+    # One bit per dimension in RAM (about 32x less); searches need oversampling with rescoring.
+    "binary": {
+        "vectors": {"on_disk": True},
+        "quantization_config": {"binary": {"always_ram": True}},
+        "hnsw_config": {"m": 16, "ef_construct": 128},
+        "optimizers_config": {"indexing_threshold": 20000},
+        "on_disk_payload": True,
+    },
+    # Vectors, graph and payload memory-mapped: smallest footprint, latency follows the page cache.
+    "disk": {
+        "vectors": {"on_disk": True},
+        "hnsw_config": {"m": 16, "ef_construct": 100, "on_disk": True},
+        "optimizers_config": {"indexing_threshold": 20000},
+        "on_disk_payload": True,
+    },
+}
+
+
+def collection_config(profile: str, size: int) -> Dict[str, Any]:
+    if profile not in STORAGE_PROFILES:
+        raise RuntimeError(f"Unknown QDRANT_STORAGE_PROFILE '{profile}' (known: {', '.join(sorted(STORAGE_PROFILES))})")
+    cfg = json.loads(json.dumps(STORAGE_PROFILES[profile]))  # deep copy
+    cfg["vectors"] = {"size": size, "distance": "Cosine", **cfg.get("vectors", {})}
+    hnsw = {"m": HNSW_M, "ef_construct": HNSW_EF_CONSTRUCT}
+    cfg.setdefault("hnsw_config", {}).update({k: v for k, v in hnsw.items() if v > 0})
+    if INDEXING_THRESHOLD_KB > 0:
+        cfg.setdefault("optimizers_config", {})["indexing_threshold"] = INDEXING_THRESHOLD_KB
+    return {k: v for k, v in cfg.items() if v}
+
+
 def ensure_collection(name: str) -> None:
+    payload = collection_config(STORAGE_PROFILE, VECTOR_SIZE)  # also rejects unknown profiles for existing collections
+    try:
+        name = qdrant_aliases().get(name, name)  # QDRANT_COLLECTION may name an alias
+    except Exception:
+        pass
     if collection_exists(name):
         try:
             info = qdrant_get(f"/collections/{name}")
@@ -236,12 +702,7 @@ def ensure_collection(name: str) -> None:
         except Exception:
             raise
         return
-    payload = {
-        "vectors": {
-            "size": VECTOR_SIZE,
-            "distance": "Cosine"
-        }
-    }
+    log(f"collection_create name={name} profile={STORAGE_PROFILE} config={json.dumps(payload, sort_keys=True)}")
     qdrant_put(f"/collections/{name}", payload)
 
 
@@ -283,6 +744,8 @@ def embed_texts_ollama_modern(texts: List[str]) -> List[List[float]]:
         payload["truncate"] = False
     if OLLAMA_KEEP_ALIVE:
         payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+    EMBED_COUNTERS.incr("requests")
+    EMBED_COUNTERS.incr("texts", len(texts))
     res = http_json("POST", f"{OLLAMA_HOST}{OLLAMA_EMBED_ENDPOINT}", payload)
     embs = res.get("embeddings")
     if not isinstance(embs, list) or not embs:
@@ -294,6 +757,8 @@ def embed_texts_ollama_modern(texts: List[str]) -> List[List[float]]:
 
 def embed_text_ollama_legacy(text: str) -> List[float]:
     payload: Dict[str, Any] = {"model": OLLAMA_MODEL, "prompt": text}
+    EMBED_COUNTERS.incr("requests")
+    EMBED_COUNTERS.incr("texts")
     res = http_json("POST", f"{OLLAMA_HOST}{OLLAMA_EMBED_LEGACY_ENDPOINT}", payload)
     if "embedding" not in res:
         raise RuntimeError(f"Ollama legacy embedding response missing 'embedding': {str(res)[:200]}")
@@ -402,30 +867,81 @@ def pdf_page_count(path: Path) -> int:
     return 0
 
 
-def extract_pdf_text_pdftotext(path: Path, max_pages: int) -> str:
+def coalesce_ranges(ranges: List[Tuple[int, int]], max_gap: int, max_runs: int = 0) -> List[Tuple[int, int]]:
+    """
+    Merge sorted page ranges, smallest gap first: one process launch instead of several. Gaps of at most
+    `max_gap` unwanted pages are always merged; beyond that, merging goes on until at most `max_runs` remain.
+    """
+    out = list(ranges)
+    while len(out) > 1:
+        gaps = [out[i + 1][0] - out[i][1] - 1 for i in range(len(out) - 1)]
+        i = min(range(len(gaps)), key=gaps.__getitem__)
+        if gaps[i] > max(0, max_gap) and (max_runs <= 0 or len(out) <= max_runs):
+            break
+        out[i : i + 2] = [(out[i][0], out[i + 1][1])]
+    return out
+
+
+def pdftotext_pages(path: Path, first: int, last: int) -> Tuple[List[str], bool]:
+    """
+    Text of pages first..last (1-based, clamped to the document by pdftotext), one entry per page, and
+    whether pdftotext exited cleanly. A failed run may still have printed some pages; they are usable
+    text, but their number says nothing about the document's length.
+    """
+    try:
+        res = subprocess.run(
+            ["pdftotext", "-f", str(first), "-l", str(last), "-layout", str(path), "-"],
+            check=False,
+            capture_output=True,
+            timeout=60,
+        )
+    except Exception:
+        return [], False
+    # Without -nopgbrk every page ends with a form feed.
+    pages = res.stdout.decode("utf-8", errors="ignore").split("\f")
+    if pages and not pages[-1].strip():
+        pages.pop()
+    return pages, res.returncode == 0
+
+
+def extract_pdf_text_pdftotext(path: Path, max_pages: int, pages: int = 0) -> Tuple[str, int]:
+    """
+    Sampled-page text of a PDF plus its page count (0 if unknown).
+
+    With an unknown page count a small file starts with one run over the first `max_pages` pages; a shorter
+    document is then done without pdfinfo. Larger files, likely long, ask pdfinfo first. The sampled pages
+    are then read in at most PDF_MAX_RUNS runs, reusing pages the first run already returned.
+    """
     if not cmd_exists("pdftotext"):
-        return ""
-    pages = pdf_page_count(path)
+        return "", pages
+    max_pages = max(1, max_pages)
+    have: Dict[int, str] = {}
+    probed = False
     if pages <= 0:
-        # pdftotext still might work, but prefer bounded work.
-        pages = 1
-    idxs0 = page_sample_indices(pages, max_pages)
-    pages_1based = [i + 1 for i in idxs0]
-    ranges = indices_to_ranges(pages_1based)
-    parts: List[str] = []
-    for start, end in ranges:
         try:
-            res = subprocess.run(
-                ["pdftotext", "-f", str(start), "-l", str(end), "-layout", "-nopgbrk", str(path), "-"],
-                check=False,
-                capture_output=True,
-                timeout=60,
-            )
-            if res.stdout:
-                parts.append(res.stdout.decode("utf-8", errors="ignore"))
-        except Exception:
-            continue
-    return "\n".join(parts)
+            large = path.stat().st_size > PDF_HEAD_RUN_MAX_BYTES
+        except OSError:
+            large = False
+        if large:
+            pages = pdf_page_count(path)
+            probed = True
+    if pages <= 0:
+        head, ok = pdftotext_pages(path, 1, max_pages)
+        have = {i + 1: t for i, t in enumerate(head)}
+        if ok and len(head) < max_pages:
+            return "\n".join(head), len(head)
+        if not probed:
+            pages = pdf_page_count(path)
+        if pages <= 0:
+            # No page count: the first pages are the bounded best effort.
+            return "\n".join(have[p] for p in sorted(have)), 0
+    wanted = [i + 1 for i in page_sample_indices(pages, max_pages)]
+    todo = indices_to_ranges([p for p in wanted if p not in have])
+    for start, end in coalesce_ranges(todo, PDF_RANGE_MAX_GAP, PDF_MAX_RUNS):
+        texts, _ok = pdftotext_pages(path, start, end)
+        for i, t in enumerate(texts):
+            have[start + i] = t
+    return "\n".join(have[p] for p in wanted if p in have), pages
 
 
 def chunks_fingerprint(chunks: List[str]) -> str:
@@ -443,19 +959,91 @@ def is_text_file(path: Path) -> bool:
     return bool(mt and mt.startswith("text/"))
 
 
-def iter_files(roots: List[str]) -> Iterable[Path]:
-    for root in roots:
-        if not os.path.exists(root):
+def _scan_dir(top: str) -> Optional[Tuple[List[Tuple[Path, Optional[os.stat_result]]], List[str]]]:
+    # One directory listing: (files with their DirEntry stat, subdirectories to descend into). None if unreadable.
+    try:
+        with os.scandir(top) as it:
+            entries = list(it)
+    except OSError:
+        return None
+    files: List[Tuple[Path, Optional[os.stat_result]]] = []
+    subdirs: List[str] = []
+    for entry in entries:
+        name = entry.name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            # Like os.walk(followlinks=False): symlinked dirs are neither listed nor descended into.
+            if name not in EXCLUDE_DIR_NAMES and not entry.is_symlink():
+                subdirs.append(entry.path)
             continue
-        for dirpath, dirnames, filenames in os.walk(root, onerror=lambda e: None):
-            if EXCLUDE_DIR_NAMES:
-                dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIR_NAMES]
-            for name in filenames:
-                if name in EXCLUDE_FILE_NAMES:
-                    continue
-                if name.startswith("._"):
-                    continue
-                yield Path(dirpath) / name
+        if name in EXCLUDE_FILE_NAMES or name.startswith("._"):
+            continue
+        try:
+            st: Optional[os.stat_result] = entry.stat()
+        except OSError:
+            st = None
+        files.append((Path(entry.path), st))
+    return files, subdirs
+
+
+def walk_files(
+    roots: List[str], est_total: int = 0, workers: Optional[int] = None
+) -> Iterator[Tuple[Path, Optional[os.stat_result]]]:
+    """
+    Single-pass os.scandir walk yielding (path, stat) pairs; stat comes from the DirEntry (None if it failed).
+    Excludes are applied while walking and a walk_progress line is logged every WALK_PROGRESS_EVERY files,
+    against est_total (the previous run's count from meta) when known.
+
+    With workers > 1 (default QDRANT_WALK_WORKERS), directory listings and stats run ahead in a thread pool
+    (up to workers * WALK_PREFETCH_PER_WORKER pending listings, across all roots), but paths are still
+    yielded in exactly the serial order, so first-seen canonical paths for dedup stay deterministic.
+    """
+    workers = WALK_WORKERS if workers is None else workers
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="walk") if workers > 1 else None
+    window = max(1, workers * WALK_PREFETCH_PER_WORKER)
+    pending = 0
+    seen = 0
+    dirs = 0
+    # Stack entries are directory paths still to list, or Futures of listings already submitted.
+    stack: List[Any] = [root for root in reversed(roots) if os.path.exists(root)]
+    try:
+        while stack:
+            if pool is not None:
+                # Keep the pool busy with the directories the consumer will reach next.
+                for i in range(len(stack) - 1, max(-1, len(stack) - 1 - window), -1):
+                    if pending >= window:
+                        break
+                    if isinstance(stack[i], str):
+                        stack[i] = pool.submit(_scan_dir, stack[i])
+                        pending += 1
+            item = stack.pop()
+            if isinstance(item, Future):
+                pending -= 1
+                listing = item.result()
+            else:
+                listing = _scan_dir(item)
+            if listing is None:
+                continue
+            dirs += 1
+            files, subdirs = listing
+            # Reverse so subdirectories are visited in listing order (top-down, like os.walk).
+            stack.extend(reversed(subdirs))
+            for path, st in files:
+                seen += 1
+                if WALK_PROGRESS_EVERY and seen % WALK_PROGRESS_EVERY == 0:
+                    log(f"walk_progress files={seen} dirs={dirs} est_total={est_total or 'unknown'}")
+                yield path, st
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_files(roots: List[str]) -> Iterable[Path]:
+    for path, _ in walk_files(roots):
+        yield path
 
 
 def upsert_batch(points: List[Dict[str, Any]]) -> None:
@@ -490,21 +1078,6 @@ def upsert_batch(points: List[Dict[str, Any]]) -> None:
             raise RuntimeError(last_err) from e
 
 
-def count_files(roots: List[str]) -> int:
-    total = 0
-    for root in roots:
-        if not os.path.exists(root):
-            continue
-        for _, dirnames, filenames in os.walk(root, onerror=lambda e: None):
-            if EXCLUDE_DIR_NAMES:
-                dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIR_NAMES]
-            if EXCLUDE_FILE_NAMES:
-                total += sum(1 for n in filenames if n not in EXCLUDE_FILE_NAMES and not n.startswith("._"))
-            else:
-                total += sum(1 for n in filenames if not n.startswith("._"))
-    return total
-
-
 def ensure_state_db() -> sqlite3.Connection:
     db_path = Path(STATE_DB)
     db_path.parent.mkdir(parents=True, exist_ok=True)
@@ -576,6 +1149,26 @@ def ensure_state_db() -> sqlite3.Connection:
         conn.execute("ALTER TABLE file_state ADD COLUMN aux_mtime INTEGER")
     if "aux_size" not in cols:
         conn.execute("ALTER TABLE file_state ADD COLUMN aux_size INTEGER")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS near_dup (
+            path TEXT PRIMARY KEY,
+            minhash BLOB
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pdf_pages (
+            sig TEXT PRIMARY KEY,
+            pages INTEGER,
+            seen_at INTEGER
+        )
+        """
+    )
+    # Lookups by path/signature for pruning deleted files (canonical copies and their duplicates).
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_content_sig_path ON content_sig(path)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_file_state_text_hash ON file_state(text_hash)")
     conn.commit()
     try:
         os.chmod(str(db_path), 0o600)
@@ -616,6 +1209,10 @@ def ensure_snippets_db() -> Optional[sqlite3.Connection]:
         """
     )
     conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_path ON chunks(path)")
+    if SHARED_CHUNKS:
+        # chunks rows double as the path list of shared points: looked up by text_hash.
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_text_hash ON chunks(text_hash)")
+        conn.execute("CREATE TABLE IF NOT EXISTS shared_points (text_hash TEXT PRIMARY KEY, created_at INTEGER)")
 
     if SNIPPETS_FTS:
         conn.execute(
@@ -769,6 +1366,210 @@ def get_state(conn: sqlite3.Connection, path: str) -> Optional[Tuple[int, int, O
     return row if row else None
 
 
+def state_fingerprint(size: int, mtime: int, aux_mtime: int, aux_size: int) -> int:
+    # Tuple hashes of ints are stable across processes (no hash randomization for ints).
+    return hash((int(size), int(mtime), int(aux_mtime), int(aux_size)))
+
+
+class StateIndex:
+    """
+    Compact in-memory snapshot of file_state (plus the OCR sidecar directory) loaded once at startup,
+    so the incremental skip check for unchanged files touches neither SQLite nor the sidecar dir.
+
+    fingerprints maps path -> state_fingerprint(size, mtime, aux_mtime, aux_size) for rows that are
+    complete under the current cfg_hash, or -1 for rows that exist but must be reprocessed.
+    unseen starts as every known path and loses each one the walk reaches (mark phase of the
+    deleted-file sweep).
+    """
+
+    NEEDS_WORK = -1
+
+    def __init__(self) -> None:
+        self.fingerprints: Dict[str, int] = {}
+        self.sidecars: Dict[str, Tuple[int, int]] = {}
+        self.unseen: Set[str] = set()
+
+    def lookup(self, path: str) -> Optional[int]:
+        return self.fingerprints.get(path)
+
+    def mark_seen(self, path: str) -> None:
+        self.unseen.discard(path)
+
+    def sidecar_stat(self, path: Path) -> Tuple[int, int]:
+        return self.sidecars.get(ocr_sidecar_path(path).name, (0, 0))
+
+
+def load_state_index(conn: sqlite3.Connection, cfg_hash: str) -> StateIndex:
+    idx = StateIndex()
+    cur = conn.execute(
+        "SELECT path, size, mtime, cfg_hash, COALESCE(complete, 1), COALESCE(aux_mtime, 0), COALESCE(aux_size, 0) FROM file_state"
+    )
+    fps = idx.fingerprints
+    for path, size, mtime, row_cfg, complete, aux_mtime, aux_size in cur:
+        if row_cfg == cfg_hash and int(complete) == 1:
+            fps[path] = state_fingerprint(size or 0, mtime or 0, aux_mtime, aux_size)
+        else:
+            fps[path] = StateIndex.NEEDS_WORK
+    idx.unseen = set(fps)
+    try:
+        with os.scandir(OCR_SIDECAR_DIR) as it:
+            for entry in it:
+                if not entry.name.endswith(".txt"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                idx.sidecars[entry.name] = (int(st.st_mtime), int(st.st_size))
+    except OSError:
+        pass
+    return idx
+
+
+_NEAR_DUP_BINS = 64
+_NEAR_DUP_BANDS = 16  # 16 bands of 4 bins: pairs above ~0.5 similarity usually share a bucket
+_NEAR_DUP_EMPTY = (1 << 58) - 1
+
+
+def text_minhash(text: str) -> Optional[array]:
+    """
+    One-permutation MinHash of the text's word shingles: each shingle hash falls into one of 64 bins by
+    its top bits and every bin keeps its smallest value. One pass, no per-permutation loop.
+    None when the text has fewer than QDRANT_NEAR_DUP_MIN_SHINGLES shingles.
+    """
+    words = re.findall(r"\w+", text.lower())
+    n = max(1, NEAR_DUP_SHINGLE_WORDS)
+    count = len(words) - n + 1
+    if count < max(1, NEAR_DUP_MIN_SHINGLES):
+        return None
+    bins = array("Q", [_NEAR_DUP_EMPTY] * _NEAR_DUP_BINS)
+    for i in range(count):
+        h = int.from_bytes(hashlib.blake2b(" ".join(words[i:i + n]).encode("utf-8"), digest_size=8).digest(), "big")
+        b, v = h >> 58, h & _NEAR_DUP_EMPTY
+        if v < bins[b]:
+            bins[b] = v
+    return bins
+
+
+def minhash_similarity(a: array, b: array) -> float:
+    # Estimated Jaccard similarity: agreeing bins among the bins either text filled.
+    filled = same = 0
+    for x, y in zip(a, b):
+        if x == _NEAR_DUP_EMPTY and y == _NEAR_DUP_EMPTY:
+            continue
+        filled += 1
+        same += x == y
+    return same / filled if filled else 0.0
+
+
+class NearDupIndex:
+    """
+    LSH index over the MinHash of every canonical (point-bearing) document. The signatures live in the
+    near_dup table of the state DB; the band buckets are rebuilt from them at startup.
+
+    check() runs after extraction, before embedding: a document whose text is at least NEAR_DUP_THRESHOLD
+    similar to an existing canonical becomes an alias of it (kind "near_dup", no points of its own);
+    otherwise it is registered as a canonical itself. Thread-safe, so pipelined extract stages can share it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.sigs: Dict[str, array] = {}
+        self.buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+
+    @staticmethod
+    def _band_keys(sig: array) -> List[Tuple[int, bytes]]:
+        rows = _NEAR_DUP_BINS // _NEAR_DUP_BANDS
+        raw = sig.tobytes()
+        width = rows * sig.itemsize
+        return [(band, raw[band * width:(band + 1) * width]) for band in range(_NEAR_DUP_BANDS)]
+
+    def add(self, path: str, sig: array) -> None:
+        with self._lock:
+            self._remove(path)
+            self.sigs[path] = sig
+            for key in self._band_keys(sig):
+                self.buckets.setdefault(key, set()).add(path)
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            self._remove(path)
+
+    def _remove(self, path: str) -> None:
+        old = self.sigs.pop(path, None)
+        if old is None:
+            return
+        for key in self._band_keys(old):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(path)
+                if not bucket:
+                    del self.buckets[key]
+
+    def best_match(self, path: str, sig: array) -> Tuple[str, float]:
+        with self._lock:
+            candidates: Set[str] = set()
+            for key in self._band_keys(sig):
+                candidates |= self.buckets.get(key, set())
+            candidates.discard(path)
+            best, best_sim = "", 0.0
+            for cand in candidates:
+                sim = minhash_similarity(sig, self.sigs[cand])
+                if sim > best_sim:
+                    best, best_sim = cand, sim
+            return best, best_sim
+
+    def check(self, work: "FileWork") -> None:
+        if work.kind != "index" or not work.chunks or work.source.endswith(_NO_TEXT_SOURCES):
+            return
+        sig = text_minhash("\n".join(work.chunks))
+        if sig is None:
+            return
+        path = str(work.path)
+        canonical, sim = self.best_match(path, sig)
+        if canonical and sim >= NEAR_DUP_THRESHOLD and os.path.exists(canonical):
+            self.remove(path)  # it may have been a canonical itself before this edit
+            work.kind = "near_dup"
+            work.canonical = canonical
+            work.sig = "near:" + canonical
+            work.similarity = round(sim, 3)
+            return
+        # Registered right away so later copies in this run find it; persisted with the file's state.
+        self.add(path, sig)
+        work.minhash = sig.tobytes()
+
+
+# Extraction results that carry no document text (path context, listings, failures).
+_NO_TEXT_SOURCES = ("_no_text", "path_context", "fallback_name", "zip_listing", "zip_unreadable", "extract_error", "extract_timeout", "extract_crashed")
+
+
+def load_near_dup_index(conn: sqlite3.Connection) -> NearDupIndex:
+    ndi = NearDupIndex()
+    for path, blob in conn.execute("SELECT path, minhash FROM near_dup"):
+        sig = array("Q")
+        sig.frombytes(blob)
+        if len(sig) == _NEAR_DUP_BINS:
+            ndi.add(path, sig)
+    return ndi
+
+
+def forget_near_dup_canonicals(conn: sqlite3.Connection, paths: List[str], reason: str, keep_index: bool = False) -> None:
+    # These paths stop being canonicals: drop their signatures and send their aliases back through indexing.
+    marks = ",".join("?" * len(paths))
+    conn.execute(f"DELETE FROM near_dup WHERE path IN ({marks})", paths)
+    conn.execute(
+        f"UPDATE file_state SET complete = 0, last_error = ? WHERE text_hash IN ({marks})",
+        [reason] + ["near:" + p for p in paths],
+    )
+    if NEAR_DUP_INDEX is not None and not keep_index:
+        for p in paths:
+            NEAR_DUP_INDEX.remove(p)
+
+
+# Set in main() when QDRANT_NEAR_DUP=1.
+NEAR_DUP_INDEX: Optional[NearDupIndex] = None
+
+
 def set_state(
     conn: sqlite3.Connection,
     path: str,
@@ -798,7 +1599,7 @@ def set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
 
 
 def compute_file_sig(path: Path, size: int) -> str:
-    # Used only for deduplicating identical files across multiple roots.
+    # Content signature: deduplicates identical files across roots and keys the PDF page-count cache.
     # Prefix+suffix hashing keeps reads bounded while keeping false positives extremely unlikely.
     try:
         with path.open("rb") as f:
@@ -817,6 +1618,18 @@ def compute_file_sig(path: Path, size: int) -> str:
         return ""
 
 
+def cached_pdf_pages(conn: sqlite3.Connection, sig: str) -> int:
+    row = conn.execute("SELECT pages FROM pdf_pages WHERE sig = ?", (sig,)).fetchone()
+    return int(row[0]) if row and row[0] else 0
+
+
+def cache_pdf_pages(conn: sqlite3.Connection, sig: str, pages: int) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO pdf_pages (sig, pages, seen_at) VALUES (?, ?, ?)",
+        (sig, int(pages), int(time.time())),
+    )
+
+
 def is_under_any_root(path: str, roots: List[str]) -> bool:
     p = os.path.abspath(path)
     for r in roots:
@@ -859,11 +1672,60 @@ def text_hash(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
 
 
+# Gear table for the content-defined chunker: one pseudo-random 32-bit value per byte, stable across processes.
+_GEAR = [int.from_bytes(hashlib.md5(bytes([i])).digest()[:4], "big") for i in range(256)]
+
+
+def _snap_cut(text: str, lo: int, hi: int) -> int:
+    # Latest paragraph break in text[lo:hi], else line break, else sentence end; hi if there is none.
+    for seps in (("\n\n",), ("\n",), (". ", "? ", "! ", "; ")):
+        best = -1
+        for sep in seps:
+            pos = text.rfind(sep, lo, hi)
+            if pos >= 0:
+                best = max(best, pos + len(sep))
+        if best > lo:
+            return best
+    return hi
+
+
+def chunk_text_cdc(text: str) -> List[str]:
+    """
+    Content-defined chunking: a gear rolling hash over the last ~32 characters picks boundaries, which are then
+    snapped back to the nearest paragraph/line/sentence break. Boundaries depend only on nearby content, so an
+    insert or edit changes the chunks around it and the rest keep their text (and their cached vectors).
+    Chunk bodies are CHUNK_SIZE/2 .. CHUNK_SIZE - CHUNK_OVERLAP chars; each chunk after the first is prefixed
+    with the previous CHUNK_OVERLAP chars like the fixed chunker.
+    """
+    max_len = max(2, CHUNK_SIZE - max(0, CHUNK_OVERLAP))
+    min_len = max(1, max_len // 2)
+    # Boundary odds of 1 in ~max_len/4 per char past min_len -> average body of ~3/4 max_len.
+    bits = max(1, (max_len // 4).bit_length() - 1)
+    shift = 32 - bits
+    bounds: List[Tuple[int, int]] = []
+    start = 0
+    g = 0
+    for i, ch in enumerate(text):
+        g = ((g << 1) + _GEAR[ord(ch) & 0xFF]) & 0xFFFFFFFF
+        size = i + 1 - start
+        if size < min_len:
+            continue
+        if (g >> shift) == 0 or size >= max_len:
+            cut = _snap_cut(text, start + min_len, i + 1)
+            bounds.append((start, cut))
+            start = cut
+    if start < len(text):
+        bounds.append((start, len(text)))
+    return [text[max(0, s - CHUNK_OVERLAP) if s else 0:e] for s, e in bounds]
+
+
 def chunk_text(text: str) -> List[str]:
     if not text:
         return []
     if CHUNK_SIZE <= 0 or len(text) <= CHUNK_SIZE:
         return [text]
+    if CHUNK_MODE == "cdc":
+        return chunk_text_cdc(text)
     chunks = []
     step = max(CHUNK_SIZE - CHUNK_OVERLAP, 1)
     for i in range(0, len(text), step):
@@ -873,31 +1735,97 @@ def chunk_text(text: str) -> List[str]:
     return chunks
 
 
-def extract_docx_text_ooxml(path: Path) -> str:
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _docx_part_lines(f: Any, max_chars: int) -> List[str]:
+    """
+    Stream one WordprocessingML part (document, header or footer). Paragraphs become lines and table rows
+    become tab-joined cell text. Stops (cutting the last line) at `max_chars` characters (0 = whole part).
+
+    Finished paragraphs and rows are detached from their parent, so memory stays proportional to the
+    collected text, not to the size of the XML.
+    """
+    lines: List[str] = []
+    total = 0
+    open_elems: List[Any] = []
+    rows: List[List[str]] = []  # cells of each open table row (nested tables stack up)
+    cells: List[List[str]] = []  # paragraphs of each open table cell
     try:
-        with zipfile.ZipFile(str(path), "r") as z:
-            xml = z.read("word/document.xml")
-    except Exception:
-        return ""
+        for ev, elem in ET.iterparse(f, events=("start", "end")):
+            if ev == "start":
+                open_elems.append(elem)
+                if elem.tag == _W_NS + "tr":
+                    rows.append([])
+                elif elem.tag == _W_NS + "tc":
+                    cells.append([])
+                continue
+            open_elems.pop()
+            line = ""
+            if elem.tag == _W_NS + "p":
+                line = "".join(t.text or "" for t in elem.iter(_W_NS + "t"))
+            elif elem.tag == _W_NS + "tc" and cells:
+                cell = " ".join(cells.pop())
+                if rows:
+                    rows[-1].append(cell)
+            elif elem.tag == _W_NS + "tr" and rows:
+                line = "\t".join(c for c in rows.pop() if c)
+            else:
+                continue
+            if open_elems:
+                open_elems[-1].remove(elem)
+            if not line:
+                continue
+            if cells:
+                cells[-1].append(line)
+                continue
+            if max_chars and total + len(line) + 1 >= max_chars:
+                if max_chars - total - 1 > 0:
+                    lines.append(line[: max_chars - total - 1])
+                break
+            lines.append(line)
+            total += len(line) + 1
+    except ET.ParseError:
+        pass  # keep what was read before the damage
+    return lines
+
+
+def extract_docx_text_ooxml(path: Union[Path, IO[bytes]], max_chars: int = 0) -> str:
+    """
+    DOCX text in one streaming pass per part: headers, then the body (paragraphs and table rows), then footers.
+
+    Headers and footers are small and read first, so a body cut off at `max_chars` still leaves room for them.
+    """
     try:
-        root = ET.fromstring(xml)
+        with zipfile.ZipFile(path, "r") as z:
+            names = z.namelist()
+            if "word/document.xml" not in names:
+                return ""
+
+            def part_lines(kind: str) -> List[str]:
+                # Section variants (first page, even pages) often repeat the same text: keep each line once.
+                out: List[str] = []
+                for name in sorted(n for n in names if n.startswith(f"word/{kind}") and n.endswith(".xml")):
+                    with z.open(name) as f:
+                        for line in _docx_part_lines(f, max_chars):
+                            if line not in out:
+                                out.append(line)
+                return out
+
+            headers = part_lines("header")
+            footers = part_lines("footer")
+            edge = sum(len(line) + 1 for line in headers + footers)
+            with z.open("word/document.xml") as f:
+                body = _docx_part_lines(f, max(1, max_chars - edge) if max_chars else 0)
     except Exception:
         return ""
-    ns = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
-    paras: List[str] = []
-    for p in root.iter(ns + "p"):
-        parts: List[str] = []
-        for t in p.iter(ns + "t"):
-            if t.text:
-                parts.append(t.text)
-        if parts:
-            paras.append("".join(parts))
-    return "\n".join(paras)
-
-
-def extract_xlsx_text_ooxml(path: Path, max_cells: int) -> str:
+    text = "\n".join(headers + body + footers)
+    return text[:max_chars] if max_chars else text
+
+
+def extract_xlsx_text_ooxml(path: Union[Path, IO[bytes]], max_cells: int) -> str:
     try:
-        with zipfile.ZipFile(str(path), "r") as z:
+        with zipfile.ZipFile(path, "r") as z:
             shared: List[str] = []
             try:
                 ss_xml = z.read("xl/sharedStrings.xml")
@@ -965,7 +1893,9 @@ def extract_xlsx_text_ooxml(path: Path, max_cells: int) -> str:
         return ""
 
 
-def extract_chunks(path: Path, stat: os.stat_result) -> Tuple[List[str], str]:
+def extract_chunks(path: Path, stat: os.stat_result, meta: Optional[Dict[str, Any]] = None) -> Tuple[List[str], str]:
+    # meta["pdf_pages"]: a known PDF page count on the way in (skips pdfinfo), the learned one on the way out.
+    # meta["archive_members"]: set for ZIP archives, the member each returned chunk came from.
     max_chunks = max(1, MAX_CHUNKS_PER_FILE)
     budget_chars = max(MAX_CHARS, CHUNK_SIZE * max_chunks)
 
@@ -1003,9 +1933,12 @@ def extract_chunks(path: Path, stat: os.stat_result) -> Tuple[List[str], str]:
     # PDFs
     if path.suffix.lower() == ".pdf":
         text = ""
+        known = int((meta or {}).get("pdf_pages", 0))
         # Prefer builtin CLIs (present on macOS via Poppler) over optional Python deps.
         try:
-            text = extract_pdf_text_pdftotext(path, PDF_MAX_PAGES)
+            text, pages = extract_pdf_text_pdftotext(path, PDF_MAX_PAGES, known)
+            if meta is not None:
+                meta["pdf_pages"] = pages
         except Exception:
             text = ""
         if text and len(text.strip()) >= OCR_PDF_MIN_TEXT_CHARS:
@@ -1017,7 +1950,7 @@ def extract_chunks(path: Path, stat: os.stat_result) -> Tuple[List[str], str]:
 
     # DOCX
     if path.suffix.lower() == ".docx":
-        text = extract_docx_text_ooxml(path)
+        text = extract_docx_text_ooxml(path, budget_chars)
         return (chunk_text(text[:budget_chars])[:max_chunks] if text else [path.name]), ("docx_ooxml" if text else "docx_no_text")
 
     # XLSX
@@ -1025,23 +1958,99 @@ def extract_chunks(path: Path, stat: os.stat_result) -> Tuple[List[str], str]:
         text = extract_xlsx_text_ooxml(path, XLSX_MAX_CELLS)
         return (chunk_text(text[:budget_chars])[:max_chunks] if text else [path.name]), ("xlsx_ooxml" if text else "xlsx_no_text")
 
+    # ZIP archives: members go through the extractors above, in memory
+    if ZIP_MEMBERS and path.suffix.lower() == ".zip":
+        chunks, members, source = extract_zip_chunks(path, max_chunks)
+        if meta is not None:
+            meta["archive_members"] = members
+        return chunks, source
+
     # Images (OCR sidecar)
     if is_image_file(path):
         ocr = read_ocr_sidecar(path, budget_chars)
         if ocr and len(ocr.strip()) >= 10:
             return chunk_text(ocr[:budget_chars])[:max_chunks], "image_ocr_sidecar"
         # Keep some context so semantic search can still hit filenames/folders.
-        parts: List[str] = []
-        cur = path
-        for _ in range(6):
-            if cur.name:
-                parts.append(cur.name)
-            if cur.parent == cur:
-                break
-            cur = cur.parent
-        return [" / ".join(reversed(parts))] if parts else [path.name], "image_no_text"
+        return [path_context_text(path)], "image_no_text"
 
     # Non-text/binary: index a short path context instead of only basename.
+    return [path_context_text(path)], "path_context"
+
+
+def zip_member_kind(name: str) -> str:
+    ext = Path(name).suffix.lower()
+    if ext == ".pdf":
+        return "pdf"
+    if ext == ".docx":
+        return "docx"
+    if ext in {".xlsx", ".xlsm"}:
+        return "xlsx"
+    return "text" if is_text_file(Path(name)) else ""
+
+
+def extract_zip_member_text(z: zipfile.ZipFile, info: zipfile.ZipInfo, max_chars: int) -> str:
+    kind = zip_member_kind(info.filename)
+    if kind == "text":
+        with z.open(info) as f:
+            return f.read(MAX_BYTES).decode("utf-8", errors="ignore")[:max_chars]
+    if kind == "pdf" and not cmd_exists("pdftotext"):
+        return ""
+    # OOXML and PDF need random access: the member is held in memory (bounded by QDRANT_ZIP_MEMBER_MAX_BYTES).
+    data = z.read(info)
+    if kind == "docx":
+        return extract_docx_text_ooxml(BytesIO(data), max_chars)
+    if kind == "xlsx":
+        return extract_xlsx_text_ooxml(BytesIO(data), XLSX_MAX_CELLS)[:max_chars]
+    if kind == "pdf":
+        # pdftotext only reads files: the one place a member touches disk.
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            text, _pages = extract_pdf_text_pdftotext(Path(tmp.name), PDF_MAX_PAGES)
+        return text[:max_chars]
+    return ""
+
+
+def extract_zip_chunks(path: Path, max_chunks: int) -> Tuple[List[str], List[str], str]:
+    """
+    Chunks of a ZIP archive plus the member each chunk came from ("" for the archive itself).
+
+    Chunk 0 holds the archive path and its member listing. Text, DOCX, XLSX and PDF members (by name,
+    at most QDRANT_ZIP_MAX_MEMBERS, none above QDRANT_ZIP_MEMBER_MAX_BYTES) share the remaining chunk slots
+    until QDRANT_ZIP_MAX_BYTES uncompressed bytes were read. Nothing is unpacked to disk.
+    """
+    context = path_context_text(path)
+    try:
+        z = zipfile.ZipFile(path, "r")
+    except Exception:
+        return [context], [""], "zip_unreadable"
+    with z:
+        infos = sorted((i for i in z.infolist() if not i.is_dir()), key=lambda i: i.filename)
+        listing = context + "\n" + "\n".join(i.filename for i in infos)
+        chunks, members = [listing[: max(1, CHUNK_SIZE)]], [""]
+        eligible = [i for i in infos if zip_member_kind(i.filename) and i.file_size <= ZIP_MEMBER_MAX_BYTES]
+        eligible = eligible[: max(0, ZIP_MAX_MEMBERS)]
+        if not eligible or max_chunks <= 1:
+            return chunks, members, "zip_listing"
+        per_member = max(1, (max_chunks - 1) // len(eligible))
+        budget = ZIP_MAX_BYTES
+        for info in eligible:
+            if len(chunks) >= max_chunks:
+                break
+            if info.file_size > budget:
+                continue
+            budget -= info.file_size
+            try:
+                text = extract_zip_member_text(z, info, per_member * max(1, CHUNK_SIZE))
+            except Exception:
+                continue  # encrypted or damaged member
+            cs = chunk_text(text)[: min(per_member, max_chunks - len(chunks))]
+            chunks.extend(cs)
+            members.extend([info.filename] * len(cs))
+    return chunks, members, ("zip_members" if len(chunks) > 1 else "zip_listing")
+
+
+def path_context_text(path: Path) -> str:
     parts: List[str] = []
     cur = path
     for _ in range(6):
@@ -1050,20 +2059,103 @@ def extract_chunks(path: Path, stat: os.stat_result) -> Tuple[List[str], str]:
         if cur.parent == cur:
             break
         cur = cur.parent
-    return ([" / ".join(reversed(parts))] if parts else [path.name]), "path_context"
+    return " / ".join(reversed(parts)) if parts else path.name
 
 
-def create_payload_indexes() -> None:
-    if not CREATE_PAYLOAD_INDEXES:
-        return
-    items: List[Tuple[str, str, bool]] = [
-        ("path", "keyword", False),
-        ("name", "keyword", False),
-        ("source", "keyword", False),
-        ("text_source", "keyword", False),
-        ("chunk_index", "integer", False),
-        ("chunk_total", "integer", False),
-        ("mtime", "integer", MTIME_IS_PRINCIPAL),
+def _extract_worker_init(pids: Any) -> None:
+    # Own process group, so ExtractPool.kill() also takes down a pdftotext the worker started.
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    pids.put(os.getpid())
+
+
+def _extract_chunks_worker(path: str, stat: os.stat_result, meta: Dict[str, Any]) -> Tuple[List[str], str, Dict[str, Any]]:
+    # Runs inside an extraction worker process (module-level so it pickles by reference).
+    chunks, source = extract_chunks(Path(path), stat, meta)
+    return chunks, source, meta
+
+
+class ExtractPool:
+    """
+    Process pool for extract_chunks(): OOXML parsing is CPU-bound (GIL) and pdftotext runs
+    as a subprocess, so several files are extracted at once.
+
+    - Each file gets a hard timeout (QDRANT_EXTRACT_TIMEOUT_SECONDS); on expiry the workers
+      are killed by PID, with their process groups, and the pool is rebuilt.
+    - A crashed worker (BrokenProcessPool) also rebuilds the pool; a file whose own extraction
+      failed that way is retried once, then indexed by path context only. Files that merely
+      shared the pool with a timed-out or crashed file are resubmitted without using up a retry.
+    """
+
+    def __init__(self, workers: int, timeout_s: float) -> None:
+        self.workers = max(1, workers)
+        self.timeout_s = max(1.0, float(timeout_s))
+        self.ex = self._new_pool()
+        self.timeouts = 0
+        self.crashes = 0
+        self.restarts = 0
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn: the pool is created from a multi-threaded process (pipeline stages), where fork is unsafe.
+        ctx = multiprocessing.get_context("spawn")
+        # Workers report their PIDs themselves: the executor keeps its processes in a private attribute.
+        self.pid_queue = ctx.SimpleQueue()
+        self.pids: Set[int] = set()
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=ctx, initializer=_extract_worker_init, initargs=(self.pid_queue,)
+        )
+
+    def worker_pids(self) -> Set[int]:
+        while not self.pid_queue.empty():
+            self.pids.add(int(self.pid_queue.get()))
+        return set(self.pids)
+
+    def submit(self, path: Path, stat: os.stat_result, meta: Dict[str, Any]) -> Future:
+        return self.ex.submit(_extract_chunks_worker, str(path), stat, meta)
+
+    def kill(self) -> None:
+        pids = self.worker_pids()
+        if not pids:
+            log("extract_pool_kill_unavailable reason=no_worker_pids")
+        for pid in pids:
+            try:
+                if hasattr(os, "killpg"):
+                    os.killpg(pid, signal.SIGKILL)  # the worker and anything it started
+                else:
+                    os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            except Exception as e:
+                log(f"extract_pool_kill_error pid={pid} err={e}")
+        self.ex.shutdown(wait=False, cancel_futures=True)
+
+    def restart(self) -> None:
+        self.restarts += 1
+        try:
+            self.ex.shutdown(wait=False, cancel_futures=True)
+        except Exception:
+            pass
+        self.ex = self._new_pool()
+
+    def close(self) -> None:
+        self.ex.shutdown(wait=False, cancel_futures=True)
+
+    def report(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "timeouts": self.timeouts, "crashes": self.crashes, "restarts": self.restarts}
+
+
+def create_payload_indexes() -> None:
+    if not CREATE_PAYLOAD_INDEXES:
+        return
+    items: List[Tuple[str, str, bool]] = [
+        ("path", "keyword", False),
+        ("name", "keyword", False),
+        ("source", "keyword", False),
+        ("text_source", "keyword", False),
+        ("chunk_index", "integer", False),
+        ("chunk_total", "integer", False),
+        ("archive_member", "keyword", False),
+        ("mtime", "integer", MTIME_IS_PRINCIPAL),
     ]
     for field, schema_type, principal in items:
         schema: Any = schema_type
@@ -1111,28 +2203,283 @@ def delete_points_for_path(path: str) -> None:
         log(f"delete_path_error path={path} err={e}")
 
 
-def delete_points_for_path_chunk_index_ge(path: str, min_chunk_index: int) -> None:
-    payload = {
-        "filter": {
-            "must": [
-                {"key": "path", "match": {"value": path}},
-                {"key": "chunk_index", "range": {"gte": int(min_chunk_index)}},
-            ]
-        }
-    }
-    try:
-        qdrant_post(
-            f"/collections/{COLLECTION}/points/delete{qdrant_params(wait=QDRANT_WAIT, ordering=QDRANT_ORDERING)}",
-            payload,
+def delete_points_for_paths(paths: List[str]) -> None:
+    # One filtered delete for many paths. Raises, so callers keep their state rows and retry later.
+    if not paths:
+        return
+    payload = {"filter": {"must": [{"key": "path", "match": {"any": list(paths)}}]}}
+    qdrant_post(
+        f"/collections/{COLLECTION}/points/delete{qdrant_params(wait=QDRANT_WAIT, ordering=QDRANT_ORDERING)}",
+        payload,
+    )
+
+
+def delete_point_ids(ids: List[str]) -> None:
+    # Delete points by ID (shared chunks: per-path copies superseded by a shared point). Raises on failure.
+    if not ids:
+        return
+    qdrant_post(
+        f"/collections/{COLLECTION}/points/delete{qdrant_params(wait=QDRANT_WAIT, ordering=QDRANT_ORDERING)}",
+        {"points": list(dict.fromkeys(ids))},
+    )
+
+
+def gc_shared_points(snip_conn: sqlite3.Connection) -> int:
+    """
+    Shared chunks: delete shared points whose text no chunks row references any more (every file that
+    had it was deleted, deduplicated or edited). Returns the number of points deleted.
+    """
+    orphans = [
+        r[0]
+        for r in snip_conn.execute(
+            "SELECT s.text_hash FROM shared_points s WHERE NOT EXISTS (SELECT 1 FROM chunks c WHERE c.text_hash = s.text_hash)"
+        ).fetchall()
+    ]
+    for i in range(0, len(orphans), 512):
+        batch = orphans[i : i + 512]
+        delete_point_ids([shared_point_id(h) for h in batch])
+        snip_conn.executemany("DELETE FROM shared_points WHERE text_hash = ?", [(h,) for h in batch])
+        snip_conn.commit()
+    return len(orphans)
+
+
+def confirmed_deleted(path: str, roots: List[str]) -> bool:
+    # Re-check on disk before pruning: the root must be mounted and the parent (if present) readable,
+    # so an unmounted volume or a transient listing error never looks like a deletion.
+    if os.path.lexists(path):
+        return False
+    if roots and not any(is_under_any_root(path, [r]) and os.path.isdir(r) for r in roots):
+        return False
+    parent = os.path.dirname(path)
+    return not os.path.isdir(parent) or os.access(parent, os.R_OK | os.X_OK)
+
+
+def prune_paths(
+    conn: sqlite3.Connection,
+    snip_conn: Optional[sqlite3.Connection],
+    paths: List[str],
+    stats: Optional[Counters] = None,
+) -> int:
+    """
+    Remove every trace of deleted files in batches: Qdrant points (one filter per batch), snippets rows,
+    content_sig/ocr_queue rows, then file_state rows. State rows go last, so a failed Qdrant delete leaves
+    them in place and the next sweep retries. Duplicates of a deleted canonical copy are marked incomplete
+    so the next run indexes one of them instead.
+    """
+    pruned = 0
+    for i in range(0, len(paths), max(1, PRUNE_BATCH_SIZE)):
+        batch = paths[i:i + max(1, PRUNE_BATCH_SIZE)]
+        delete_points_for_paths(batch)
+        marks = ",".join("?" * len(batch))
+        if snip_conn is not None:
+            try:
+                snip_conn.execute(f"DELETE FROM chunks WHERE path IN ({marks})", batch)
+                snip_conn.commit()
+            except Exception as e:
+                log(f"snippets_prune_error err={e}")
+        forget_near_dup_canonicals(conn, batch, "canonical_deleted")
+        sigs = [r[0] for r in conn.execute(f"SELECT sig FROM content_sig WHERE path IN ({marks})", batch)]
+        if sigs:
+            sig_marks = ",".join("?" * len(sigs))
+            conn.execute(f"DELETE FROM content_sig WHERE sig IN ({sig_marks})", sigs)
+            conn.execute(
+                f"UPDATE file_state SET complete = 0, last_error = 'canonical_deleted' WHERE text_hash IN ({sig_marks})",
+                sigs,
+            )
+        conn.execute(f"DELETE FROM ocr_queue WHERE path IN ({marks})", batch)
+        conn.execute(f"DELETE FROM file_state WHERE path IN ({marks})", batch)
+        conn.commit()
+        pruned += len(batch)
+        if stats is not None:
+            stats.incr("pruned", len(batch))
+    return pruned
+
+
+def sweep_deleted(
+    conn: sqlite3.Connection,
+    snip_conn: Optional[sqlite3.Connection],
+    roots: List[str],
+    state_index: StateIndex,
+    stats: "RunStats",
+) -> Dict[str, Any]:
+    """
+    Sweep phase after a full walk: file_state paths under the scanned roots that the walk never reached
+    (state_index.unseen) and that are confirmed gone on disk. Work is proportional to the number of deletions.
+    """
+    candidates = sorted(p for p in state_index.unseen if is_under_any_root(p, roots))
+    deleted = [p for p in candidates if confirmed_deleted(p, roots)]
+    report: Dict[str, Any] = {"candidates": len(candidates), "deleted": len(deleted), "pruned": 0}
+    known = max(1, len(state_index.fingerprints))
+    if len(deleted) > PRUNE_MAX_FRACTION * known:
+        log(f"prune_refused deleted={len(deleted)} known={known} max_fraction={PRUNE_MAX_FRACTION}")
+        report["refused"] = True
+        return report
+    report["pruned"] = prune_paths(conn, snip_conn, deleted, stats)
+    return report
+
+
+def delete_points_batch(stale: List[Tuple[str, int]], paths: List[str]) -> None:
+    """
+    One filtered delete for many targets: stale tail chunks (path and chunk_index >= n) plus whole paths,
+    OR-ed together as `should` clauses. Raises on failure.
+    """
+    clauses: List[Dict[str, Any]] = [
+        {"must": [{"key": "path", "match": {"value": p}}, {"key": "chunk_index", "range": {"gte": int(n)}}]}
+        for p, n in stale
+    ]
+    if paths:
+        clauses.append({"key": "path", "match": {"any": list(dict.fromkeys(paths))}})
+    if not clauses:
+        return
+    qdrant_post(
+        f"/collections/{COLLECTION}/points/delete{qdrant_params(wait=QDRANT_WAIT, ordering=QDRANT_ORDERING)}",
+        {"filter": {"should": clauses}},
+    )
+
+
+def embed_model_key(provider: str) -> str:
+    """
+    Persistent cache key: provider:model plus a short hash of the settings that change the vectors for
+    the same text. For Ollama that is the endpoint (/api/embed and the legacy /api/embeddings normalize
+    differently) and server-side truncation; for both providers the clamp length.
+    """
+    model = OPENAI_EMBED_MODEL if provider == "openai" else OLLAMA_MODEL
+    variant: Dict[str, Any] = {"embed_max_chars": EMBED_MAX_CHARS}
+    if provider == "ollama":
+        variant["endpoint"] = OLLAMA_EMBED_ENDPOINT if OLLAMA_USE_BATCH else OLLAMA_EMBED_LEGACY_ENDPOINT
+        variant["truncate"] = OLLAMA_TRUNCATE
+    digest = hashlib.sha1(json.dumps(variant, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{provider}:{model}:{digest}"
+
+
+def pack_vector(vec: List[float]) -> bytes:
+    arr = array("f", vec)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_vector(blob: bytes) -> List[float]:
+    arr = array("f")
+    arr.frombytes(blob)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tolist()
+
+
+class EmbedStore:
+    """
+    Persistent embedding cache (SQLite) keyed by (provider:model, text_hash of the clamped text).
+
+    Vectors are stored as little-endian float32 blobs (what Qdrant keeps anyway), and the
+    least recently used rows are evicted once the DB grows past QDRANT_EMBED_CACHE_DB_MAX_MB.
+    """
+
+    def __init__(self, db_path: str, model_key: str, max_mb: int) -> None:
+        self.model_key = model_key
+        self.max_mb = max(0, int(max_mb))
+        self.max_rows = 0
+        self._lock = threading.Lock()
+        p = Path(db_path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        # Used from the embed stage thread in pipelined mode; access is serialized by _lock.
+        self.conn = sqlite3.connect(str(p), timeout=30, check_same_thread=False)
+        try:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA busy_timeout=30000")
+            self.conn.execute("PRAGMA mmap_size=268435456")
+        except Exception:
+            pass
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_key TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER,
+                vec BLOB,
+                last_used INTEGER,
+                PRIMARY KEY (model_key, text_hash)
+            )
+            """
         )
-    except Exception as e:
-        log(f"delete_path_stale_error path={path} err={e}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self.conn.commit()
+        try:
+            os.chmod(str(p), 0o600)
+        except Exception:
+            pass
+        row = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        self.rows = int(row[0]) if row else 0
+
+    def get_many(self, hashes: List[str]) -> Dict[str, List[float]]:
+        out: Dict[str, List[float]] = {}
+        if not hashes:
+            return out
+        now = int(time.time())
+        with self._lock:
+            hit_rowids: List[int] = []
+            step = 500
+            for i in range(0, len(hashes), step):
+                part = hashes[i:i + step]
+                qs = ",".join(["?"] * len(part))
+                cur = self.conn.execute(
+                    f"SELECT rowid, text_hash, vec FROM embeddings WHERE model_key = ? AND text_hash IN ({qs})",
+                    [self.model_key] + part,
+                )
+                for rowid, h, blob in cur.fetchall():
+                    out[str(h)] = unpack_vector(blob)
+                    hit_rowids.append(int(rowid))
+            for i in range(0, len(hit_rowids), step):
+                part_ids = hit_rowids[i:i + step]
+                qs = ",".join(["?"] * len(part_ids))
+                self.conn.execute(f"UPDATE embeddings SET last_used = ? WHERE rowid IN ({qs})", [now] + part_ids)
+            if hit_rowids:
+                self.conn.commit()
+        return out
+
+    def put_many(self, items: List[Tuple[str, List[float]]]) -> None:
+        if not items:
+            return
+        now = int(time.time())
+        with self._lock:
+            cur = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model_key, text_hash, dim, vec, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(self.model_key, h, len(v), pack_vector(v), now) for h, v in items],
+            )
+            self.rows += max(0, cur.rowcount)
+            if self.max_mb and not self.max_rows:
+                dim = max(1, len(items[0][1]))
+                self.max_rows = max(1, (self.max_mb * 1024 * 1024) // (dim * 4 + 100))
+            if self.max_rows and self.rows > self.max_rows:
+                # Evict down to 90% so eviction runs rarely, not on every insert.
+                n = self.rows - int(self.max_rows * 0.9)
+                cur = self.conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (n,),
+                )
+                self.rows -= max(0, cur.rowcount)
+                log(f"embed_store_evicted rows={cur.rowcount} remaining={self.rows}")
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self.conn.commit()
+                self.conn.close()
+            except Exception:
+                pass
 
 
 class EmbedCache:
-    def __init__(self, max_size: int) -> None:
+    def __init__(self, max_size: int, store: Optional[EmbedStore] = None) -> None:
         self.max_size = max_size
         self.cache: OrderedDict[str, List[float]] = OrderedDict()
+        self.store = store
+        self._unsaved: List[Tuple[str, List[float]]] = []
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
 
     def get(self, key: str) -> Optional[List[float]]:
         if key in self.cache:
@@ -1145,30 +2492,108 @@ class EmbedCache:
         self.cache.move_to_end(key)
         if len(self.cache) > self.max_size:
             self.cache.popitem(last=False)
+        if self.store is not None:
+            self._unsaved.append((key, value))
+
+    def lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        # Memory first, then one bulk query against the persistent store for the rest.
+        found: Dict[str, List[float]] = {}
+        rest: List[str] = []
+        for k in keys:
+            v = self.get(k)
+            if v is not None:
+                found[k] = v
+                self.memory_hits += 1
+            else:
+                rest.append(k)
+        if rest and self.store is not None:
+            try:
+                disk = self.store.get_many(list(dict.fromkeys(rest)))
+            except Exception as e:
+                log(f"embed_store_get_error err={e}")
+                disk = {}
+            for k, v in disk.items():
+                self.cache[k] = v
+                self.cache.move_to_end(k)
+                found[k] = v
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+            self.disk_hits += sum(1 for k in rest if k in disk)
+        self.misses += sum(1 for k in rest if k not in found)
+        return found
+
+    def persist(self) -> None:
+        if self.store is None or not self._unsaved:
+            return
+        items, self._unsaved = self._unsaved, []
+        try:
+            self.store.put_many(items)
+        except Exception as e:
+            log(f"embed_store_put_error err={e}")
+
+    def report(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses}
+        if self.store is not None:
+            out["store_rows"] = self.store.rows
+        return out
+
+    def close(self) -> None:
+        self.persist()
+        if self.store is not None:
+            self.store.close()
+
+
+def open_embed_cache(provider: str) -> EmbedCache:
+    store: Optional[EmbedStore] = None
+    if DEDUP_EMBEDDINGS and EMBED_CACHE_PERSIST:
+        try:
+            store = EmbedStore(EMBED_CACHE_DB, embed_model_key(provider), EMBED_CACHE_DB_MAX_MB)
+        except Exception as e:
+            log(f"embed_store_open_error db={EMBED_CACHE_DB} err={e}")
+    return EmbedCache(EMBED_CACHE_SIZE, store)
 
 
 def embed_texts(provider: str, texts: List[str], cache: EmbedCache) -> Tuple[List[Optional[List[float]]], List[Optional[str]]]:
     results: List[Optional[List[float]]] = [None] * len(texts)
     errors: List[Optional[str]] = [None] * len(texts)
 
-    missing: List[Tuple[int, str, str]] = []
+    prepared: List[Tuple[int, str, str]] = []
     for i, raw in enumerate(texts):
         t = clamp_embedding_text(raw)
-        h = text_hash(t)
-        if DEDUP_EMBEDDINGS:
-            cached = cache.get(h)
-            if cached is not None:
-                results[i] = cached
-                continue
-        missing.append((i, t, h))
+        prepared.append((i, t, text_hash(t)))
+
+    missing: List[Tuple[int, str, str]] = prepared
+    if DEDUP_EMBEDDINGS:
+        cached = cache.lookup([h for _, _, h in prepared])
+        missing = []
+        for i, t, h in prepared:
+            if h in cached:
+                results[i] = cached[h]
+            else:
+                missing.append((i, t, h))
 
     if not missing:
         return results, errors
+    try:
+        embed_missing(provider, missing, results, errors, cache)
+    finally:
+        cache.persist()
+    return results, errors
+
 
+def embed_missing(
+    provider: str,
+    missing: List[Tuple[int, str, str]],
+    results: List[Optional[List[float]]],
+    errors: List[Optional[str]],
+    cache: EmbedCache,
+) -> None:
     if provider == "openai":
         payload = {"model": OPENAI_EMBED_MODEL, "input": [t for _, t, _ in missing]}
         headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
         try:
+            EMBED_COUNTERS.incr("requests")
+            EMBED_COUNTERS.incr("texts", len(missing))
             res = http_json("POST", "https://api.openai.com/v1/embeddings", payload, headers=headers)
             embs = [d["embedding"] for d in res.get("data", [])]
             for (idx, text, h), emb in zip(missing, embs):
@@ -1178,52 +2603,85 @@ def embed_texts(provider: str, texts: List[str], cache: EmbedCache) -> Tuple[Lis
         except Exception as e:
             for idx, _, _ in missing:
                 errors[idx] = str(e)
-        return results, errors
+        return
 
     # Ollama: modern batch first, fallback to legacy (possibly parallel).
-    if OLLAMA_USE_BATCH:
-        i = 0
-        while i < len(missing):
-            batch = missing[i:i + max(1, OLLAMA_BATCH_SIZE)]
-            batch_texts = [t for _, t, _ in batch]
-            try:
-                embs = embed_texts_ollama_modern(batch_texts)
-                for (idx, _t, h), emb in zip(batch, embs):
-                    results[idx] = emb
-                    if DEDUP_EMBEDDINGS:
-                        cache.set(h, emb)
-            except Exception as e:
-                # Legacy fallback per text to salvage progress.
-                with ThreadPoolExecutor(max_workers=max(1, EMBED_CONCURRENCY)) as ex:
-                    fut_map = {ex.submit(embed_text_ollama_legacy, t): (idx, h) for idx, t, h in batch}
-                    for fut in as_completed(fut_map):
-                        idx, h = fut_map[fut]
-                        try:
-                            emb = fut.result()
-                            results[idx] = emb
-                            if DEDUP_EMBEDDINGS:
-                                cache.set(h, emb)
-                        except Exception as e2:
-                            errors[idx] = str(e2 or e)
-            i += len(batch)
-        return results, errors
-
-    with ThreadPoolExecutor(max_workers=max(1, EMBED_CONCURRENCY)) as ex:
-        fut_map = {ex.submit(embed_text_ollama_legacy, t): (idx, h) for idx, t, h in missing}
-        for fut in as_completed(fut_map):
-            idx, h = fut_map[fut]
-            try:
-                emb = fut.result()
+    def apply(
+        batch: List[Tuple[int, str, str]], out: List[Tuple[Optional[List[float]], Optional[str]]], cacheable: bool = True
+    ) -> None:
+        # Results land on the calling thread: EmbedCache is not thread-safe.
+        for (idx, _t, h), (emb, err) in zip(batch, out):
+            if emb is not None:
                 results[idx] = emb
-                if DEDUP_EMBEDDINGS:
+                if DEDUP_EMBEDDINGS and cacheable:
                     cache.set(h, emb)
-            except Exception as e:
-                errors[idx] = str(e)
-    return results, errors
+            elif err is not None:
+                errors[idx] = err
 
+    t0 = time.time()
+    if OLLAMA_USE_BATCH:
+        size = max(1, EMBED_BATCH_CTL.get() if EMBED_BATCH_CTL is not None else OLLAMA_BATCH_SIZE)
+        batches = [missing[i:i + size] for i in range(0, len(missing), size)]
+        # Static settings send batches one by one; the adaptive controller may run several at once.
+        workers = min(len(batches), EMBED_CONCURRENCY_CTL.get()) if EMBED_CONCURRENCY_CTL is not None else 1
+        if workers <= 1:
+            for batch in batches:
+                apply(batch, *embed_ollama_batch(batch))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                for batch, (out, cacheable) in zip(batches, ex.map(embed_ollama_batch, batches)):
+                    apply(batch, out, cacheable)
+        units = len(batches)
+    else:
+        workers = max(1, EMBED_CONCURRENCY_CTL.get() if EMBED_CONCURRENCY_CTL is not None else EMBED_CONCURRENCY)
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            fut_map = {ex.submit(embed_text_ollama_legacy, t): (idx, t, h) for idx, t, h in missing}
+            for fut in as_completed(fut_map):
+                item = fut_map[fut]
+                try:
+                    emb = fut.result()
+                except Exception as e:
+                    apply([item], [(None, str(e))])
+                    continue
+                apply([item], [(emb, None)])
+        units = len(missing)
+    ctl = EMBED_CONCURRENCY_CTL
+    # Only calls with enough requests to fill every worker say something about the concurrency setting.
+    if ctl is not None and units > 1 and units >= ctl.get():
+        ctl.observe(len(missing), time.time() - t0, ok=all(errors[idx] is None for idx, _, _ in missing))
 
-def run_config_hash(provider: str) -> str:
-    payload = {
+
+def embed_ollama_batch(
+    batch: List[Tuple[int, str, str]]
+) -> Tuple[List[Tuple[Optional[List[float]], Optional[str]]], bool]:
+    """
+    One /api/embed request; if it fails the batch is salvaged text by text via the legacy endpoint.
+    Returns the (vector, error) pairs and whether they may be cached: salvaged vectors come from an endpoint
+    that normalizes differently from the one embed_model_key() names, so they are used for this run only.
+    """
+    t0 = time.time()
+    try:
+        embs = embed_texts_ollama_modern([t for _, t, _ in batch])
+    except Exception as e:
+        if EMBED_BATCH_CTL is not None:
+            EMBED_BATCH_CTL.observe(len(batch), time.time() - t0, ok=False)
+        out: List[Tuple[Optional[List[float]], Optional[str]]] = [(None, None)] * len(batch)
+        with ThreadPoolExecutor(max_workers=max(1, EMBED_CONCURRENCY)) as ex:
+            fut_map = {ex.submit(embed_text_ollama_legacy, t): j for j, (_idx, t, _h) in enumerate(batch)}
+            for fut in as_completed(fut_map):
+                j = fut_map[fut]
+                try:
+                    out[j] = (fut.result(), None)
+                except Exception as e2:
+                    out[j] = (None, str(e2 or e))
+        return out, False
+    if EMBED_BATCH_CTL is not None:
+        EMBED_BATCH_CTL.observe(len(batch), time.time() - t0)
+    return [(emb, None) for emb in embs], True
+
+
+def run_config(provider: str) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
         "indexer_version": INDEXER_VERSION,
         "provider": provider,
         "collection": COLLECTION,
@@ -1246,141 +2704,180 @@ def run_config_hash(provider: str) -> str:
         "snippet_max_chars": SNIPPET_MAX_CHARS,
         "ocr_pdf_min_text_chars": OCR_PDF_MIN_TEXT_CHARS,
     }
-    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    if ZIP_MEMBERS:
+        payload["zip_members"] = [ZIP_MAX_MEMBERS, ZIP_MAX_BYTES, ZIP_MEMBER_MAX_BYTES]
+    if CHUNK_MODE != "fixed":
+        # Only added when set, so existing fixed-mode indexes keep their cfg_hash.
+        payload["chunk_mode"] = CHUNK_MODE
+    if SLIM_PAYLOAD:
+        payload["slim_payload"] = True
+    if SHARED_CHUNKS:
+        payload["shared_chunks"] = True
+    return payload
 
 
-def main() -> int:
-    roots = DEFAULT_ROOTS
-    if len(sys.argv) > 1:
-        roots = sys.argv[1:]
+def run_config_hash(provider: str) -> str:
+    return hashlib.sha256(json.dumps(run_config(provider), sort_keys=True).encode("utf-8")).hexdigest()
 
-    provider = choose_provider()
-    if provider not in ("openai", "ollama"):
-        raise RuntimeError(f"Unsupported embedding provider: {provider}")
 
-    # state db for incremental indexing
-    conn = ensure_state_db()
-    snip_conn = ensure_snippets_db()
-    cfg_hash = run_config_hash(provider)
-    prev_cfg = get_meta(conn, "run_cfg_hash")
-    if prev_cfg != cfg_hash:
-        log("Run config changed; files will be reprocessed as needed.")
-        set_meta(conn, "run_cfg_hash", cfg_hash)
-        conn.commit()
+# run_config keys that only concern embedding and storage; QDRANT_MIGRATE_FROM_SNIPPETS may change them.
+EMBEDDING_CFG_KEYS = (
+    "provider", "collection", "qdrant_url", "openai_model", "ollama_model",
+    "ollama_embed_endpoint", "ollama_legacy_endpoint", "ollama_truncate", "embed_max_chars",
+)
 
-    global VECTOR_SIZE
-    if VECTOR_SIZE == 0:
-        sample = "Dropbox semantic index bootstrap"
-        cache = EmbedCache(EMBED_CACHE_SIZE)
-        vecs, errs = embed_texts(provider, [sample], cache)
-        if vecs[0] is None:
-            raise RuntimeError(f"Failed to compute vector size: {errs[0]}")
-        vec0 = vecs[0]
-        VECTOR_SIZE = len(vec0)
-        log(f"Detected vector size: {VECTOR_SIZE} ({provider})")
 
-    wait_for_qdrant()
-    ensure_collection(COLLECTION)
-    create_payload_indexes()
+def point_payload(path: str, size: int, mtime: int, text_source: str, chunk_index: int, chunk_total: int, chunk: str) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"path": path, "name": Path(path).name}
+    if not SLIM_PAYLOAD:
+        payload["size"] = size
+    payload.update(
+        {
+            "mtime": mtime,
+            "source": "dropbox",
+            "text_source": text_source,
+            "chunk_index": chunk_index,
+            "chunk_total": chunk_total,
+            # Hash the exact text sent for embeddings (after clamping) so the payload reflects reality.
+            # Kept in slim mode too: chunk reuse matches unchanged chunks of edited files by it.
+            "text_hash": text_hash(clamp_embedding_text(chunk)),
+        }
+    )
+    if not SLIM_PAYLOAD:
+        payload["preview"] = chunk if PAYLOAD_PREVIEW_MAX_CHARS == 0 else chunk[: max(0, PAYLOAD_PREVIEW_MAX_CHARS)]
+    return payload
+
+
+def shared_point_payload(chunk: str) -> Dict[str, Any]:
+    # No path: per-path deletes never touch shared points; they go once no chunks row references them.
+    payload: Dict[str, Any] = {"source": "dropbox", "shared": True, "text_hash": text_hash(clamp_embedding_text(chunk))}
+    if not SLIM_PAYLOAD:
+        payload["preview"] = chunk if PAYLOAD_PREVIEW_MAX_CHARS == 0 else chunk[: max(0, PAYLOAD_PREVIEW_MAX_CHARS)]
+    return payload
+
+
+def shared_point_id(chunk_hash: str) -> str:
+    return str(uuid.UUID(hex=hashlib.md5(f"shared::{chunk_hash}".encode("utf-8")).hexdigest()))
+
+
+def point_id_for(path: str, chunk_index: int) -> str:
+    return str(uuid.UUID(hex=hashlib.md5(f"{path}::{chunk_index}".encode("utf-8")).hexdigest()))
+
+
+@dataclass
+class FileWork:
+    # One file moving through the indexing stages (prepare -> extract -> embed -> commit).
+    path: Path
+    stat: os.stat_result
+    aux_mtime: int
+    aux_size: int
+    had_prev: bool
+    kind: str = "index"  # index | dedup | move | near_dup
+    sig: str = ""
+    canonical: str = ""
+    chunks: List[str] = field(default_factory=list)
+    source: str = ""
+    vectors: List[Optional[List[float]]] = field(default_factory=list)
+    vec_errs: List[Optional[str]] = field(default_factory=list)
+    reuse_ok: bool = False
+    moved_from: str = ""  # kind == "move": previous path whose points are re-keyed
+    moved_points: List[Dict[str, Any]] = field(default_factory=list)
+    moved_fp: str = ""
+    reused: Dict[int, List[float]] = field(default_factory=dict)  # chunk index -> vector from the previous version
+    pdf_sig: str = ""  # content signature the PDF page count is cached under
+    pdf_pages: int = 0  # known page count going into extraction, learned count coming out
+    pdf_pages_cached: int = 0
+    members: List[str] = field(default_factory=list)  # ZIP archives: member path per chunk ("" = the archive itself)
+    similarity: float = 0.0  # kind == "near_dup": estimated similarity to the canonical
+    minhash: bytes = b""  # canonical documents under QDRANT_NEAR_DUP: signature persisted once the upsert landed
+
+    def extract_meta(self) -> Dict[str, Any]:
+        # Hints for extract_chunks(); it writes what it learned back into the same dict.
+        return {"pdf_pages": self.pdf_pages}
+
+    def apply_meta(self, meta: Dict[str, Any]) -> None:
+        self.pdf_pages = int(meta.get("pdf_pages") or 0)
+        self.members = list(meta.get("archive_members") or [])
+
+    def embed_indexes(self) -> List[int]:
+        return [i for i in range(len(self.chunks)) if i not in self.reused]
+
+    def fill_vectors(self, indexes: List[int], vectors: List[Optional[List[float]]], errs: List[Optional[str]]) -> None:
+        self.vectors = [self.reused.get(i) for i in range(len(self.chunks))]
+        self.vec_errs = [None] * len(self.chunks)
+        for i, vec, err in zip(indexes, vectors, errs):
+            self.vectors[i] = vec
+            self.vec_errs[i] = err
+
+
+class RunStats(Counters):
+    def __init__(self) -> None:
+        super().__init__(
+            [
+                "points_indexed",
+                "files_seen",
+                "files_indexed",
+                "skipped",
+                "skipped_incremental",
+                "skipped_dedup",
+                "embed_errors",
+                "chunks_reused",
+                "files_moved",
+                "points_moved",
+            ]
+        )
 
-    effective_batch_size = max(1, max(BATCH_SIZE, MAX_CHUNKS_PER_FILE))
-    batch: List[Dict[str, Any]] = []
-    pending_states: List[Tuple[str, int, int, int, int, bool, str, str]] = []
-    pending_snippets: List[Tuple[Any, ...]] = []
-    pending_qdrant_stale_deletes: List[Tuple[str, int]] = []
-    pending_snippet_stale_deletes: List[Tuple[str, int]] = []
-    points_indexed = 0
-    files_seen = 0
-    files_indexed = 0
-    skipped = 0
-    skipped_incremental = 0
-    skipped_dedup = 0
-    embed_errors = 0
-    t0 = time.time()
 
-    total_files = count_files(roots)
-    run_id = uuid.uuid4().hex
-    log(f"Starting index. run_id={run_id} provider={provider} total_files={total_files} collection={COLLECTION}")
-    audit = open(AUDIT_PATH, "a", encoding="utf-8")
+class AuditLog:
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self.f = open(path, "a", encoding="utf-8")
 
-    batch_id = 0
-    cache = EmbedCache(EMBED_CACHE_SIZE)
+    def write(self, event: Dict[str, Any], flush: bool = False) -> None:
+        with self._lock:
+            self.f.write(json.dumps(event) + "\n")
+            if flush:
+                self.f.flush()
 
-    def flush_batch() -> None:
-        nonlocal batch_id, batch, pending_states, pending_snippets, pending_qdrant_stale_deletes, pending_snippet_stale_deletes
-        if not batch:
-            return
-        batch_id += 1
-        first_path = batch[0]["payload"]["path"]
-        last_path = batch[-1]["payload"]["path"]
-        try:
-            upsert_batch(batch)
-            try:
-                upsert_snippets(snip_conn, pending_snippets)
-                if snip_conn is not None:
-                    for p, min_idx in pending_snippet_stale_deletes:
-                        delete_snippets_stale(snip_conn, p, min_idx)
-                    snip_conn.commit()
-            except Exception as e:
-                log(f"snippets_flush_error err={e}")
-            audit.write(
-                json.dumps(
-                    {
-                        "run_id": run_id,
-                        "batch_id": batch_id,
-                        "status": "ok",
-                        "count": len(batch),
-                        "first_path": first_path,
-                        "last_path": last_path,
-                        "timestamp": int(time.time()),
-                    }
-                )
-                + "\n"
-            )
-            for p, size, mtime, aux_mtime, aux_size, complete, fp, last_err in pending_states:
-                set_state(conn, p, size, mtime, aux_mtime, aux_size, cfg_hash, complete, fp, last_err)
-            conn.commit()
-            for p, min_idx in pending_qdrant_stale_deletes:
-                try:
-                    delete_points_for_path_chunk_index_ge(p, min_idx)
-                except Exception as e:
-                    log(f"delete_stale_error path={p} err={e}")
-        except Exception as e:
-            audit.write(
-                json.dumps(
-                    {
-                        "run_id": run_id,
-                        "batch_id": batch_id,
-                        "status": "error",
-                        "count": len(batch),
-                        "first_path": first_path,
-                        "last_path": last_path,
-                        "error": str(e),
-                        "timestamp": int(time.time()),
-                    }
-                )
-                + "\n"
-            )
-            audit.flush()
-            raise
-        audit.flush()
-        batch.clear()
-        pending_states.clear()
-        pending_snippets.clear()
-        pending_qdrant_stale_deletes.clear()
-        pending_snippet_stale_deletes.clear()
-
-    for path in iter_files(roots):
-        if MAX_FILES and files_indexed >= MAX_FILES:
-            break
-        files_seen += 1
+    def flush(self) -> None:
+        with self._lock:
+            self.f.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self.f.close()
+
+
+def prepare_file(
+    conn: sqlite3.Connection,
+    path: Path,
+    roots: List[str],
+    cfg_hash: str,
+    stats: RunStats,
+    state_index: Optional[StateIndex] = None,
+    stat: Optional[os.stat_result] = None,
+) -> Optional[FileWork]:
+    stats.incr("files_seen")
+    if state_index is not None:
+        state_index.mark_seen(str(path))
+    if stat is None:
         try:
             stat = path.stat()
         except Exception:
-            skipped += 1
-            continue
-
-        # incremental skip by mtime+size+config hash and only if the last attempt was complete
+            stats.incr("skipped")
+            return None
+
+    # incremental skip by mtime+size+config hash and only if the last attempt was complete
+    if state_index is not None:
+        aux_mtime, aux_size = state_index.sidecar_stat(path)
+        fp = state_index.lookup(str(path))
+        if fp is not None and fp == state_fingerprint(stat.st_size, int(stat.st_mtime), aux_mtime, aux_size):
+            stats.incr("skipped")
+            stats.incr("skipped_incremental")
+            return None
+        had_prev = fp is not None
+        prev_same_cfg = fp is not None and fp != StateIndex.NEEDS_WORK
+    else:
         aux_mtime, aux_size = ocr_sidecar_stat(path)
         state = get_state(conn, str(path))
         if (
@@ -1392,91 +2889,632 @@ def main() -> int:
             and int(state[4]) == int(aux_mtime)
             and int(state[5]) == int(aux_size)
         ):
-            skipped += 1
-            skipped_incremental += 1
-            continue
+            stats.incr("skipped")
+            stats.incr("skipped_incremental")
+            return None
         had_prev = state is not None
+        prev_same_cfg = bool(state) and state[2] == cfg_hash and int(state[3]) == 1
+    work = FileWork(path=path, stat=stat, aux_mtime=int(aux_mtime), aux_size=int(aux_size), had_prev=had_prev)
+    # Old vectors are only reusable if they came from the same model/config.
+    work.reuse_ok = prev_same_cfg
+
+    is_pdf = PDF_PAGE_CACHE and path.suffix.lower() == ".pdf"
+    sig = compute_file_sig(path, stat.st_size) if DEDUP_FILES or is_pdf else ""
+    # cross-root file dedup (byte-signature)
+    if DEDUP_FILES:
+        if sig:
+            canonical, stale_canonical = upsert_sig_canonical(conn, sig, str(path), roots)
+            if stale_canonical and not prepare_move(conn, work, stale_canonical, cfg_hash):
+                delete_points_for_path(stale_canonical)
+            if canonical and canonical != str(path):
+                work.kind = "dedup"
+                work.sig = sig
+                work.canonical = canonical
+    if is_pdf and sig and work.kind == "index":
+        work.pdf_sig = sig
+        work.pdf_pages = work.pdf_pages_cached = cached_pdf_pages(conn, sig)
+        if work.pdf_pages:
+            stats.incr("pdf_pages_cached")
+    return work
+
+
+def prepare_move(conn: sqlite3.Connection, work: FileWork, old_path: str, cfg_hash: str) -> bool:
+    """
+    The file's content signature belongs to a path that no longer exists: treat it as a move/rename.
+    If the old copy is fully indexed under this config, take its points (vectors + payload) so the commit
+    stage can re-key them to the new path without extracting or embedding anything.
+    """
+    if not MOVE_DETECTION or work.had_prev or os.path.exists(old_path):
+        return False
+    row = conn.execute(
+        "SELECT cfg_hash, COALESCE(complete, 1), text_hash FROM file_state WHERE path = ?", (old_path,)
+    ).fetchone()
+    if not row or row[0] != cfg_hash or int(row[1]) != 1:
+        return False
+    try:
+        points = fetch_points_for_path(old_path)
+    except Exception as e:
+        log(f"move_fetch_error old={old_path} err={e}")
+        return False
+    if not points:
+        return False
+    if SHARED_CHUNKS and len(points) < max(int((p.get("payload") or {}).get("chunk_total") or 0) for p in points):
+        # Some chunks live on shared points (no path) and cannot be re-keyed: re-index instead.
+        return False
+    for p in points:
+        payload = p.get("payload") or {}
+        if not isinstance(p.get("vector"), list) or "chunk_index" not in payload:
+            return False
+        if str(payload.get("text_source", "")).endswith("ocr_sidecar"):
+            # OCR sidecars are keyed by path; let the new path go through extraction.
+            return False
+    work.kind = "move"
+    work.moved_from = old_path
+    work.moved_points = points
+    work.moved_fp = row[2] or ""
+    return True
+
+
+def extract_work(work: FileWork) -> None:
+    meta = work.extract_meta()
+    chunks, source = extract_chunks(work.path, work.stat, meta)
+    work.apply_meta(meta)
+    work.chunks = chunks[: max(1, MAX_CHUNKS_PER_FILE)] if chunks else []
+    work.source = source
+    if NEAR_DUP_INDEX is not None:
+        NEAR_DUP_INDEX.check(work)
+
+
+def fetch_points_for_path(path: str, with_payload: Any = True) -> List[Dict[str, Any]]:
+    # All points currently stored for this file, vectors included (one scroll request).
+    r = qdrant_post(
+        f"/collections/{COLLECTION}/points/scroll",
+        {
+            "filter": {"must": [{"key": "path", "match": {"value": path}}]},
+            "limit": max(64, MAX_CHUNKS_PER_FILE * 2),
+            "with_payload": with_payload,
+            "with_vector": True,
+        },
+    )
+    return list((r.get("result") or {}).get("points") or [])
 
-        # cross-root file dedup (byte-signature)
-        if DEDUP_FILES:
-            sig = compute_file_sig(path, stat.st_size)
-            if sig:
-                canonical, stale_canonical = upsert_sig_canonical(conn, sig, str(path), roots)
-                if stale_canonical:
-                    delete_points_for_path(stale_canonical)
-                if canonical and canonical != str(path):
-                    # ensure duplicates do not linger from previous runs
-                    delete_points_for_path(str(path))
-                    delete_snippets_for_path(snip_conn, str(path))
-                    skipped += 1
-                    skipped_dedup += 1
-                    try:
-                        set_state(conn, str(path), stat.st_size, int(stat.st_mtime), aux_mtime, aux_size, cfg_hash, True, sig, "")
-                        conn.commit()
-                    except Exception:
-                        pass
-                    try:
-                        audit.write(
-                            json.dumps(
-                                {
-                                    "run_id": run_id,
-                                    "batch_id": batch_id,
-                                    "status": "dedup_skip",
-                                    "path": str(path),
-                                    "canonical_path": canonical,
-                                    "sig": sig,
-                                    "timestamp": int(time.time()),
-                                }
-                            )
-                            + "\n"
-                        )
-                        audit.flush()
-                    except Exception:
-                        pass
-                    continue
 
-        chunks, source = extract_chunks(path, stat)
-        if not chunks:
-            skipped += 1
-            continue
-        chunks = chunks[: max(1, MAX_CHUNKS_PER_FILE)]
-        if source == "pdf_no_text" and aux_mtime == 0 and aux_size == 0:
-            enqueue_ocr(conn, path, stat, f"low_text source={source}")
-        if OCR_IMAGES_ENABLED and source == "image_no_text" and aux_mtime == 0 and aux_size == 0:
-            enqueue_ocr(conn, path, stat, f"low_text source={source}")
+def fetch_prev_vectors(path: str) -> Dict[str, List[float]]:
+    # text_hash -> vector for the points currently stored for this file.
+    out: Dict[str, List[float]] = {}
+    for p in fetch_points_for_path(path, ["text_hash"]):
+        h = (p.get("payload") or {}).get("text_hash")
+        vec = p.get("vector")
+        if h and isinstance(vec, list) and (not VECTOR_SIZE or len(vec) == VECTOR_SIZE):
+            out[h] = vec
+    return out
+
+
+def reuse_prev_vectors(work: FileWork) -> None:
+    """
+    For a changed file indexed before under the same config, take vectors of chunks whose text did not
+    change (matched by text_hash, whatever their position) from the file's existing Qdrant points.
+    """
+    if not CHUNK_REUSE or not work.reuse_ok or not work.chunks or work.reused:
+        return
+    try:
+        prev = fetch_prev_vectors(str(work.path))
+    except Exception as e:
+        log(f"chunk_reuse_fetch_error path={work.path} err={e}")
+        return
+    for i, chunk in enumerate(work.chunks):
+        vec = prev.get(text_hash(clamp_embedding_text(chunk)))
+        if vec is not None:
+            work.reused[i] = vec
+
+
+def embed_work(provider: str, work: FileWork, cache: "EmbedCache") -> None:
+    reuse_prev_vectors(work)
+    todo = work.embed_indexes()
+    vectors, errs = embed_texts(provider, [work.chunks[i] for i in todo], cache) if todo else ([], [])
+    work.fill_vectors(todo, vectors, errs)
+
+
+class EmbedAccumulator:
+    """
+    Gathers chunks from several files into one embed_texts() call so small files share full
+    embedding batches instead of sending 1-chunk requests.
+
+    A batch is sent once it holds `target_chunks` chunks or its oldest file waited `max_wait_s`.
+    With `follow_adaptive` the target tracks the tuned embed batch size times embed concurrency instead.
+    Vectors are routed back to their files (by chunk offset) before the files reach the commit stage.
+    """
+
+    def __init__(
+        self, provider: str, cache: "EmbedCache", target_chunks: int, max_wait_s: float, follow_adaptive: bool = False
+    ) -> None:
+        self.provider = provider
+        self.cache = cache
+        self.target_chunks = max(1, int(target_chunks))
+        self.follow_adaptive = follow_adaptive
+        self.max_wait_s = max(0.0, float(max_wait_s))
+        self.pending: List[FileWork] = []
+        self.pending_chunks = 0
+        self.first_at = 0.0
+        self.batches = 0
+        self.files = 0
+
+    def target(self) -> int:
+        if self.follow_adaptive and EMBED_BATCH_CTL is not None:
+            return EMBED_BATCH_CTL.get() * (EMBED_CONCURRENCY_CTL.get() if EMBED_CONCURRENCY_CTL is not None else 1)
+        return self.target_chunks
+
+    def remaining_wait(self) -> Optional[float]:
+        if not self.pending:
+            return None
+        return max(0.0, self.first_at + self.max_wait_s - time.time())
+
+    def add(self, work: FileWork) -> List[FileWork]:
+        reuse_prev_vectors(work)
+        if not self.pending:
+            self.first_at = time.time()
+        self.pending.append(work)
+        self.pending_chunks += len(work.embed_indexes())
+        if self.pending_chunks >= self.target() or self.remaining_wait() == 0.0:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[FileWork]:
+        if not self.pending:
+            return []
+        works, self.pending = self.pending, []
+        self.pending_chunks = 0
+        todo = [w.embed_indexes() for w in works]
+        texts: List[str] = []
+        for w, idxs in zip(works, todo):
+            texts.extend(w.chunks[i] for i in idxs)
+        vectors, errs = embed_texts(self.provider, texts, self.cache) if texts else ([], [])
+        off = 0
+        for w, idxs in zip(works, todo):
+            n = len(idxs)
+            w.fill_vectors(idxs, vectors[off:off + n], errs[off:off + n])
+            off += n
+        self.batches += 1
+        self.files += len(works)
+        return works
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "files": self.files,
+            "avg_files_per_batch": round(self.files / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+def new_embed_accumulator(provider: str, cache: "EmbedCache") -> Optional[EmbedAccumulator]:
+    if not EMBED_ACCUMULATE:
+        return None
+    target = EMBED_ACCUMULATE_CHUNKS if EMBED_ACCUMULATE_CHUNKS > 0 else OLLAMA_BATCH_SIZE
+    # An explicit QDRANT_EMBED_ACCUMULATE_CHUNKS wins over the adaptive batch size.
+    follow = ADAPTIVE and EMBED_ACCUMULATE_CHUNKS <= 0
+    return EmbedAccumulator(provider, cache, target, EMBED_ACCUMULATE_MAX_WAIT_MS / 1000.0, follow_adaptive=follow)
+
+
+@dataclass
+class SentBatch:
+    # One upsert batch plus everything that may only be committed once Qdrant acknowledged it.
+    batch_id: int
+    points: List[Dict[str, Any]]
+    states: List[Tuple[str, int, int, int, int, bool, str, str]]
+    snippets: List[Tuple[Any, ...]]
+    snippet_moves: List[Tuple[str, str, int, int, str]]
+    snippet_stale_deletes: List[Tuple[str, int]]
+    qdrant_stale_deletes: List[Tuple[str, int]]
+    moves: List[str]
+    dup_deletes: List[str]
+    dup_states: List[Tuple[str, int, int, int, int, bool, str, str]]
+    near_dups: List[Tuple[str, bytes]]
+    point_deletes: List[str]
+    shared: List[str]
+    reused: int
+    sent_at: float = 0.0
+    upsert_s: float = 0.0  # time spent in the upsert request itself (excludes waiting to be collected)
+    future: Optional[Future] = None
+
+
+class BatchWriter:
+    """
+    Commit stage: owns the Qdrant batch, pending snippet rows and pending file_state rows.
+
+    file_state only advances after Qdrant accepted the upsert, no matter whether files arrive
+    from the sequential loop or from the pipelined stages. With `inflight` > 0 upserts run in the
+    background (up to `inflight` batches at once) and acknowledged batches are committed in send
+    order; flush() is the barrier that sends the current batch and waits for all of them.
+    An optional `size_ctl` retunes batch_size from each upsert's latency and outcome.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        snip_conn: Optional[sqlite3.Connection],
+        cfg_hash: str,
+        run_id: str,
+        audit: AuditLog,
+        stats: RunStats,
+        batch_size: int,
+        inflight: int = 0,
+        size_ctl: Optional[AimdController] = None,
+    ) -> None:
+        self.conn = conn
+        self.snip_conn = snip_conn
+        self.cfg_hash = cfg_hash
+        self.run_id = run_id
+        self.audit = audit
+        self.stats = stats
+        self.batch_size = max(1, batch_size)
+        self.size_ctl = size_ctl
+        if size_ctl is not None:
+            self.batch_size = size_ctl.get()
+        self.batch_id = 0
+        self.batch: List[Dict[str, Any]] = []
+        self.pending_states: List[Tuple[str, int, int, int, int, bool, str, str]] = []
+        self.pending_snippets: List[Tuple[Any, ...]] = []
+        self.pending_qdrant_stale_deletes: List[Tuple[str, int]] = []
+        self.pending_snippet_stale_deletes: List[Tuple[str, int]] = []
+        self.batch_reused = 0
+        self.pending_moves: List[str] = []
+        self.pending_snippet_moves: List[Tuple[str, str, int, int, str]] = []
+        self.pending_dup_deletes: List[str] = []
+        self.pending_dup_states: List[Tuple[str, int, int, int, int, bool, str, str]] = []
+        self.pending_near_dups: List[Tuple[str, bytes]] = []
+        self.pending_point_deletes: List[str] = []
+        self.pending_shared: List[str] = []
+        # QDRANT_SHARED_CHUNKS: placement of recently committed chunk texts whose snippets rows may still be in flight.
+        self.recent_hashes: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self.inflight_max = max(0, inflight)
+        self.inflight: "deque[SentBatch]" = deque()
+        self.upsert_pool = ThreadPoolExecutor(max_workers=self.inflight_max, thread_name_prefix="upsert") if self.inflight_max else None
+        self.max_inflight_seen = 0
+
+    def _take(self) -> SentBatch:
+        self.batch_id += 1
+        sent = SentBatch(
+            batch_id=self.batch_id,
+            points=self.batch,
+            states=self.pending_states,
+            snippets=self.pending_snippets,
+            snippet_moves=self.pending_snippet_moves,
+            snippet_stale_deletes=self.pending_snippet_stale_deletes,
+            qdrant_stale_deletes=self.pending_qdrant_stale_deletes,
+            moves=self.pending_moves,
+            dup_deletes=self.pending_dup_deletes,
+            dup_states=self.pending_dup_states,
+            near_dups=self.pending_near_dups,
+            point_deletes=self.pending_point_deletes,
+            shared=self.pending_shared,
+            reused=self.batch_reused,
+            sent_at=time.time(),
+        )
+        self.batch = []
+        self.pending_states = []
+        self.pending_snippets = []
+        self.pending_snippet_moves = []
+        self.pending_snippet_stale_deletes = []
+        self.pending_qdrant_stale_deletes = []
+        self.pending_moves = []
+        self.pending_dup_deletes = []
+        self.pending_dup_states = []
+        self.pending_near_dups = []
+        self.pending_point_deletes = []
+        self.pending_shared = []
+        self.batch_reused = 0
+        return sent
+
+    def send(self) -> None:
+        """Hand the current batch to Qdrant: synchronously, or in the background when async upserts are on."""
+        if not self.batch and not self.pending_states:
+            return
+        sent = self._take()
+        if self.upsert_pool is None:
+            try:
+                self._upsert(sent)
+            except Exception as e:
+                self._failed(sent, e)
+                raise
+            self._commit(sent)
+            return
+        sent.future = self.upsert_pool.submit(self._upsert, sent)
+        self.inflight.append(sent)
+        self.max_inflight_seen = max(self.max_inflight_seen, len(self.inflight))
+        self.collect(block=len(self.inflight) > self.inflight_max)
+
+    def collect(self, block: bool = False) -> None:
+        # Commit acknowledged batches in send order; with block=True wait for at least the oldest one.
+        while self.inflight:
+            head = self.inflight[0]
+            assert head.future is not None
+            if not head.future.done() and not block:
+                return
+            try:
+                head.future.result()
+            except Exception as e:
+                self.inflight.popleft()
+                self._failed(head, e)
+                # Later batches may have landed in Qdrant, but their state never advances: they are redone next run.
+                for rest in self.inflight:
+                    rest.future.cancel()
+                self.inflight.clear()
+                raise
+            self.inflight.popleft()
+            self._commit(head)
+            block = False
+
+    def flush(self) -> None:
+        self.send()
+        if self.inflight:
+            while self.inflight:
+                self.collect(block=True)
+        if self.pending_dup_deletes:
+            sent = self._take()
+            self.flush_deletes(sent)
+            self.conn.commit()
+
+    def close(self) -> None:
+        if self.upsert_pool is not None:
+            self.upsert_pool.shutdown(wait=True)
+
+    def _upsert(self, sent: SentBatch) -> None:
+        t0 = time.time()
+        try:
+            upsert_batch(sent.points)
+        finally:
+            sent.upsert_s = time.time() - t0
+
+    def _tune(self, sent: SentBatch, ok: bool) -> None:
+        if self.size_ctl is not None and sent.points:
+            self.batch_size = self.size_ctl.observe(len(sent.points), sent.upsert_s, ok)
+
+    def _failed(self, sent: SentBatch, e: BaseException) -> None:
+        self._tune(sent, ok=False)
+        self.audit.write(
+            {
+                "run_id": self.run_id,
+                "batch_id": sent.batch_id,
+                "status": "error",
+                "count": len(sent.points),
+                "first_path": sent.points[0]["payload"].get("path", ""),
+                "last_path": sent.points[-1]["payload"].get("path", ""),
+                "error": str(e),
+                "timestamp": int(time.time()),
+            },
+            flush=True,
+        )
+
+    def _commit(self, sent: SentBatch) -> None:
+        batch = sent.points
+        self._tune(sent, ok=True)
+        try:
+            upsert_snippets(self.snip_conn, sent.snippets)
+            if self.snip_conn is not None:
+                self.snip_conn.executemany(
+                    "UPDATE chunks SET point_id = ?, path = ?, mtime = ?, size = ? WHERE point_id = ?",
+                    sent.snippet_moves,
+                )
+                for p, min_idx in sent.snippet_stale_deletes:
+                    delete_snippets_stale(self.snip_conn, p, min_idx)
+                if sent.shared:
+                    self.snip_conn.executemany(
+                        "INSERT OR IGNORE INTO shared_points (text_hash, created_at) VALUES (?, ?)",
+                        [(h, int(time.time())) for h in sent.shared],
+                    )
+                self.snip_conn.commit()
+        except Exception as e:
+            log(f"snippets_flush_error err={e}")
+        if batch:
+            self.audit.write(
+                {
+                    "run_id": self.run_id,
+                    "batch_id": sent.batch_id,
+                    "status": "ok",
+                    "count": len(batch),
+                    "chunks_reused": sent.reused,
+                    "reuse_ratio": round(sent.reused / len(batch), 3),
+                    "upsert_ms": int((time.time() - sent.sent_at) * 1000),
+                    "first_path": batch[0]["payload"].get("path", ""),
+                    "last_path": batch[-1]["payload"].get("path", ""),
+                    "timestamp": int(time.time()),
+                }
+            )
+        for p, size, mtime, aux_mtime, aux_size, complete, fp, last_err in sent.states:
+            set_state(self.conn, p, size, mtime, aux_mtime, aux_size, self.cfg_hash, complete, fp, last_err)
+        if sent.near_dups:
+            # A canonical whose text changed keeps its role, but its aliases must be compared again.
+            changed = []
+            for p, minhash in sent.near_dups:
+                row = self.conn.execute("SELECT minhash FROM near_dup WHERE path = ?", (p,)).fetchone()
+                if row and row[0] != minhash:
+                    changed.append(p)
+            if changed:
+                forget_near_dup_canonicals(self.conn, changed, "canonical_changed", keep_index=True)
+            self.conn.executemany("INSERT OR REPLACE INTO near_dup (path, minhash) VALUES (?, ?)", sent.near_dups)
+        self.conn.commit()
+        self.flush_deletes(sent)
+        self.audit.flush()
+
+    def flush_deletes(self, sent: SentBatch) -> None:
+        """
+        Every Qdrant delete collected with a batch goes out as one filtered request: stale tail chunks of
+        re-indexed files, duplicates that must not keep points, and old paths of moved files.
+        Only called after the batch those deletes belong to was upserted.
+        """
+        if sent.point_deletes:
+            try:
+                delete_point_ids(sent.point_deletes)
+                self.stats.incr("delete_requests")
+            except Exception as e:
+                # A leftover per-path copy of a shared chunk only duplicates a search hit; the file's next reindex retries.
+                log(f"delete_ids_error count={len(sent.point_deletes)} err={e}")
+        stale, dups, moves = sent.qdrant_stale_deletes, sent.dup_deletes, sent.moves
+        if not (stale or dups or moves):
+            return
+        try:
+            delete_points_batch(stale, dups + moves)
+        except Exception as e:
+            # Duplicates stay unmarked and are retried next run; old rows of moved files are left for the sweep.
+            log(f"delete_batch_error stale={len(stale)} paths={len(dups) + len(moves)} err={e}")
+            return
+        self.stats.incr("delete_requests")
+        for p, size, mtime, aux_mtime, aux_size, complete, fp, last_err in sent.dup_states:
+            set_state(self.conn, p, size, mtime, aux_mtime, aux_size, self.cfg_hash, complete, fp, last_err)
+        if moves:
+            marks = ",".join("?" * len(moves))
+            self.conn.execute(f"DELETE FROM file_state WHERE path IN ({marks})", moves)
+            self.conn.execute(f"DELETE FROM ocr_queue WHERE path IN ({marks})", moves)
+            forget_near_dup_canonicals(self.conn, moves, "canonical_moved")
+        self.conn.commit()
+
+    def report(self) -> Dict[str, Any]:
+        return {"inflight": self.inflight_max, "batches": self.batch_id, "max_inflight_seen": self.max_inflight_seen}
+
+    def place_chunk(self, path: str, pid: str, chunk_hash: str) -> str:
+        """
+        QDRANT_SHARED_CHUNKS: where a chunk's vector lives. "own" is a per-path point (first copy of the text).
+        "shared" means the text's shared point exists already. "new_shared" means this is the second file
+        with the text: the shared point is created and the first file's per-path point is deleted.
+        """
+        owner = self.recent_hashes.get(chunk_hash)
+        if owner is None:
+            assert self.snip_conn is not None
+            if self.snip_conn.execute("SELECT 1 FROM shared_points WHERE text_hash = ?", (chunk_hash,)).fetchone():
+                owner = ("", "")
+            else:
+                row = self.snip_conn.execute(
+                    "SELECT path, point_id FROM chunks WHERE text_hash = ? AND path != ? LIMIT 1", (chunk_hash, path)
+                ).fetchone()
+                owner = (row[0], row[1]) if row else (path, pid)
+        placement = "own"
+        if owner[0] == "":
+            placement = "shared"
+        elif owner[0] != path:
+            self.pending_point_deletes.append(owner[1])
+            self.pending_shared.append(chunk_hash)
+            owner = ("", "")
+            placement = "new_shared"
+        self.recent_hashes[chunk_hash] = owner
+        self.recent_hashes.move_to_end(chunk_hash)
+        while len(self.recent_hashes) > 65536:
+            self.recent_hashes.popitem(last=False)
+        return placement
+
+    def commit_move(self, work: FileWork) -> None:
+        path = str(work.path)
+        stat = work.stat
+        file_points: List[Dict[str, Any]] = []
+        for p in work.moved_points:
+            payload = dict(p["payload"])
+            payload.update({"path": path, "name": work.path.name, "mtime": int(stat.st_mtime)})
+            if not SLIM_PAYLOAD:
+                payload["size"] = stat.st_size  # as in point_payload(): slim points carry filter fields only
+            pid = point_id_for(path, int(payload["chunk_index"]))
+            file_points.append({"id": pid, "vector": p["vector"], "payload": payload})
+            self.pending_snippet_moves.append((pid, path, int(stat.st_mtime), int(stat.st_size), str(p["id"])))
+        if self.batch and (len(self.batch) + len(file_points) > self.batch_size):
+            self.send()
+        self.batch.extend(file_points)
+        self.pending_moves.append(work.moved_from)
+        self.pending_states.append(
+            (path, int(stat.st_size), int(stat.st_mtime), int(work.aux_mtime), int(work.aux_size), True, work.moved_fp, "")
+        )
+        self.stats.incr("files_moved")
+        self.stats.incr("points_moved", len(file_points))
+        self.audit.write(
+            {"run_id": self.run_id, "status": "move", "path": path, "from_path": work.moved_from, "points": len(file_points), "timestamp": int(time.time())}
+        )
+        if len(self.batch) >= self.batch_size:
+            self.send()
+
+    def commit_dedup(self, work: FileWork) -> None:
+        path = work.path
+        stat = work.stat
+        # ensure duplicates do not linger from previous runs; the Qdrant delete and the state row go out with the next flush
+        delete_snippets_for_path(self.snip_conn, str(path))
+        self.stats.incr("skipped")
+        self.stats.incr("skipped_dedup" if work.kind == "dedup" else "skipped_near_dup")
+        if work.kind == "near_dup":
+            # If this file used to be a canonical, its own aliases have to find a new one.
+            forget_near_dup_canonicals(self.conn, [str(path)], "canonical_aliased")
+        self.pending_dup_deletes.append(str(path))
+        self.pending_dup_states.append(
+            (str(path), int(stat.st_size), int(stat.st_mtime), int(work.aux_mtime), int(work.aux_size), True, work.sig, "")
+        )
+        try:
+            self.audit.write(
+                {
+                    "run_id": self.run_id,
+                    "batch_id": self.batch_id,
+                    "status": "dedup_skip" if work.kind == "dedup" else "near_dup_skip",
+                    "path": str(path),
+                    "canonical_path": work.canonical,
+                    "sig": work.sig,
+                    "similarity": work.similarity if work.kind == "near_dup" else 1.0,
+                    "timestamp": int(time.time()),
+                },
+                flush=True,
+            )
+        except Exception:
+            pass
+        if len(self.pending_dup_deletes) >= self.batch_size:
+            self.flush()
+
+    def commit_file(self, work: FileWork) -> None:
+        if work.kind in ("dedup", "near_dup"):
+            self.commit_dedup(work)
+            return
+        if work.kind == "move":
+            self.commit_move(work)
+            return
+        path = work.path
+        stat = work.stat
+        chunks = work.chunks
+        source = work.source
+        if work.pdf_sig and work.pdf_pages > 0 and work.pdf_pages != work.pdf_pages_cached:
+            # A fact about the bytes, not about Qdrant: no need to wait for the upsert.
+            cache_pdf_pages(self.conn, work.pdf_sig, work.pdf_pages)
+        if source == "pdf_no_text" and work.aux_mtime == 0 and work.aux_size == 0:
+            enqueue_ocr(self.conn, path, stat, f"low_text source={source}")
+        if OCR_IMAGES_ENABLED and source == "image_no_text" and work.aux_mtime == 0 and work.aux_size == 0:
+            enqueue_ocr(self.conn, path, stat, f"low_text source={source}")
+        if self.conn.in_transaction:
+            # Do not sit on the write lock until the next send(): the pipelined walker writes content_sig rows.
+            self.conn.commit()
 
-        vectors, vec_errs = embed_texts(provider, chunks, cache)
         file_had_points = False
         file_complete = True
         last_err = ""
         file_points: List[Dict[str, Any]] = []
         now_ts = int(time.time())
-        for idx, (chunk, vec) in enumerate(zip(chunks, vectors)):
+        for idx, (chunk, vec) in enumerate(zip(chunks, work.vectors)):
             if vec is None:
-                embed_errors += 1
-                skipped += 1
+                self.stats.incr("embed_errors")
+                self.stats.incr("skipped")
                 file_complete = False
-                last_err = vec_errs[idx] or last_err or "embedding_failed"
+                last_err = work.vec_errs[idx] or last_err or "embedding_failed"
                 continue
-            pid = str(uuid.UUID(hex=hashlib.md5(f"{path}::{idx}".encode("utf-8")).hexdigest()))
-            # Hash the exact text sent for embeddings (after clamping) so the payload reflects reality.
-            chunk_for_embed = clamp_embedding_text(chunk)
-            preview = chunk if PAYLOAD_PREVIEW_MAX_CHARS == 0 else chunk[: max(0, PAYLOAD_PREVIEW_MAX_CHARS)]
+            pid = point_id_for(str(path), idx)
             snippet_text = chunk if SNIPPET_MAX_CHARS == 0 else chunk[: max(0, SNIPPET_MAX_CHARS)]
-            payload = {
-                "path": str(path),
-                "name": path.name,
-                "size": stat.st_size,
-                "mtime": int(stat.st_mtime),
-                "source": "dropbox",
-                "text_source": source,
-                "chunk_index": idx,
-                "chunk_total": len(chunks),
-                "text_hash": text_hash(chunk_for_embed),
-                "preview": preview,
-            }
-            file_points.append({"id": pid, "vector": vec, "payload": payload})
-            pending_snippets.append(
+            payload = point_payload(str(path), stat.st_size, int(stat.st_mtime), source, idx, len(chunks), chunk)
+            placement = "own"
+            if SHARED_CHUNKS and self.snip_conn is not None:
+                placement = self.place_chunk(str(path), pid, payload["text_hash"])
+            if placement == "own":
+                if idx < len(work.members) and work.members[idx]:
+                    payload["archive_member"] = work.members[idx]
+                file_points.append({"id": pid, "vector": vec, "payload": payload})
+                self.stats.incr("points_indexed")
+            else:
+                if work.had_prev:
+                    self.pending_point_deletes.append(pid)  # this chunk's per-path point from an earlier version
+                if placement == "new_shared":
+                    shared_pid = shared_point_id(payload["text_hash"])
+                    file_points.append({"id": shared_pid, "vector": vec, "payload": shared_point_payload(chunk)})
+                    self.stats.incr("points_indexed")
+                self.stats.incr("chunks_shared")
+            self.pending_snippets.append(
                 (
                     pid,
                     str(path),
@@ -1485,66 +3523,997 @@ def main() -> int:
                     int(stat.st_mtime),
                     int(stat.st_size),
                     source,
-                    cfg_hash,
+                    self.cfg_hash,
                     payload["text_hash"],
                     snippet_text,
                     now_ts,
                 )
             )
-            points_indexed += 1
             file_had_points = True
 
         if file_had_points:
-            files_indexed += 1
+            self.stats.incr("files_indexed")
         else:
             # Do not mark as complete; this file should be retried later.
             try:
                 set_state(
-                    conn,
+                    self.conn,
                     str(path),
                     int(stat.st_size),
                     int(stat.st_mtime),
-                    int(aux_mtime),
-                    int(aux_size),
-                    cfg_hash,
+                    int(work.aux_mtime),
+                    int(work.aux_size),
+                    self.cfg_hash,
                     False,
                     chunks_fingerprint(chunks),
                     last_err or "no_vectors",
                 )
-                if files_seen % 200 == 0:
-                    conn.commit()
+                self.conn.commit()
             except Exception:
                 pass
-            continue
+            return
 
         # Keep file points together (no partial splits across upserts) so state only advances on successful write.
-        if batch and (len(batch) + len(file_points) > effective_batch_size):
-            flush_batch()
-
-        batch.extend(file_points)
-        if had_prev:
-            pending_qdrant_stale_deletes.append((str(path), int(len(chunks))))
-            pending_snippet_stale_deletes.append((str(path), int(len(chunks))))
-        pending_states.append(
+        if self.batch and (len(self.batch) + len(file_points) > self.batch_size):
+            self.send()
+
+        self.batch.extend(file_points)
+        reused = sum(1 for i in work.reused if i < len(work.vectors) and work.vectors[i] is not None)
+        if reused:
+            self.batch_reused += reused
+            self.stats.incr("chunks_reused", reused)
+        if work.had_prev:
+            self.pending_qdrant_stale_deletes.append((str(path), int(len(chunks))))
+            self.pending_snippet_stale_deletes.append((str(path), int(len(chunks))))
+        self.pending_states.append(
             (
                 str(path),
                 int(stat.st_size),
                 int(stat.st_mtime),
-                int(aux_mtime),
-                int(aux_size),
+                int(work.aux_mtime),
+                int(work.aux_size),
                 file_complete,
                 chunks_fingerprint(chunks),
                 last_err,
             )
         )
+        if work.minhash:
+            self.pending_near_dups.append((str(path), work.minhash))
+
+        # Files whose chunks all sit on existing shared points add state rows but no points.
+        if len(self.batch) >= self.batch_size or len(self.pending_states) >= self.batch_size:
+            self.send()
+
+
+def run_sequential(
+    conn: sqlite3.Connection,
+    roots: List[str],
+    provider: str,
+    cfg_hash: str,
+    writer: BatchWriter,
+    cache: "EmbedCache",
+    stats: RunStats,
+    accumulator: Optional[EmbedAccumulator] = None,
+    state_index: Optional[StateIndex] = None,
+    est_total: int = 0,
+    files: Optional[Iterable[Tuple[Path, Optional[os.stat_result]]]] = None,
+    max_files: Optional[int] = None,
+) -> None:
+    if files is None:
+        files = walk_files(roots, est_total)
+    limit = MAX_FILES if max_files is None else max_files
+    queued = 0
+    for path, st in files:
+        # QDRANT_MAX_FILES counts files taken for indexing, as in the pipelined walk stage.
+        if limit and queued >= limit:
+            break
+        work = prepare_file(conn, path, roots, cfg_hash, stats, state_index, st)
+        if work is None:
+            continue
+        if work.kind == "index":
+            queued += 1
+            extract_work(work)
+            if not work.chunks:
+                stats.incr("skipped")
+                continue
+        if work.kind == "index":  # still: extraction may have made it a near-duplicate alias
+            if accumulator is not None:
+                for ready in accumulator.add(work):
+                    writer.commit_file(ready)
+                continue
+            embed_work(provider, work, cache)
+        writer.commit_file(work)
+    if accumulator is not None:
+        for ready in accumulator.flush():
+            writer.commit_file(ready)
+
+
+_STAGE_DONE = object()
+
+
+class StageQueue:
+    """Bounded queue between two pipeline stages that records depth and blocking time."""
+
+    def __init__(self, name: str, maxsize: int, stop: threading.Event) -> None:
+        self.name = name
+        self.q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, maxsize))
+        self.stop = stop
+        self._lock = threading.Lock()
+        self.put_wait_s = 0.0
+        self.get_wait_s = 0.0
+        self.items = 0
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.depth_samples = 0
+
+    def put(self, item: Any) -> bool:
+        t0 = time.time()
+        while True:
+            if self.stop.is_set():
+                return False
+            try:
+                self.q.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        depth = self.q.qsize()
+        with self._lock:
+            self.put_wait_s += time.time() - t0
+            self.items += 1
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_sum += depth
+            self.depth_samples += 1
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        # Returns _STAGE_DONE on end of stream (or when the pipeline is stopping), None on timeout.
+        t0 = time.time()
+        try:
+            while True:
+                if self.stop.is_set():
+                    return _STAGE_DONE
+                wait = 0.5 if timeout is None else max(0.0, min(0.5, t0 + timeout - time.time()))
+                try:
+                    return self.q.get(timeout=wait)
+                except queue.Empty:
+                    if timeout is not None and time.time() - t0 >= timeout:
+                        return None
+        finally:
+            with self._lock:
+                self.get_wait_s += time.time() - t0
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "depth": self.q.qsize(),
+                "max_depth": self.max_depth,
+                "avg_depth": round(self.depth_sum / self.depth_samples, 2) if self.depth_samples else 0.0,
+                "items": self.items,
+                "producer_blocked_s": round(self.put_wait_s, 2),
+                "consumer_starved_s": round(self.get_wait_s, 2),
+            }
+
+
+def run_pipeline(
+    roots: List[str],
+    provider: str,
+    cfg_hash: str,
+    writer: BatchWriter,
+    cache: "EmbedCache",
+    stats: RunStats,
+    extract_pool: Optional[ExtractPool] = None,
+    accumulator: Optional[EmbedAccumulator] = None,
+    state_index: Optional[StateIndex] = None,
+    est_total: int = 0,
+) -> Dict[str, Any]:
+    """
+    Pipelined mode: walk, extract, embed and commit run concurrently, joined by bounded queues.
+
+    The commit stage stays on the calling thread (it owns the state DB connection used by
+    BatchWriter), so file_state still only advances after a successful flush().
+    """
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    q_extract = StageQueue("extract", PIPELINE_QUEUE_SIZE, stop)
+    q_embed = StageQueue("embed", PIPELINE_QUEUE_SIZE, stop)
+    q_commit = StageQueue("commit", PIPELINE_QUEUE_SIZE, stop)
+    busy: Dict[str, float] = {"walk": 0.0, "extract": 0.0, "embed": 0.0, "commit": 0.0}
+
+    def walk_stage() -> None:
+        # Separate connection: sqlite3 connections must not be shared across threads.
+        walk_conn = ensure_state_db()
+        queued = 0
+        try:
+            for path, st in walk_files(roots, est_total):
+                if MAX_FILES and queued >= MAX_FILES:
+                    break
+                t0 = time.time()
+                work = prepare_file(walk_conn, path, roots, cfg_hash, stats, state_index, st)
+                if walk_conn.in_transaction:
+                    # Release the write lock right away; the commit stage writes through its own connection.
+                    walk_conn.commit()
+                busy["walk"] += time.time() - t0
+                if work is None:
+                    continue
+                target = q_extract if work.kind == "index" else q_commit
+                if not target.put(work):
+                    return
+                if work.kind == "index":
+                    queued += 1
+        finally:
+            walk_conn.close()
+
+    def extract_stage() -> None:
+        while True:
+            work = q_extract.get()
+            if work is _STAGE_DONE:
+                return
+            t0 = time.time()
+            extract_work(work)
+            busy["extract"] += time.time() - t0
+            if not work.chunks:
+                stats.incr("skipped")
+                continue
+            if not (q_commit if work.kind == "near_dup" else q_embed).put(work):
+                return
+
+    def extract_stage_pooled() -> None:
+        pool = extract_pool
+        assert pool is not None
+        inflight: Dict[Future, Tuple[FileWork, float, int]] = {}
+        input_done = False
+
+        def finish(work: FileWork, chunks: List[str], source: str) -> bool:
+            work.chunks = chunks[: max(1, MAX_CHUNKS_PER_FILE)] if chunks else []
+            work.source = source
+            if not work.chunks:
+                stats.incr("skipped")
+                return True
+            if NEAR_DUP_INDEX is not None:
+                NEAR_DUP_INDEX.check(work)
+            return (q_commit if work.kind == "near_dup" else q_embed).put(work)
+
+        def give_up(work: FileWork, source: str) -> bool:
+            log(f"extract_failed path={work.path} reason={source}")
+            return finish(work, [path_context_text(work.path)], source)
+
+        while True:
+            if stop.is_set():
+                return
+            # Keep at most one file per worker in flight so the timeout measures extraction time only.
+            while not input_done and len(inflight) < pool.workers:
+                work = q_extract.get(timeout=None if not inflight else 0.05)
+                if work is None:
+                    break
+                if work is _STAGE_DONE:
+                    input_done = True
+                    break
+                inflight[pool.submit(work.path, work.stat, work.extract_meta())] = (work, time.time(), 1)
+            if not inflight:
+                if input_done:
+                    return
+                continue
+
+            t0 = time.time()
+            done, _ = wait(list(inflight), timeout=0.5, return_when=FIRST_COMPLETED)
+            busy["extract"] += time.time() - t0
+            broken = False
+            retry: List[Tuple[FileWork, int, bool]] = []  # (work, attempts, charged)
+            for fut in done:
+                work, _started, attempts = inflight.pop(fut)
+                try:
+                    chunks, source, meta = fut.result()
+                    work.apply_meta(meta)
+                except BrokenProcessPool:
+                    broken = True
+                    retry.append((work, attempts, True))
+                    continue
+                except Exception as e:
+                    log(f"extract_error path={work.path} err={e}")
+                    chunks, source = [path_context_text(work.path)], "extract_error"
+                if not finish(work, chunks, source):
+                    return
+
+            now = time.time()
+            expired = [f for f, (_w, started, _a) in inflight.items() if now - started >= pool.timeout_s]
+            if expired:
+                pool.timeouts += len(expired)
+                for f in expired:
+                    work, _started, _a = inflight.pop(f)
+                    if not give_up(work, "extract_timeout"):
+                        return
+                pool.kill()
+                broken = True
+            elif broken:
+                pool.crashes += 1
+
+            if broken:
+                # Everything still in flight died with the pool. Those files did nothing wrong: resubmit them
+                # without charging an attempt. Files whose own future broke get one retry on the fresh pool.
+                retry.extend((w, a, False) for (w, _started, a) in inflight.values())
+                inflight.clear()
+                pool.restart()
+                for work, attempts, charged in retry:
+                    if charged and attempts >= 2:
+                        if not give_up(work, "extract_crashed"):
+                            return
+                        continue
+                    attempts += 1 if charged else 0
+                    inflight[pool.submit(work.path, work.stat, work.extract_meta())] = (work, time.time(), attempts)
+
+    def embed_stage() -> None:
+        while True:
+            if accumulator is None:
+                work = q_embed.get()
+                if work is _STAGE_DONE:
+                    return
+                t0 = time.time()
+                embed_work(provider, work, cache)
+                busy["embed"] += time.time() - t0
+                ready = [work]
+            else:
+                work = q_embed.get(timeout=accumulator.remaining_wait())
+                t0 = time.time()
+                if work is None or work is _STAGE_DONE:
+                    # Deadline reached (or end of stream): send whatever is pending.
+                    ready = accumulator.flush()
+                else:
+                    ready = accumulator.add(work)
+                busy["embed"] += time.time() - t0
+            for w in ready:
+                if not q_commit.put(w):
+                    return
+            if work is _STAGE_DONE:
+                return
+
+    def run_stage(fn, out_queues: List[StageQueue]) -> None:
+        try:
+            fn()
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for q in out_queues:
+                q.put(_STAGE_DONE)
+
+    # Dedup work goes from walk straight to commit. It is always queued before the walk stage
+    # ends, so it sits ahead of the embed stage's end marker in the FIFO commit queue.
+    threads = [
+        threading.Thread(target=run_stage, args=(walk_stage, [q_extract]), name="index-walk", daemon=True),
+        threading.Thread(
+            target=run_stage,
+            args=(extract_stage if extract_pool is None else extract_stage_pooled, [q_embed]),
+            name="index-extract",
+            daemon=True,
+        ),
+        threading.Thread(target=run_stage, args=(embed_stage, [q_commit]), name="index-embed", daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    def report() -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "stages_busy_s": {k: round(v, 2) for k, v in busy.items()},
+            "queues": {q.name: q.report() for q in (q_extract, q_embed, q_commit)},
+        }
+        if extract_pool is not None:
+            out["extract_pool"] = extract_pool.report()
+        if accumulator is not None:
+            out["embed_accumulator"] = accumulator.report()
+        return out
+
+    last_report = time.time()
+    try:
+        while True:
+            # Wake up well inside the walker's 30 s lock timeout, even when embedding is slow.
+            work = q_commit.get(timeout=min(PIPELINE_REPORT_SECONDS, 5.0))
+            if time.time() - last_report >= PIPELINE_REPORT_SECONDS:
+                log(f"pipeline_status run_id={writer.run_id} {json.dumps(report(), sort_keys=True)}")
+                last_report = time.time()
+            if work is None:
+                if writer.conn.in_transaction:
+                    writer.conn.commit()
+                continue
+            if work is _STAGE_DONE:
+                break
+            t0 = time.time()
+            writer.commit_file(work)
+            busy["commit"] += time.time() - t0
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for t in threads:
+            t.join(timeout=5)
+
+    if errors:
+        raise errors[0]
+    return report()
+
+
+@dataclass
+class WatchEvents:
+    changed: Set[str] = field(default_factory=set)
+    deleted: Set[str] = field(default_factory=set)
+    deleted_dirs: Set[str] = field(default_factory=set)
+    overflow: bool = False
+
+
+def _watch_name_ok(name: str) -> bool:
+    return bool(name) and name not in EXCLUDE_FILE_NAMES and not name.startswith("._")
+
+
+class InotifyWatcher:
+    """
+    Recursive inotify watches over the roots (Linux only, via libc). Raises OSError when inotify is
+    unavailable or the watch limit (fs.inotify.max_user_watches) is hit; callers fall back to SnapshotWatcher.
+    """
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    _EVENT = struct.Struct("iIII")
+
+    name = "inotify"
+
+    def __init__(self, roots: List[str]) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        import ctypes
+
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._ctypes = ctypes
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+        self.wd_paths: Dict[int, str] = {}
+        try:
+            for root in roots:
+                if os.path.isdir(root):
+                    self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, path: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            if err in (errno.ENOENT, errno.EACCES, errno.ENOTDIR):
+                return
+            raise OSError(err, f"inotify_add_watch failed for {path}: {os.strerror(err)}")
+        self.wd_paths[wd] = path
+
+    def _add_tree(self, top: str) -> None:
+        stack = [top]
+        while stack:
+            d = stack.pop()
+            self._add_watch(d)
+            listing = _scan_dir(d)
+            if listing is not None:
+                stack.extend(listing[1])
+
+    def poll(self, timeout: float) -> WatchEvents:
+        events = WatchEvents()
+        ready, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not ready:
+            return events
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+            off = 0
+            while off + self._EVENT.size <= len(buf):
+                wd, mask, _cookie, name_len = self._EVENT.unpack_from(buf, off)
+                off += self._EVENT.size
+                name = buf[off:off + name_len].rstrip(b"\0").decode("utf-8", "surrogateescape")
+                off += name_len
+                self._handle(events, wd, mask, name)
+        return events
+
+    def _handle(self, events: WatchEvents, wd: int, mask: int, name: str) -> None:
+        if mask & self.IN_Q_OVERFLOW:
+            events.overflow = True
+            return
+        if mask & self.IN_IGNORED:
+            self.wd_paths.pop(wd, None)
+            return
+        base = self.wd_paths.get(wd)
+        if base is None or not name:
+            return
+        path = os.path.join(base, name)
+        if mask & self.IN_ISDIR:
+            if name in EXCLUDE_DIR_NAMES:
+                return
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                # New or moved-in directory: watch it and report everything already inside.
+                try:
+                    self._add_tree(path)
+                except OSError as e:
+                    log(f"watch_add_error path={path} err={e}")
+                    events.overflow = True
+                for p, _ in walk_files([path], workers=1):
+                    events.changed.add(str(p))
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                events.deleted_dirs.add(path)
+            return
+        if not _watch_name_ok(name):
+            return
+        if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+            events.deleted.add(path)
+            events.changed.discard(path)
+        else:
+            events.changed.add(path)
+            events.deleted.discard(path)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class SnapshotWatcher:
+    """
+    Portable fallback: re-walk the roots every poll_s seconds and diff (size, mtime_ns) against the last snapshot.
+    Metadata only; no SQLite or Qdrant traffic for unchanged files.
+    """
+
+    name = "snapshot"
+
+    def __init__(self, roots: List[str], poll_s: float) -> None:
+        self.roots = roots
+        self.poll_s = max(0.1, poll_s)
+        self.snapshot = self._take()
+        self.next_scan = time.time() + self.poll_s
+
+    def _take(self) -> Dict[str, Tuple[int, int]]:
+        snap: Dict[str, Tuple[int, int]] = {}
+        for p, st in walk_files(self.roots):
+            snap[str(p)] = (st.st_size, st.st_mtime_ns) if st is not None else (-1, -1)
+        return snap
+
+    def poll(self, timeout: float) -> WatchEvents:
+        events = WatchEvents()
+        wait_s = self.next_scan - time.time()
+        if wait_s > 0:
+            time.sleep(min(wait_s, max(0.0, timeout)))
+            if time.time() < self.next_scan:
+                return events
+        current = self._take()
+        self.next_scan = time.time() + self.poll_s
+        for p, sig in current.items():
+            if self.snapshot.get(p) != sig:
+                events.changed.add(p)
+        events.deleted = set(self.snapshot) - set(current)
+        self.snapshot = current
+        return events
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(roots: List[str]) -> Any:
+    if WATCH_BACKEND in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as e:
+            if WATCH_BACKEND == "inotify":
+                raise
+            log(f"watch_inotify_unavailable err={e}; using snapshot polling every {WATCH_POLL_SECONDS}s")
+    return SnapshotWatcher(roots, WATCH_POLL_SECONDS)
+
+
+class ChangeDebouncer:
+    """
+    Per-path debounce for bursty sync writes: a path is released once it has been quiet for quiet_s,
+    or max_delay_s after its first event even if it keeps changing. The latest event kind wins.
+    """
+
+    def __init__(self, quiet_s: float, max_delay_s: float) -> None:
+        self.quiet_s = quiet_s
+        self.max_delay_s = max(quiet_s, max_delay_s)
+        self.pending: Dict[str, Tuple[str, float, float]] = {}  # path -> (kind, first_seen, last_seen)
+
+    def add(self, paths: Iterable[str], kind: str, now: float) -> None:
+        for p in paths:
+            prev = self.pending.get(p)
+            self.pending[p] = (kind, prev[1] if prev else now, now)
+
+    def pop_ready(self, now: float) -> Dict[str, str]:
+        ready = {
+            p: kind
+            for p, (kind, first, last) in self.pending.items()
+            if now - last >= self.quiet_s or now - first >= self.max_delay_s
+        }
+        for p in ready:
+            del self.pending[p]
+        return ready
+
+
+def known_deleted_paths(conn: sqlite3.Connection, paths: List[str], roots: List[str]) -> List[str]:
+    # Expand deleted files/directories to the file_state rows they cover (directory = path range scan).
+    out: Set[str] = set()
+    for p in paths:
+        if conn.execute("SELECT 1 FROM file_state WHERE path = ?", (p,)).fetchone():
+            out.add(p)
+        prefix = p.rstrip(os.sep) + os.sep
+        hi = prefix[:-1] + chr(ord(os.sep) + 1)
+        out.update(r[0] for r in conn.execute("SELECT path FROM file_state WHERE path >= ? AND path < ?", (prefix, hi)))
+    return sorted(p for p in out if confirmed_deleted(p, roots))
+
+
+def run_watch(
+    watcher: Any,
+    conn: sqlite3.Connection,
+    roots: List[str],
+    provider: str,
+    cfg_hash: str,
+    writer: BatchWriter,
+    cache: "EmbedCache",
+    stats: RunStats,
+    accumulator: Optional[EmbedAccumulator] = None,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """
+    Long-running watch loop: feeds only changed paths (after debouncing) through the sequential
+    extract/embed/commit path. An event-queue overflow triggers one incremental catch-up walk.
+    """
+    stop = stop or threading.Event()
+    debouncer = ChangeDebouncer(WATCH_DEBOUNCE_SECONDS, WATCH_MAX_DELAY_SECONDS)
+    log(f"watch_start backend={watcher.name} roots={len(roots)} debounce_s={WATCH_DEBOUNCE_SECONDS}")
+    while not stop.is_set():
+        events = watcher.poll(min(1.0, WATCH_DEBOUNCE_SECONDS) if debouncer.pending else 1.0)
+        now = time.time()
+        if events.overflow:
+            log("watch_overflow; running an incremental catch-up walk")
+            debouncer.pending.clear()
+            run_sequential(conn, roots, provider, cfg_hash, writer, cache, stats, accumulator, max_files=0)
+            writer.flush()
+            conn.commit()
+            continue
+        debouncer.add(events.changed, "changed", now)
+        debouncer.add(events.deleted, "deleted", now)
+        debouncer.add(events.deleted_dirs, "deleted_dir", now)
+        ready = debouncer.pop_ready(now)
+        if not ready:
+            continue
+
+        t0 = time.time()
+        files: List[Tuple[Path, Optional[os.stat_result]]] = []
+        deleted: List[str] = []
+        for p, kind in sorted(ready.items()):
+            if kind == "changed":
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    deleted.append(p)
+                    continue
+                if not S_ISREG(st.st_mode) or not is_under_any_root(p, roots):
+                    continue
+                files.append((Path(p), st))
+            else:
+                deleted.append(p)
+        before = stats.get("files_indexed")
+        if files:
+            # QDRANT_MAX_FILES caps the initial walk only: a watcher must keep indexing every change.
+            run_sequential(conn, roots, provider, cfg_hash, writer, cache, stats, accumulator, files=files, max_files=0)
+            writer.flush()
+        conn.commit()
+        pruned = 0
+        if deleted and PRUNE:
+            try:
+                pruned = prune_paths(conn, writer.snip_conn, known_deleted_paths(conn, deleted, roots), stats)
+            except Exception as e:
+                # State rows stay in place; the next full-walk sweep picks them up.
+                log(f"watch_prune_error err={e}")
+        stats.incr("watch_batches")
+        stats.incr("watch_deleted", len(deleted))
+        log(
+            f"watch_batch changed={len(files)} indexed={stats.get('files_indexed') - before} "
+            f"deleted={len(deleted)} pruned={pruned} seconds={round(time.time() - t0, 2)}"
+        )
 
-        if len(batch) >= effective_batch_size:
-            flush_batch()
 
-    flush_batch()
+def check_migration_source(
+    snip_conn: Optional[sqlite3.Connection], prev_cfg: Optional[Dict[str, Any]], cfg: Dict[str, Any]
+) -> None:
+    if SHARED_CHUNKS:
+        raise RuntimeError("QDRANT_MIGRATE_FROM_SNIPPETS=1 does not build shared chunks: run it without QDRANT_SHARED_CHUNKS")
+    if snip_conn is None or SNIPPET_MAX_CHARS != 0:
+        raise RuntimeError("QDRANT_MIGRATE_FROM_SNIPPETS=1 needs the snippets DB with full chunk text (QDRANT_SNIPPET_MAX_CHARS=0)")
+    if prev_cfg is None:
+        log("migrate_warning previous run config unknown; extraction settings cannot be compared")
+        return
+    if prev_cfg == cfg:
+        return  # resuming an interrupted migration
+    changed = sorted(k for k in set(prev_cfg) | set(cfg) if k not in EMBEDDING_CFG_KEYS and prev_cfg.get(k) != cfg.get(k))
+    if changed:
+        raise RuntimeError(f"QDRANT_MIGRATE_FROM_SNIPPETS=1 cannot apply extraction setting changes: {', '.join(changed)}")
+    if prev_cfg.get("collection") == cfg.get("collection"):
+        raise RuntimeError("QDRANT_MIGRATE_FROM_SNIPPETS=1 writes a new collection: set QDRANT_COLLECTION to a new name")
+
+
+_MIGRATE_COLUMNS = "point_id, path, chunk_index, chunk_total, mtime, size, source, cfg_hash, text"
+
+
+def migration_skip_reason(conn: sqlite3.Connection, cfg_hash: str, rows: List[Tuple[Any, ...]]) -> str:
+    # rows: one file's chunks rows (_MIGRATE_COLUMNS) sorted by chunk_index; "" = safe to migrate.
+    st = conn.execute(
+        "SELECT size, mtime, cfg_hash, complete, text_hash FROM file_state WHERE path = ?", (rows[0][1],)
+    ).fetchone()
+    if st is None:
+        return "no_state"
+    size, mtime, state_cfg, complete, fingerprint = st
+    if state_cfg == cfg_hash:
+        return "already_migrated"
+    if not complete:
+        return "incomplete"
+    if rows[0][6] == "zip_members":
+        return "archive"  # archive_member is not kept in the snippets DB
+    if any(r[4] != mtime or r[5] != size or r[7] not in (state_cfg, cfg_hash) for r in rows):
+        return "stale_rows"
+    # Every chunk present, none truncated, and from the version that was indexed.
+    if [r[2] for r in rows] != list(range(rows[0][3])) or chunks_fingerprint([r[8] for r in rows]) != fingerprint:
+        return "fingerprint_mismatch"
+    return ""
+
+
+def migrate_from_snippets(
+    conn: sqlite3.Connection,
+    snip_conn: sqlite3.Connection,
+    provider: str,
+    cfg_hash: str,
+    cache: "EmbedCache",
+    stats: "RunStats",
+) -> Dict[str, Any]:
+    """
+    QDRANT_MIGRATE_FROM_SNIPPETS=1: fill COLLECTION from the chunk text kept in the snippets DB instead of the files.
+
+    Rows are read in path order, QDRANT_MIGRATE_BATCH_ROWS at a time (a file is never split across rounds),
+    embedded with the current model and upserted. Each migrated file's file_state row then moves to cfg_hash,
+    so the next normal run skips it. Files whose rows do not reproduce their file_state fingerprint keep their
+    old cfg_hash and are re-extracted by the next normal run.
+    """
+    t0 = time.time()
+    size = max(1, MIGRATE_BATCH_ROWS)
+    skipped: Dict[str, int] = {}
+    files = points = 0
+    after = ""
+    while True:
+        rows = snip_conn.execute(
+            f"SELECT {_MIGRATE_COLUMNS} FROM chunks WHERE path > ? ORDER BY path LIMIT ?", (after, size)
+        ).fetchall()
+        if not rows:
+            break
+        after = rows[-1][1]
+        if len(rows) == size:
+            # The page may end inside a file: read that file whole; the next page starts after it.
+            rows = [r for r in rows if r[1] != after]
+            rows += snip_conn.execute(f"SELECT {_MIGRATE_COLUMNS} FROM chunks WHERE path = ?", (after,)).fetchall()
+        by_path: Dict[str, List[Tuple[Any, ...]]] = {}
+        for r in rows:
+            by_path.setdefault(r[1], []).append(r)
+        ready: List[List[Tuple[Any, ...]]] = []
+        for group in by_path.values():
+            group.sort(key=lambda r: r[2])
+            stats.incr("files_seen")
+            reason = migration_skip_reason(conn, cfg_hash, group)
+            if reason:
+                skipped[reason] = skipped.get(reason, 0) + 1
+                stats.incr("skipped")
+                continue
+            ready.append(group)
+        if not ready:
+            continue
+
+        vectors, _errs = embed_texts(provider, [r[8] for group in ready for r in group], cache)
+        batch: List[Dict[str, Any]] = []
+        snippet_rows: List[Tuple[Any, ...]] = []
+        done: List[str] = []
+        now_ts = int(time.time())
+        pos = 0
+        for group in ready:
+            vecs = vectors[pos:pos + len(group)]
+            pos += len(group)
+            if any(v is None for v in vecs):
+                stats.incr("embed_errors")
+                stats.incr("skipped")
+                skipped["embed_failed"] = skipped.get("embed_failed", 0) + 1
+                continue
+            for (pid, path, chunk_index, chunk_total, mtime, fsize, source, _cfg, text), vec in zip(group, vecs):
+                payload = point_payload(path, fsize, mtime, source, chunk_index, chunk_total, text)
+                batch.append({"id": pid, "vector": vec, "payload": payload})
+                snippet_rows.append((cfg_hash, payload["text_hash"], now_ts, pid))
+            done.append(group[0][1])
+        for i in range(0, len(batch), max(1, BATCH_SIZE)):
+            upsert_batch(batch[i:i + max(1, BATCH_SIZE)])
+        # Snippets first: a crash in between leaves rows that still pass migration_skip_reason on the next try.
+        snip_conn.executemany("UPDATE chunks SET cfg_hash = ?, text_hash = ?, updated_at = ? WHERE point_id = ?", snippet_rows)
+        snip_conn.commit()
+        conn.executemany("UPDATE file_state SET cfg_hash = ?, updated_at = ? WHERE path = ?", [(cfg_hash, now_ts, p) for p in done])
+        conn.commit()
+        files += len(done)
+        points += len(batch)
+        stats.incr("files_indexed", len(done))
+        stats.incr("points_indexed", len(batch))
+        log(f"migrate_progress files={files} points={points} last_path={after}")
+
+    # Duplicates and near-duplicates have no points of their own: they follow their canonical.
+    aliases = conn.execute(
+        "UPDATE file_state SET cfg_hash = ? WHERE cfg_hash != ? AND complete = 1 AND text_hash LIKE 'near:%' "
+        "AND substr(text_hash, 6) IN (SELECT path FROM file_state WHERE cfg_hash = ? AND complete = 1)",
+        (cfg_hash, cfg_hash, cfg_hash),
+    ).rowcount
+    aliases += conn.execute(
+        "UPDATE file_state SET cfg_hash = ? WHERE cfg_hash != ? AND complete = 1 AND text_hash IN "
+        "(SELECT c.sig FROM content_sig c JOIN file_state f ON f.path = c.path WHERE f.cfg_hash = ? AND f.complete = 1)",
+        (cfg_hash, cfg_hash, cfg_hash),
+    ).rowcount
+    conn.commit()
+    log(f"migrate_done files={files} points={points} aliases={aliases} skipped={json.dumps(skipped, sort_keys=True)}")
+    return {
+        "files_migrated": files,
+        "points_migrated": points,
+        "aliases_migrated": aliases,
+        "skipped": skipped,
+        "seconds": round(time.time() - t0, 2),
+    }
+
+
+def main() -> int:
+    roots = DEFAULT_ROOTS
+    if len(sys.argv) > 1:
+        roots = sys.argv[1:]
+
+    provider = choose_provider()
+    if provider not in ("openai", "ollama"):
+        raise RuntimeError(f"Unsupported embedding provider: {provider}")
+
+    live = ""
+    if ALIAS:
+        wait_for_qdrant()
+        live = use_alias_build_target()
+
+    # state db for incremental indexing
+    conn = ensure_state_db()
+    snip_conn = ensure_snippets_db()
+    cfg_hash = run_config_hash(provider)
+    prev_cfg = get_meta(conn, "run_cfg_hash")
+    prev_cfg_json = get_meta(conn, "run_cfg")
+    if SLIM_PAYLOAD and snip_conn is None:
+        raise RuntimeError("QDRANT_SLIM_PAYLOAD=1 keeps previews only in the snippets DB: enable QDRANT_SNIPPETS_ENABLED")
+    if SHARED_CHUNKS and snip_conn is None:
+        raise RuntimeError("QDRANT_SHARED_CHUNKS=1 keeps the paths of shared chunks in the snippets DB: enable QDRANT_SNIPPETS_ENABLED")
+    if MIGRATE_FROM_SNIPPETS:
+        # Fail before any embedding work (and before recording the new config) if the snippets DB cannot stand in for the files.
+        check_migration_source(snip_conn, json.loads(prev_cfg_json) if prev_cfg_json else None, run_config(provider))
+    if prev_cfg != cfg_hash:
+        log("Run config changed; files will be reprocessed as needed.")
+        set_meta(conn, "run_cfg_hash", cfg_hash)
+    if prev_cfg != cfg_hash or prev_cfg_json is None:
+        set_meta(conn, "run_cfg", json.dumps(run_config(provider), sort_keys=True))
+        conn.commit()
+
+    cache = open_embed_cache(provider)
+    global VECTOR_SIZE
+    if VECTOR_SIZE == 0:
+        sample = "Dropbox semantic index bootstrap"
+        vecs, errs = embed_texts(provider, [sample], cache)
+        if vecs[0] is None:
+            raise RuntimeError(f"Failed to compute vector size: {errs[0]}")
+        vec0 = vecs[0]
+        VECTOR_SIZE = len(vec0)
+        log(f"Detected vector size: {VECTOR_SIZE} ({provider})")
+
+    wait_for_qdrant()
+    ensure_collection(COLLECTION)
+    create_payload_indexes()
+
+    effective_batch_size = max(1, max(BATCH_SIZE, MAX_CHUNKS_PER_FILE))
+    stats = RunStats()
+    t0 = time.time()
+
+    # No pre-count walk: the previous run's file count (if any) serves as the progress estimate.
+    total_files_est = int(get_meta(conn, "last_total_files") or 0)
+    run_id = uuid.uuid4().hex
+    log(
+        f"Starting index. run_id={run_id} provider={provider} total_files_est={total_files_est} collection={COLLECTION} "
+        f"pipeline={int(PIPELINE or EXTRACT_WORKERS > 0)} extract_workers={EXTRACT_WORKERS}"
+    )
+    audit = AuditLog(AUDIT_PATH)
+    upsert_ctl = enable_adaptive(effective_batch_size) if ADAPTIVE else None
+    writer = BatchWriter(conn, snip_conn, cfg_hash, run_id, audit, stats, effective_batch_size, UPSERT_INFLIGHT, upsert_ctl)
+
+    accumulator = new_embed_accumulator(provider, cache)
+    if not NEAR_DUP:
+        # Aliases from an earlier QDRANT_NEAR_DUP=1 run have no points of their own: index them now.
+        released = conn.execute(
+            "UPDATE file_state SET complete = 0, last_error = 'near_dup_disabled' WHERE complete = 1 AND text_hash LIKE 'near:%'"
+        ).rowcount
+        conn.commit()
+        if released:
+            log(f"near_dup_released aliases={released}")
+    state_index: Optional[StateIndex] = None
+    if (STATE_PRELOAD or PRUNE) and not MIGRATE_FROM_SNIPPETS:
+        t_load = time.time()
+        state_index = load_state_index(conn, cfg_hash)
+        log(f"state_preload rows={len(state_index.fingerprints)} sidecars={len(state_index.sidecars)} seconds={round(time.time() - t_load, 2)}")
+    if NEAR_DUP:
+        global NEAR_DUP_INDEX
+        NEAR_DUP_INDEX = load_near_dup_index(conn)
+        log(f"near_dup_preload canonicals={len(NEAR_DUP_INDEX.sigs)}")
+    # Start watching before the catch-up walk so changes made while it runs are not missed.
+    watcher = open_watcher(roots) if WATCH and not MIGRATE_FROM_SNIPPETS else None
+    pipeline_report: Optional[Dict[str, Any]] = None
+    migrate_report: Optional[Dict[str, Any]] = None
+    if MIGRATE_FROM_SNIPPETS:
+        migrate_report = migrate_from_snippets(conn, snip_conn, provider, cfg_hash, cache, stats)
+    elif PIPELINE or EXTRACT_WORKERS > 0:
+        extract_pool = ExtractPool(EXTRACT_WORKERS, EXTRACT_TIMEOUT_SECONDS) if EXTRACT_WORKERS > 0 else None
+        try:
+            pipeline_report = run_pipeline(
+                roots, provider, cfg_hash, writer, cache, stats, extract_pool, accumulator, state_index, total_files_est
+            )
+        finally:
+            if extract_pool is not None:
+                extract_pool.close()
+    else:
+        run_sequential(conn, roots, provider, cfg_hash, writer, cache, stats, accumulator, state_index, total_files_est)
+    writer.flush()
+    # files_seen covers the whole tree unless QDRANT_MAX_FILES cut the walk short.
+    total_files = stats.get("files_seen") if not MAX_FILES else max(total_files_est, stats.get("files_seen"))
+    prune_report: Optional[Dict[str, Any]] = None
+    if not MAX_FILES and not MIGRATE_FROM_SNIPPETS:
+        set_meta(conn, "last_total_files", str(total_files))
+        if PRUNE and state_index is not None:
+            prune_report = sweep_deleted(conn, snip_conn, roots, state_index, stats)
+            log(f"prune candidates={prune_report['candidates']} pruned={prune_report['pruned']}")
+    shared_gc = 0
+    if SHARED_CHUNKS and snip_conn is not None:
+        try:
+            shared_gc = gc_shared_points(snip_conn)
+        except Exception as e:
+            log(f"shared_gc_error err={e}")
+        writer.recent_hashes.clear()
+    if ALIAS and not live:
+        # First build behind this alias: there is nothing to compare it with, so searches use it right away.
+        switch_alias(ALIAS, COLLECTION)
+        live = COLLECTION
+        log(f"alias_created alias={ALIAS} collection={COLLECTION}")
+    elif ALIAS and live != COLLECTION:
+        log(f"alias_unchanged alias={ALIAS} live={live} built={COLLECTION} (evaluate, then switch with qdrant_alias.py)")
+    if watcher is not None:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            run_watch(watcher, conn, roots, provider, cfg_hash, writer, cache, stats, accumulator, stop)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        if accumulator is not None:
+            for ready in accumulator.flush():
+                writer.commit_file(ready)
+        writer.flush()
 
     dt = time.time() - t0
+    writer.close()
     audit.close()
+    cache.close()
+    HTTP_POOL.close()
     try:
         conn.commit()
         conn.close()
@@ -1553,26 +4522,52 @@ def main() -> int:
             snip_conn.close()
     except Exception:
         pass
+    c = stats.counts
     log(
         "Completed index. "
-        f"files_seen={files_seen} files_indexed={files_indexed} "
-        f"points_indexed={points_indexed} skipped={skipped} "
-        f"skipped_incremental={skipped_incremental} skipped_dedup={skipped_dedup} "
-        f"embed_errors={embed_errors} total_files={total_files} seconds={round(dt,2)}"
+        f"files_seen={c['files_seen']} files_indexed={c['files_indexed']} "
+        f"points_indexed={c['points_indexed']} skipped={c['skipped']} "
+        f"skipped_incremental={c['skipped_incremental']} skipped_dedup={c['skipped_dedup']} "
+        f"embed_errors={c['embed_errors']} total_files={total_files} seconds={round(dt,2)}"
     )
-    print(json.dumps({
-        "points_indexed": points_indexed,
-        "files_seen": files_seen,
-        "files_indexed": files_indexed,
-        "skipped": skipped,
-        "skipped_incremental": skipped_incremental,
-        "skipped_dedup": skipped_dedup,
-        "embed_errors": embed_errors,
+    summary: Dict[str, Any] = {
+        "points_indexed": c["points_indexed"],
+        "files_seen": c["files_seen"],
+        "files_indexed": c["files_indexed"],
+        "skipped": c["skipped"],
+        "skipped_incremental": c["skipped_incremental"],
+        "skipped_dedup": c["skipped_dedup"],
+        "embed_errors": c["embed_errors"],
+        "chunks_reused": c["chunks_reused"],
+        "files_moved": c["files_moved"],
+        "skipped_near_dup": c.get("skipped_near_dup", 0),
+        "pdf_pages_cached": c.get("pdf_pages_cached", 0),
         "total_files": total_files,
         "seconds": round(dt, 2),
         "collection": COLLECTION,
         "qdrant": QDRANT_URL,
-    }))
+    }
+    summary["embed_requests"] = EMBED_COUNTERS.snapshot()
+    summary["http"] = HTTP_POOL.counters.snapshot()
+    if accumulator is not None:
+        summary["embed_accumulator"] = accumulator.report()
+    if DEDUP_EMBEDDINGS:
+        summary["embed_cache"] = cache.report()
+    if pipeline_report is not None:
+        summary["pipeline"] = pipeline_report
+    if ADAPTIVE:
+        summary["adaptive"] = adaptive_report(upsert_ctl)
+    if prune_report is not None:
+        summary["prune"] = prune_report
+    if migrate_report is not None:
+        summary["migrate"] = migrate_report
+    if SHARED_CHUNKS:
+        summary["shared_chunks"] = {"chunks_shared": c.get("chunks_shared", 0), "shared_points_deleted": shared_gc}
+    if ALIAS:
+        summary["alias"] = {"alias": ALIAS, "live": live, "collection": COLLECTION}
+    if UPSERT_INFLIGHT:
+        summary["upserts"] = writer.report()
+    print(json.dumps(summary))
     return 0
 
 
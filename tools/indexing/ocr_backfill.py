@@ -6,10 +6,15 @@ import hashlib
 import shutil
 import sqlite3
 import subprocess
+import sys
 import tempfile
 from pathlib import Path
 from typing import List, Tuple, Optional
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import index_dropbox_qdrant as idx  # noqa: E402
+
 
 STATE_DB = os.environ.get(
     "QDRANT_STATE_DB",
@@ -121,6 +126,31 @@ def pdf_page_count(path: Path) -> int:
     return 0
 
 
+def cached_pdf_page_count(conn: sqlite3.Connection, path: Path) -> int:
+    # The indexer caches page counts by content signature; pdfinfo only runs on a miss (and fills the cache).
+    try:
+        sig = idx.compute_file_sig(path, path.stat().st_size)
+    except OSError:
+        sig = ""
+    if sig:
+        try:
+            row = conn.execute("SELECT pages FROM pdf_pages WHERE sig = ?", (sig,)).fetchone()
+        except sqlite3.Error:
+            row = None  # state DB from an indexer without the cache
+        if row and row[0]:
+            return int(row[0])
+    pages = pdf_page_count(path)
+    if sig and pages > 0:
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO pdf_pages (sig, pages, seen_at) VALUES (?, ?, ?)",
+                (sig, pages, int(time.time())),
+            )
+        except sqlite3.Error:
+            pass
+    return pages
+
+
 def tesseract_image(image_path: Path) -> str:
     if not cmd_exists("tesseract"):
         raise RuntimeError("tesseract_not_found")
@@ -134,10 +164,10 @@ def tesseract_image(image_path: Path) -> str:
     return out
 
 
-def ocr_pdf(path: Path) -> str:
+def ocr_pdf(path: Path, conn: Optional[sqlite3.Connection] = None) -> str:
     if not cmd_exists("pdftoppm"):
         raise RuntimeError("pdftoppm_not_found")
-    pages = pdf_page_count(path)
+    pages = cached_pdf_page_count(conn, path) if conn is not None else pdf_page_count(path)
     if pages <= 0:
         pages = 1
     idxs0 = page_sample_indices(pages, OCR_MAX_PAGES)
@@ -224,8 +254,15 @@ def ocr_image(path: Path) -> str:
     return tesseract_image(path)
 
 
+def state_db_path() -> str:
+    # With QDRANT_ALIAS the indexer keeps one state DB per collection: work on the queue it writes to.
+    if not os.environ.get("QDRANT_ALIAS"):
+        return STATE_DB
+    return idx.resolve_collection_dbs()[1]
+
+
 def db_connect() -> sqlite3.Connection:
-    db_path = Path(STATE_DB)
+    db_path = Path(state_db_path())
     db_path.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(str(db_path), timeout=30)
     try:
@@ -291,7 +328,7 @@ def main() -> int:
 
             text = ""
             if ext.lower() == ".pdf":
-                text = ocr_pdf(path)
+                text = ocr_pdf(path, conn)
             else:
                 text = ocr_image(path)
             text = (text or "").strip()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Show or switch the Qdrant alias that searches use (QDRANT_ALIAS, see the README's blue/green section).
+
+  qdrant_alias.py show                     live target and every collection, with point counts
+  qdrant_alias.py switch <collection>      atomically point the alias at <collection>
+
+Rolling back is a switch to the previous collection; `switch` prints it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import index_dropbox_qdrant as idx  # noqa: E402
+
+
+def collection_info(name: str) -> Dict[str, Any]:
+    res = idx.qdrant_get(f"/collections/{name}").get("result", {})
+    vectors = res.get("config", {}).get("params", {}).get("vectors", {})
+    return {"points": int(res.get("points_count") or 0), "vector_size": vectors.get("size"), "status": res.get("status")}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Blue/green alias management for the Dropbox Qdrant index")
+    ap.add_argument("--alias", default=idx.ALIAS, help="alias name (default: QDRANT_ALIAS)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("show")
+    sw = sub.add_parser("switch")
+    sw.add_argument("collection")
+    sw.add_argument("--force", action="store_true", help="switch even if the collection is empty or still indexing")
+    args = ap.parse_args()
+    if not args.alias:
+        print("Set QDRANT_ALIAS or pass --alias.")
+        return 2
+
+    live = idx.qdrant_aliases().get(args.alias, "")
+    if args.cmd == "show":
+        names = sorted(c["name"] for c in idx.qdrant_get("/collections").get("result", {}).get("collections", []))
+        print(json.dumps({"alias": args.alias, "live": live}))
+        for name in names:
+            print(json.dumps({"collection": name, "live": name == live, **collection_info(name)}))
+        return 0
+
+    if args.collection == live:
+        print(json.dumps({"alias": args.alias, "from": live, "to": live, "changed": False}))
+        return 0
+    info = collection_info(args.collection)
+    if not args.force and (info["points"] == 0 or info["status"] not in ("green", None)):
+        print(f"Refusing to switch to '{args.collection}' ({info}); pass --force to override.")
+        return 1
+    if live and not args.force:
+        live_size = collection_info(live)["vector_size"]
+        if live_size != info["vector_size"]:
+            # Searches embed queries with the configured model: it has to match the new collection.
+            print(f"Note: vector size changes {live_size} -> {info['vector_size']}; update the search tools' embedding model.")
+    prev = idx.switch_alias(args.alias, args.collection)
+    print(json.dumps({"alias": args.alias, "from": prev, "to": args.collection, "changed": True, "rollback": prev}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
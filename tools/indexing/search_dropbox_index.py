@@ -12,7 +12,9 @@ from urllib.parse import urlencode
 
 QDRANT_URL = os.environ.get("QDRANT_URL", "http://127.0.0.1:6333")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY") or os.environ.get("QDRANT_APIKEY")
-COLLECTION = os.environ.get("QDRANT_COLLECTION", "dropbox_semantic_index")
+ALIAS = os.environ.get("QDRANT_ALIAS", "")
+# An explicit collection wins (e.g. to try a rebuild); otherwise search through the alias.
+COLLECTION = os.environ.get("QDRANT_COLLECTION") or ALIAS or "dropbox_semantic_index"
 
 SNIPPETS_DB = os.environ.get(
     "QDRANT_SNIPPETS_DB",
@@ -26,6 +28,12 @@ OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "nomic-embed-text")
 OLLAMA_EMBED_ENDPOINT = os.environ.get("OLLAMA_EMBED_ENDPOINT", "/api/embed")
 
+# Search-time settings for quantized collections (QDRANT_STORAGE_PROFILE=sq8|binary) and HNSW recall.
+SEARCH_HNSW_EF = int(os.environ.get("QDRANT_SEARCH_HNSW_EF", "0"))  # 0 = collection default
+SEARCH_OVERSAMPLING = float(os.environ.get("QDRANT_SEARCH_OVERSAMPLING", "0"))  # 0 = Qdrant default
+SEARCH_RESCORE = os.environ.get("QDRANT_SEARCH_RESCORE", "1") != "0"
+SEARCH_EXPAND_MAX = int(os.environ.get("QDRANT_SEARCH_EXPAND_MAX", "20"))  # files listed per shared chunk hit
+
 HTTP_CONNECT_TIMEOUT = float(os.environ.get("INDEX_HTTP_CONNECT_TIMEOUT", "3"))
 HTTP_MAX_TIME = float(os.environ.get("INDEX_HTTP_MAX_TIME", "60"))
 
@@ -143,12 +151,32 @@ def embed_query(text: str) -> List[float]:
     raise RuntimeError(f"Unsupported provider: {provider}")
 
 
+# Payload fields a search needs; slim collections (QDRANT_SLIM_PAYLOAD=1) have no preview and rely on the snippets DB.
+# Shared chunk points (QDRANT_SHARED_CHUNKS=1) carry no path, only the text_hash the snippets DB maps to files.
+RESULT_PAYLOAD_FIELDS = ["path", "chunk_index", "chunk_total", "archive_member", "preview", "shared", "text_hash"]
+
+
+def search_params() -> Dict[str, Any]:
+    params: Dict[str, Any] = {}
+    if SEARCH_HNSW_EF > 0:
+        params["hnsw_ef"] = SEARCH_HNSW_EF
+    if SEARCH_OVERSAMPLING > 0 or not SEARCH_RESCORE:
+        quant: Dict[str, Any] = {"rescore": SEARCH_RESCORE}
+        if SEARCH_OVERSAMPLING > 0:
+            quant["oversampling"] = SEARCH_OVERSAMPLING
+        params["quantization"] = quant
+    return params
+
+
 def qdrant_vector_search(vec: List[float], limit: int) -> List[Dict[str, Any]]:
-    payload = {
+    payload: Dict[str, Any] = {
         "vector": vec,
         "limit": int(limit),
-        "with_payload": True,
+        "with_payload": RESULT_PAYLOAD_FIELDS,
     }
+    params = search_params()
+    if params:
+        payload["params"] = params
     res = http_json(
         "POST",
         f"{QDRANT_URL}/collections/{COLLECTION}/points/search{qdrant_params()}",
@@ -158,8 +186,23 @@ def qdrant_vector_search(vec: List[float], limit: int) -> List[Dict[str, Any]]:
     return res.get("result", []) or []
 
 
-def snippets_connect() -> Optional[sqlite3.Connection]:
+def snippets_db_path() -> str:
+    # With QDRANT_ALIAS the indexer keeps one snippets DB per versioned collection: use the one behind COLLECTION.
+    if not ALIAS or "QDRANT_SNIPPETS_DB" in os.environ:
+        return SNIPPETS_DB
+    collection = COLLECTION
+    try:
+        res = http_json("GET", f"{QDRANT_URL}/aliases", headers=qdrant_headers())
+        aliases = {a["alias_name"]: a["collection_name"] for a in res.get("result", {}).get("aliases", [])}
+        collection = aliases.get(COLLECTION, COLLECTION)
+    except Exception:
+        pass
     p = Path(SNIPPETS_DB)
+    return str(p.with_name(f"{p.stem}.{collection}{p.suffix}"))
+
+
+def snippets_connect() -> Optional[sqlite3.Connection]:
+    p = Path(snippets_db_path())
     if not p.exists():
         return None
     conn = sqlite3.connect(str(p), timeout=30)
@@ -187,6 +230,51 @@ def snippets_by_point_ids(conn: sqlite3.Connection, point_ids: List[str]) -> Dic
     return out
 
 
+def expand_shared(conn: sqlite3.Connection, results: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    One shared chunk hit -> one result per file containing that text, all with the hit's score. A hit expands
+    to at most QDRANT_SEARCH_EXPAND_MAX files and leaves a slot of the `limit` for every hit ranked below it,
+    so one boilerplate chunk cannot crowd out the rest of the page.
+    """
+    out: List[Dict[str, Any]] = []
+    seen: set = set()
+    for i, r in enumerate(results):
+        if len(out) >= limit:
+            break
+        payload = r.get("payload") or {}
+        if not payload.get("shared"):
+            if str(r.get("id")) not in seen:
+                seen.add(str(r.get("id")))
+                out.append(r)
+            continue
+        h = str(payload.get("text_hash") or "")
+        total = conn.execute("SELECT COUNT(*) FROM chunks WHERE text_hash = ?", (h,)).fetchone()[0]
+        later = min(len(results) - i - 1, limit - len(out) - 1)  # slots kept for the hits ranked below
+        cur = conn.execute(
+            "SELECT point_id, path, chunk_index, chunk_total FROM chunks WHERE text_hash = ? ORDER BY path LIMIT ?",
+            (h, max(1, min(SEARCH_EXPAND_MAX, limit - len(out) - later))),
+        )
+        for pid, path, chunk_index, chunk_total in cur.fetchall():
+            if str(pid) in seen:
+                continue
+            seen.add(str(pid))
+            out.append(
+                {
+                    "id": str(pid),
+                    "payload": {
+                        "path": path,
+                        "chunk_index": int(chunk_index or 0),
+                        "chunk_total": int(chunk_total or 0),
+                        "preview": payload.get("preview") or "",
+                    },
+                    "score": r.get("score"),
+                    "source": r.get("source"),
+                    "shared_files": int(total),
+                }
+            )
+    return out
+
+
 def fts_search(conn: sqlite3.Connection, query: str, limit: int) -> List[Dict[str, Any]]:
     # Prefer FTS (if present), else fall back to LIKE on chunks.text.
     has_fts = False
@@ -305,6 +393,8 @@ def main() -> int:
             r["source"] = "vector"
 
     snip_conn = snippets_connect()
+    if snip_conn is not None and vec_results:
+        vec_results = expand_shared(snip_conn, vec_results, max(10, limit))
     fts_results: List[Dict[str, Any]] = []
     if (mode_fts or mode_hybrid) and snip_conn is not None:
         fts_results = fts_search(snip_conn, query, limit=max(10, limit))
@@ -342,18 +432,19 @@ def main() -> int:
         preview = (payload.get("preview") or "").replace("\n", " ").strip()
         if len(preview) > 200:
             preview = preview[:200] + "..."
-        print(
-            json.dumps(
-                {
-                    "score": score,
-                    "path": path,
-                    "chunk_index": chunk_index,
-                    "preview": preview,
-                    "source": r.get("source"),
-                    "rrf_score": r.get("rrf_score"),
-                }
-            )
-        )
+        row = {
+            "score": score,
+            "path": path,
+            "chunk_index": chunk_index,
+            "preview": preview,
+            "source": r.get("source"),
+            "rrf_score": r.get("rrf_score"),
+        }
+        if payload.get("archive_member"):
+            row["archive_member"] = payload["archive_member"]
+        if r.get("shared_files"):
+            row["shared_files"] = r["shared_files"]
+        print(json.dumps(row))
     return 0
 
 
@@ -2,7 +2,9 @@
 from __future__ import annotations
 
 import argparse
+import os
 import sqlite3
+import sys
 from pathlib import Path
 from typing import Iterable, Sequence
 
@@ -51,12 +53,22 @@ def _fmt_pct(done: int, total: int) -> str:
     return f"{(done / total) * 100:.3f}%"
 
 
+def _default_db() -> str:
+    # The indexer's state DB for this environment; per collection under QDRANT_ALIAS.
+    if os.environ.get("QDRANT_ALIAS"):
+        sys.path.insert(0, str(Path(__file__).resolve().parent))
+        import index_dropbox_qdrant as idx
+
+        return idx.resolve_collection_dbs()[1]
+    return os.environ.get("QDRANT_STATE_DB", str(Path.cwd() / ".cache" / "qdrant_dropbox_state.sqlite"))
+
+
 def main(argv: Sequence[str] | None = None) -> int:
     p = argparse.ArgumentParser(description="Show Dropbox->Qdrant index status from the SQLite state DB.")
     p.add_argument(
         "--db",
-        default=str(Path.cwd() / ".cache" / "qdrant_dropbox_state.sqlite"),
-        help="Path to SQLite state DB (default: ./.cache/qdrant_dropbox_state.sqlite)",
+        default="",
+        help="Path to SQLite state DB (default: the indexer's, from QDRANT_STATE_DB / QDRANT_ALIAS, else ./.cache/qdrant_dropbox_state.sqlite)",
     )
     p.add_argument(
         "--windows",
@@ -66,7 +78,7 @@ def main(argv: Sequence[str] | None = None) -> int:
     )
     args = p.parse_args(list(argv) if argv is not None else None)
 
-    db = Path(str(args.db)).expanduser()
+    db = Path(str(args.db or _default_db())).expanduser()
     if not db.exists():
         raise SystemExit(f"State DB not found: {db}")
 